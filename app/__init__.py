@@ -1,12 +1,13 @@
 from flask import Flask, jsonify, request
 from app.core.config import Config
-from app.core.database import db
+from app.core.database import db, add_missing_columns
 from app.core.logger import setup_logger, logger
 from app.core.extensions import init_extensions
 from app.api.proxy import proxy_bp
 from app.api.admin import admin_bp
 from app.api.polygon import polygon_bp
 from app.api.health import health_bp
+from app.api.metrics import metrics_bp
 
 
 def create_app(config=None):
@@ -29,7 +30,13 @@ def create_app(config=None):
         
         # 5. 导入模型以触发自动创建
         from app.models.api_key import APIKey
-        from app.models.polygon_task import PolygonTask
+        from app.models.polygon_task import PolygonTask, migrate_progress_data
+        from app.models.polygon_task_progress import PolygonTaskProgress
+        from app.models.key_ledger import KeyLedgerEntry
+
+        # 已有的表补上新增的列，旧任务的JSON进度迁移到进度表
+        add_missing_columns(PolygonTask)
+        migrate_progress_data()
         
         # 6. 初始化扩展（包括任务执行器）
         init_extensions(app)
@@ -39,6 +46,7 @@ def create_app(config=None):
     app.register_blueprint(admin_bp, url_prefix='/admin')
     app.register_blueprint(polygon_bp, url_prefix='/api/polygon')
     app.register_blueprint(health_bp, url_prefix='/health')
+    app.register_blueprint(metrics_bp, url_prefix='/metrics')
 
     
     # 8. 全局错误处理
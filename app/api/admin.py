@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify, render_template
 from app.models.api_key import APIKey
 from app.core.database import db
+from app.services.key_manager import KeyManager
+from app.core.extensions import response_cache, request_coalescer, upstream_client
 import logging
 
 logger = logging.getLogger(__name__)
@@ -27,6 +29,7 @@ def list_keys():
         'is_active': key.is_active,
         'description': key.description,
         'last_reset': key.last_reset.isoformat() if key.last_reset else None,
+        'health': KeyManager.get_health(key.id),
         'search_usage': {
             'keyword': {
                 'used': key.keyword_search_used,
@@ -46,6 +49,27 @@ def list_keys():
         }
     } for key in keys])
 
+@admin_bp.route('/cache', methods=['GET'])
+def cache_stats():
+    """获取响应缓存的命中统计"""
+    return jsonify(response_cache.get_stats())
+
+@admin_bp.route('/cache', methods=['DELETE'])
+def clear_cache():
+    """清空响应缓存"""
+    response_cache.clear()
+    return jsonify({'message': 'Cache cleared successfully'})
+
+@admin_bp.route('/coalescing', methods=['GET'])
+def coalescing_stats():
+    """获取并发相同请求的合并统计"""
+    return jsonify(request_coalescer.get_stats())
+
+@admin_bp.route('/upstream', methods=['GET'])
+def upstream_stats():
+    """获取各上游IP的延迟和健康状态"""
+    return jsonify(upstream_client.get_stats())
+
 @admin_bp.route('/keys', methods=['POST'])
 def add_key():
     """添加新key"""
@@ -58,6 +82,7 @@ def add_key():
         )
         db.session.add(key)
         db.session.commit()
+        KeyManager.sync_key(key)
         return jsonify({
             'id': key.id,
             'key': key.masked_key,
@@ -97,6 +122,7 @@ def update_key(key_id):
             key.description = data['description']
             
         db.session.commit()
+        KeyManager.sync_key(key)
         return jsonify({
             'message': 'Key updated successfully',
             'key': {
@@ -135,6 +161,7 @@ def delete_key(key_id):
         key = APIKey.query.get_or_404(key_id)
         db.session.delete(key)
         db.session.commit()
+        KeyManager.remove_key(key_id)
         return jsonify({'message': 'Key deleted successfully'})
     except Exception as e:
         logger.error(f"Failed to delete key: {str(e)}")
@@ -180,6 +207,7 @@ def update_key_limits(key_id):
             key.polygon_qps_limit = limits['polygon_qps_limit']
             
         db.session.commit()
+        KeyManager.sync_key(key)
         return jsonify({'message': 'Limits updated successfully'})
     except Exception as e:
         logger.error(f"Failed to update key limits: {str(e)}")
@@ -0,0 +1,255 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+import httpx
+from app.core.extensions import key_pool, response_cache, metrics
+from app.core.logger import logger
+from app.services.key_manager import KeyManager
+from app.services.response_cache import ResponseCache
+from app.services.retry_plan import RetryPlan
+from app.services.search_client import (SEARCH_ENDPOINTS, UpstreamResult, give_up, handle_response,
+                                       upstream_failed)
+
+
+class AsyncSingleFlight:
+    """SingleFlight 的协程版本
+
+    同一事件循环内并发的相同请求共享 leader 的 Future；等待超过 max_wait 秒
+    或 leader 被取消（客户端断开）时，等待者自行执行一次。
+    """
+
+    def __init__(self, enabled: bool = True, max_wait: float = 60):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self.enabled = enabled
+        self.max_wait = max_wait
+        self.stats = {
+            'leaders': 0,
+            'shared': 0,
+            'timeouts': 0
+        }
+
+    async def do(self, key: str, func: Callable[[], Awaitable]) -> Tuple[object, bool]:
+        """执行或加入对 key 的调用
+
+        Returns:
+            (结果, 是否共享了其他请求的结果)
+        """
+        future = self._calls.get(key)
+        if future is None:
+            future = self._calls[key] = asyncio.get_running_loop().create_future()
+            self.stats['leaders'] += 1
+            try:
+                result = await func()
+                # 结果和异常都作为值传递，没有等待者时不会产生未读取异常的警告
+                future.set_result((result, None))
+                return result, False
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                future.set_result((None, e))
+                raise
+            finally:
+                self._calls.pop(key, None)
+
+        try:
+            result, error = await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except asyncio.TimeoutError:
+            self.stats['timeouts'] += 1
+            logger.warning(f"等待相同请求超时({self.max_wait}s), 改为单独请求: {key}")
+            return await func(), False
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                raise
+            return await func(), False
+
+        self.stats['shared'] += 1
+        if error is not None:
+            raise error
+        return result, True
+
+    def get_stats(self) -> Dict:
+        """合并统计"""
+        stats = dict(self.stats)
+        stats['in_flight'] = len(self._calls)
+        stats['enabled'] = self.enabled
+        return stats
+
+
+class AsyncProxy:
+    """/amap 搜索接口的异步实现（ASGI），由 app/asgi.py 的异步网关挂载
+
+    选key、等待QPS令牌和请求上游都在事件循环中完成，一个worker可以同时挂起大量
+    慢的上游请求而不必为每个请求占用一个线程。key池、熔断、缓存和额度记录与同步接口共用，
+    涉及数据库的操作（数据库账本、标记超限、禁用key）放到线程中执行。
+    """
+
+    PREFIX = '/amap/'
+
+    def __init__(self, app):
+        self.app = app
+        self.client: Optional[httpx.AsyncClient] = None
+        self.coalescer = AsyncSingleFlight(app.config['COALESCE_ENABLED'], app.config['COALESCE_MAX_WAIT'])
+
+    async def startup(self):
+        """创建上游连接池（需要在事件循环中调用）"""
+        config = self.app.config
+        limits = httpx.Limits(
+            max_connections=config['ASYNC_MAX_CONNECTIONS'],
+            max_keepalive_connections=config['ASYNC_MAX_CONNECTIONS'],
+            keepalive_expiry=config['UPSTREAM_KEEPALIVE_IDLE'] or None
+        )
+
+        def transport(proxy: Optional[str] = None) -> httpx.AsyncHTTPTransport:
+            return httpx.AsyncHTTPTransport(verify=False, limits=limits, proxy=proxy,
+                                            retries=config['UPSTREAM_RETRIES'])
+
+        mounts = None
+        if config.get('PROXY_ENABLED'):
+            mounts = {
+                'http://': transport(config.get('HTTP_PROXY')),
+                'https://': transport(config.get('HTTPS_PROXY'))
+            }
+        self.client = httpx.AsyncClient(
+            transport=transport(),
+            mounts=mounts,
+            timeout=config['REQUEST_TIMEOUT'] / 1000  # 转换为秒
+        )
+        logger.info(f"异步上游连接池已创建, 最大连接数: {config['ASYNC_MAX_CONNECTIONS']}, "
+                    f"代理: {'开启' if mounts else '关闭'}")
+
+    async def shutdown(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def handles(self, scope) -> bool:
+        """是否由异步接口处理（批量接口等其他请求仍交给 Flask）"""
+        path = scope['path']
+        return (scope['method'] == 'GET' and path.startswith(self.PREFIX)
+                and path[len(self.PREFIX):] in SEARCH_ENDPOINTS)
+
+    async def __call__(self, scope, receive, send):
+        """ASGI 入口"""
+        endpoint = scope['path'][len(self.PREFIX):]
+        search_type = SEARCH_ENDPOINTS[endpoint]
+        params = parse_qsl(scope['query_string'].decode('utf-8', errors='replace'), keep_blank_values=True)
+        request_headers = dict(scope['headers'])
+        cache_control = request_headers.get(b'cache-control', b'').decode('latin-1')
+        accept_encoding = request_headers.get(b'accept-encoding', b'').decode('latin-1')
+        use_cache = 'no-cache' not in cache_control
+
+        start_time = time.perf_counter()
+        try:
+            with self.app.app_context():
+                result, source = await self._search(endpoint, search_type, params, use_cache)
+        except Exception as e:
+            logger.error(f"Proxy request failed: {str(e)}")
+            result, source = UpstreamResult(500, data={
+                'status': '0',
+                'info': str(e),
+                'info_code': '1008612'
+            }), 'upstream'
+
+        with metrics.stage_seconds.time('serialization', search_type):
+            body, content_type, content_encoding = result.body(accept_encoding)
+        headers = [
+            (b'content-type', content_type.encode('latin-1')),
+            (b'content-length', str(len(body)).encode('latin-1'))
+        ]
+        if content_encoding:
+            headers.append((b'content-encoding', content_encoding.encode('latin-1')))
+        for name, value in result.headers(source):
+            headers.append((name.lower().encode('latin-1'), value.encode('latin-1')))
+        await send({'type': 'http.response.start', 'status': result.status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+        metrics.request_seconds.observe(time.perf_counter() - start_time, search_type, source)
+
+    async def _run(self, blocking: bool, func, *args):
+        """blocking 为真时在线程中（使用独立的应用上下文）执行 func"""
+        if not blocking:
+            return func(*args)
+
+        def call():
+            with self.app.app_context():
+                return func(*args)
+        return await asyncio.to_thread(call)
+
+    async def _search(self, endpoint: str, search_type: str, params: List[Tuple[str, str]],
+                      use_cache: bool = True) -> Tuple[UpstreamResult, str]:
+        """依次尝试缓存、合并中的相同请求和上游（同 SearchClient.search）"""
+        request_key = ResponseCache.make_key(endpoint, params)
+
+        cache_key = None
+        if response_cache.enabled:
+            cache_key = request_key
+            if use_cache:
+                cached = await self._run(bool(response_cache.cache_dir), response_cache.get, cache_key)
+                if cached:
+                    body, content_type = cached
+                    return UpstreamResult(200, content=body, content_type=content_type), 'cache'
+
+        def forward():
+            return self._forward(endpoint, search_type, dict(params), cache_key)
+        if self.coalescer.enabled:
+            result, shared = await self.coalescer.do(request_key, forward)
+            return result, 'coalesced' if shared else 'upstream'
+        return await forward(), 'upstream'
+
+    async def _forward(self, endpoint: str, search_type: str, args: dict,
+                       cache_key: str = None) -> UpstreamResult:
+        """选取key并请求上游，key超限、无效或被限流时换key重试（同 SearchClient._forward）"""
+        config = self.app.config
+        plan = RetryPlan(search_type, config['RETRY_MAX_ATTEMPTS'], config['RETRY_BUDGET'])
+        try:
+            while True:
+                with metrics.stage_seconds.time('key_selection', search_type), plan.timed('key_selection'):
+                    key = await KeyManager.get_available_key_async(search_type, exclude=plan.tried,
+                                                                   max_wait=plan.remaining())
+                if not key:
+                    return give_up(plan, f'No available API key for {search_type} search')
+                plan.start(key)
+                result = await self._attempt(endpoint, search_type, args, cache_key, key, plan)
+                if result is not None:
+                    if plan.attempts > 1:
+                        logger.info(f"{search_type} search finished after {plan.attempts} attempts")
+                    return plan.finish(result)
+                if not plan.can_retry():
+                    logger.warning(f"{search_type} search gave up after {plan.attempts} attempts")
+                    return give_up(plan, f'Retry limit reached for {search_type} search after {plan.attempts} attempts')
+        finally:
+            await self._run(plan.pending, plan.flush)
+
+    async def _attempt(self, endpoint: str, search_type: str, args: dict, cache_key: Optional[str],
+                       key, plan: RetryPlan) -> Optional[UpstreamResult]:
+        """用指定的key请求一次上游，key超限、无效或被限流需要换key时返回 None（同 SearchClient._attempt）"""
+        logger.info(f"Searching for {search_type} in {endpoint}, using key {key.masked_key},params: {args}")
+
+        # 数据库账本的额度操作会访问数据库
+        ledger_blocking = key_pool.ledger.blocking
+        consumed = False
+        try:
+            url = f"{self.app.config['AMAP_BASE_URL']}/{endpoint}"
+            params = dict(args)
+            params['key'] = key.key
+
+            start_time = time.time()
+            try:
+                response = await self.client.get(url, params=params)
+            except httpx.HTTPError as e:
+                upstream_failed(key, search_type, time.time() - start_time, e)
+                raise
+            outcome = handle_response(search_type, key, plan, cache_key, response.status_code, response.content,
+                                      response.headers, time.time() - start_time,
+                                      self.app.config['PROXY_PASSTHROUGH'])
+            for func, action_args, kind in outcome.actions:
+                if kind == 'ledger':
+                    await self._run(ledger_blocking, func, *action_args)
+                    consumed = outcome.consumed
+                else:
+                    await self._run(bool(response_cache.cache_dir), func, *action_args)
+            return outcome.result
+        finally:
+            if not consumed:
+                await self._run(ledger_blocking, KeyManager.release_key, key.id, search_type)
@@ -0,0 +1,36 @@
+import hmac
+import ipaddress
+from flask import Blueprint, Response, abort, current_app, request
+from app.core.extensions import metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+def _ip_allowed(remote_addr: str, allowed: str) -> bool:
+    """remote_addr 是否在 allowed（逗号分隔的IP或网段）之内"""
+    try:
+        address = ipaddress.ip_address(remote_addr)
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network.strip(), strict=False)
+               for network in allowed.split(',') if network.strip())
+
+
+@metrics_bp.route('', methods=['GET'])
+def export_metrics():
+    """Prometheus 格式的运行指标
+
+    指标包含各key的额度等信息，可以用 METRICS_ALLOWED_IPS 限制来源IP、用 METRICS_TOKEN 要求
+    Authorization: Bearer <token>；都不设置时需要在网络层（防火墙/反向代理）限制访问。
+    """
+    if not metrics.enabled:
+        abort(404)
+    allowed_ips = current_app.config.get('METRICS_ALLOWED_IPS')
+    if allowed_ips and not _ip_allowed(request.remote_addr or '', allowed_ips):
+        return Response('Forbidden', status=403)
+    token = current_app.config.get('METRICS_TOKEN')
+    if token:
+        scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(credentials.strip(), token):
+            return Response('Unauthorized', status=401, headers={'WWW-Authenticate': 'Bearer'})
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify, current_app, send_from_directory
 from app.services.polygon_crawler import PolygonCrawler
+from app.services.result_writer import result_mimetype
 from app.models.polygon_task import PolygonTask
+from app.models.polygon_task_progress import PolygonTaskProgress
 from app.core.database import db
 import os
 import logging
@@ -30,18 +32,23 @@ def create_task():
         # 获取优先级，默认为0
         priority = data.get('priority', 999)
 
-        task = PolygonCrawler.create_task(
-            task_id=data['task_id'],
-            name=data['name'],
-            polygon=data['polygon'],
-            priority=priority
-        )
+        try:
+            task = PolygonCrawler.create_task(
+                task_id=data['task_id'],
+                name=data['name'],
+                polygon=data['polygon'],
+                priority=priority,
+                result_format=data.get('format')
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
         return jsonify({
             'task_id': task.task_id,
             'name': task.name,
             'status': task.status,
-            'priority': task.priority
+            'priority': task.priority,
+            'result_file': task.result_file
         }), 201
 
     except Exception as e:
@@ -78,6 +85,8 @@ def list_tasks():
 
         # 添加分页
         paginated_tasks = query.paginate(page=page, per_page=per_page, error_out=False)
+        # 一次查询取出本页所有任务的进度计数
+        summaries = PolygonTaskProgress.summaries(task.id for task in paginated_tasks.items)
 
         return jsonify({
             'tasks': [{
@@ -86,7 +95,8 @@ def list_tasks():
                 'status': 'stalled' if task.is_stalled() else task.status,
                 'current_type': task.current_type,
                 'current_page': task.current_page,
-                'progress': task.progress,
+                'progress': summaries[task.id] or task.legacy_progress,
+                'total_progress': task.total_progress,
                 'created_at': task.created_at.isoformat(),
                 'updated_at': task.updated_at.isoformat(),
                 'priority': task.priority
@@ -142,10 +152,12 @@ def download_result(task_id):
         current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # app目录
         results_dir = os.path.join(current_dir, 'results')  # app/results
 
+        # 按存储的格式原样返回
         return send_from_directory(
             results_dir,
             task.result_file,
-            as_attachment=True
+            as_attachment=True,
+            mimetype=result_mimetype(task.result_file)
         )
 
     except Exception as e:
@@ -1,21 +1,17 @@
-from flask import Blueprint, request, jsonify, Response, current_app
+from flask import Blueprint, request, jsonify, Response, current_app, stream_with_context
+import json
 import requests
-from app.services.key_manager import KeyManager
+from app.core.extensions import metrics
+from app.services.search_client import SEARCH_ENDPOINTS, SearchClient
 from app.core.logger import logger
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # 禁用SSL警告
 requests.packages.urllib3.disable_warnings()
 
 proxy_bp = Blueprint('proxy', __name__)
 
-# 搜索服务的端点映射
-SEARCH_ENDPOINTS = {
-    'v3/place/text': 'keyword',      # 关键字搜索
-    'v3/place/around': 'around',     # 周边搜索
-    'v3/place/polygon': 'polygon'    # 多边形搜索
-}
-
 @proxy_bp.route('/<path:endpoint>', methods=['GET'])
 def proxy_request(endpoint):
     """代理高德地图API请求"""
@@ -29,72 +25,13 @@ def proxy_request(endpoint):
                 'info': 'Invalid endpoint'
             }), 400
 
-        # 获取可用的key
-        key = KeyManager.get_available_key(search_type)
-        if search_type == 'polygon':
-            time.sleep(1/key.polygon_qps_limit*1.5)
-        if not key:
-            return jsonify({
-                'status': '0',
-                'info': f'No available API key for {search_type} search',
-                'info_code': '1008611'
-            }), 503
-        logger.info(f"Searching for {search_type} in {endpoint}, using key {key.masked_key},params: {request.args}")
-        # 构建请求URL和参数
-        url = f"{current_app.config['AMAP_BASE_URL']}/{endpoint}"
-        params = dict(request.args)
-        params['key'] = key.key
-        
-        # 构建代理设置
-        proxies = None
-        if current_app.config['PROXY_ENABLED']:
-            proxies = {
-                'http': current_app.config['HTTP_PROXY'],
-                'https': current_app.config['HTTPS_PROXY']
-            }
-        
-        # 发送请求
-        response = requests.get(
-            url,
-            params=params,
-            proxies=proxies,
-            timeout=current_app.config['REQUEST_TIMEOUT'] / 1000,  # 转换为秒
-            verify=False
-        )
-        # 处理响应
-        if response.status_code == 200:
-            result = response.json()
-            
-            # 检查是否是搜索服务请求
-            search_type = SEARCH_ENDPOINTS.get(endpoint)
-            if search_type and result.get('infocode') == '10000':
-                # 增加对应搜索服务的使用次数
-                logger.info(f"Incrementing usage for {search_type} search")
-                KeyManager.increment_usage(key.id, search_type)
-                return jsonify(result)
-            else:
-                info = result.get('info', '')
-                if 'DAILY_QUERY_OVER_LIMIT' in info:
-                    # 标记key对应服务超出限额并重试
-                    if search_type:
-                        KeyManager.mark_daily_limit(key.id, search_type)
-                    return proxy_request(endpoint)
-                elif 'INVALID_USER_KEY' in info:
-                    # 禁用无效key并重试
-                    KeyManager.disable_key(key, reason=info)
-                    logger.warning(f"Key {key.masked_key} is invalid, reason: {info}")
-                    return proxy_request(endpoint)
-                return Response(
-                    result,
-                    status=400,
-                    content_type=response.headers['content-type']
-                )
-        else:
-            return Response(
-                response.content,
-                status=response.status_code,
-                content_type=response.headers['content-type']
-            )
+        start_time = time.perf_counter()
+        use_cache = 'no-cache' not in request.headers.get('Cache-Control', '')
+        result, source = SearchClient.search(endpoint, request.args.items(multi=True), use_cache)
+        with metrics.stage_seconds.time('serialization', search_type):
+            response = result.to_response(source, request.headers.get('Accept-Encoding', ''))
+        metrics.request_seconds.observe(time.perf_counter() - start_time, search_type, source)
+        return response
             
     except Exception as e:
         logger.error(f"Proxy request failed: {str(e)}")
@@ -104,3 +41,59 @@ def proxy_request(endpoint):
             'info_code': '1008612'
         }), 500
 
+
+@proxy_bp.route('/batch', methods=['POST'])
+def batch_request():
+    """批量搜索
+
+    请求体为 {"requests": [{"endpoint": "v3/place/text", "params": {...}, "id": 可选}, ...]}，
+    各查询并发执行（每个key仍受QPS限制），结果按完成顺序以 NDJSON 流式返回，每行一个查询。
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('requests') if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return jsonify({'status': '0', 'info': 'requests must be a list'}), 400
+    max_items = current_app.config['BATCH_MAX_ITEMS']
+    if len(items) > max_items:
+        return jsonify({'status': '0', 'info': f'Too many requests in batch (max {max_items})'}), 400
+
+    use_cache = 'no-cache' not in request.headers.get('Cache-Control', '')
+    app = current_app._get_current_object()
+
+    def run(index: int, item) -> dict:
+        line = {'index': index}
+        if not isinstance(item, dict):
+            line.update(status=400, data={'status': '0', 'info': 'Invalid request item'})
+            return line
+        line.update(id=item.get('id'), endpoint=item.get('endpoint'))
+        search_type = SEARCH_ENDPOINTS.get(item.get('endpoint'))
+        params = item.get('params') or {}
+        if not search_type or not isinstance(params, dict):
+            line.update(status=400, data={'status': '0', 'info': 'Invalid endpoint'})
+            return line
+        try:
+            with app.app_context():
+                result, source = SearchClient.search(item['endpoint'],
+                                                     [(name, str(value)) for name, value in params.items()],
+                                                     use_cache)
+            line.update(status=result.status, source=source, attempts=result.attempts, data=result.json())
+        except Exception as e:
+            logger.error(f"Batch item {index} failed: {str(e)}")
+            line.update(status=500, data={'status': '0', 'info': str(e), 'info_code': '1008612'})
+        return line
+
+    def generate():
+        executor = ThreadPoolExecutor(
+            max_workers=max(1, min(current_app.config['BATCH_CONCURRENCY'], len(items))),
+            thread_name_prefix='BatchSearch'
+        )
+        try:
+            futures = [executor.submit(run, index, item) for index, item in enumerate(items)]
+            for future in as_completed(futures):
+                yield json.dumps(future.result(), ensure_ascii=False) + '\n'
+        finally:
+            # 客户端断开时取消尚未开始的查询
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    logger.info(f"Batch search with {len(items)} requests")
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
@@ -0,0 +1,46 @@
+"""异步网关入口（ASGI）
+
+/amap 下的搜索请求由 AsyncProxy 在事件循环中处理，其他请求（管理端、多边形任务、
+批量接口、健康检查）通过 a2wsgi 转交给 Flask 应用，在线程池中执行。
+
+运行: uvicorn app.asgi:app --port 5000
+或设置 ASYNC_GATEWAY=true 后用 gunicorn.conf.py 启动（UvicornWorker）。
+依赖见 requirements-async.txt。
+"""
+from a2wsgi import WSGIMiddleware
+from app import create_app
+from app.api.async_proxy import AsyncProxy
+from app.core.logger import logger
+
+flask_app = create_app()
+proxy = AsyncProxy(flask_app)
+wsgi = WSGIMiddleware(flask_app, workers=flask_app.config['ASYNC_WSGI_THREADS'])
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await proxy.startup()
+            except Exception as e:
+                logger.error(f"异步网关启动失败: {str(e)}")
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await proxy.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http' and proxy.handles(scope):
+        if proxy.client is None:
+            # 服务器未发送 lifespan 事件时在首次请求时创建连接池
+            await proxy.startup()
+        await proxy(scope, receive, send)
+    else:
+        await wsgi(scope, receive, send)
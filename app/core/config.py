@@ -33,6 +33,7 @@ class Config:
     # API代理配置
     AMAP_BASE_URL = os.getenv('AMAP_BASE_URL')
     REQUEST_TIMEOUT = int(os.getenv('REQUEST_TIMEOUT'))
+    PROXY_PASSTHROUGH = os.getenv('PROXY_PASSTHROUGH', 'true').lower() == 'true'   # 成功的搜索结果原样转发上游响应，不重新序列化
     
     # 代理配置
     CUSTOM_PROXY_URL = os.getenv('CUSTOM_PROXY_URL', 'http://localhost:5000/amap')
@@ -40,6 +41,15 @@ class Config:
     HTTP_PROXY = os.getenv('HTTP_PROXY')
     HTTPS_PROXY = os.getenv('HTTPS_PROXY')
     
+    # 上游连接池配置
+    UPSTREAM_POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', '10'))              # 每个worker到上游的最大连接数
+    UPSTREAM_RETRIES = int(os.getenv('UPSTREAM_RETRIES', '1'))                   # 连接失败/被重置时的重试次数
+    UPSTREAM_KEEPALIVE_IDLE = int(os.getenv('UPSTREAM_KEEPALIVE_IDLE', '60'))    # TCP keep-alive 空闲探测秒数(0关闭)
+    UPSTREAM_IP_PINNING = os.getenv('UPSTREAM_IP_PINNING', 'false').lower() == 'true'   # 直连解析出的上游IP并按延迟选择
+    UPSTREAM_IPS = os.getenv('UPSTREAM_IPS', '')                                 # 固定的上游IP列表(逗号分隔)，留空则解析域名
+    UPSTREAM_IP_COOLDOWN = float(os.getenv('UPSTREAM_IP_COOLDOWN', '30'))        # 请求失败的IP隔离秒数
+    UPSTREAM_RESOLVE_INTERVAL = float(os.getenv('UPSTREAM_RESOLVE_INTERVAL', '300'))   # 重新解析上游域名的间隔(秒)
+    
     # 日志配置
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     LOG_FORMAT = os.getenv('LOG_FORMAT', '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -55,6 +65,69 @@ class Config:
     TIMEZONE = os.getenv('TIMEZONE', 'Asia/Shanghai')
     KEY_RESET_HOUR = int(os.getenv('KEY_RESET_HOUR', '1'))
     
+    # Key池配置
+    KEY_POOL_SYNC_INTERVAL = int(os.getenv('KEY_POOL_SYNC_INTERVAL', '30'))  # 与数据库同步间隔(秒)
+    KEY_SELECTION_STRATEGY = os.getenv('KEY_SELECTION_STRATEGY', 'random')  # random/least_used/weighted_remaining/latency
+    QPS_BURST = float(os.getenv('QPS_BURST', '1'))                    # 令牌桶容量(允许的突发请求数)
+    QPS_MAX_WAIT = float(os.getenv('QPS_MAX_WAIT', '10'))             # 所有key都限速时最长等待(秒)
+    QPS_ADAPTIVE = os.getenv('QPS_ADAPTIVE', 'true').lower() == 'true'   # 上游限流时按AIMD自适应调整每个key的QPS
+    QPS_DECREASE_FACTOR = float(os.getenv('QPS_DECREASE_FACTOR', '0.5'))   # 限流时速度乘以该系数
+    QPS_INCREASE = float(os.getenv('QPS_INCREASE', '0.5'))               # 满速时每秒增加的QPS
+    QPS_MAX_FACTOR = float(os.getenv('QPS_MAX_FACTOR', '1.0'))           # 自适应速度最高为配置QPS上限的倍数
+    RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', '5'))    # key超限/无效时单个请求最多尝试的key数
+    RETRY_BUDGET = float(os.getenv('RETRY_BUDGET', '30'))             # 单个请求换key重试的总时间预算(秒)
+    QUOTA_LEDGER = os.getenv('QUOTA_LEDGER', 'local')                 # 额度账本: local(单worker)/mmap(单机多worker)/database(多机)
+    QUOTA_LEDGER_PATH = os.getenv('QUOTA_LEDGER_PATH')                # mmap账本文件路径，默认 /dev/shm/amkm_quota_ledger
+    QUOTA_LEDGER_SLOTS = int(os.getenv('QUOTA_LEDGER_SLOTS', '1024')) # mmap账本槽位数(key数 x 3)
+    QUOTA_LEDGER_OWNER_TIMEOUT = int(os.getenv('QUOTA_LEDGER_OWNER_TIMEOUT', '300'))  # database账本中worker多久没有同步视为已退出(秒)，需大于 KEY_POOL_SYNC_INTERVAL
+    
+    # Key熔断配置
+    CIRCUIT_WINDOW = int(os.getenv('CIRCUIT_WINDOW', '20'))                  # 统计最近多少次调用
+    CIRCUIT_MIN_CALLS = int(os.getenv('CIRCUIT_MIN_CALLS', '5'))             # 至少多少次调用后才判断
+    CIRCUIT_ERROR_RATE = float(os.getenv('CIRCUIT_ERROR_RATE', '0.5'))       # 失败率达到多少时隔离
+    CIRCUIT_SLOW_CALL = float(os.getenv('CIRCUIT_SLOW_CALL', '5'))           # 超过多少秒的调用计为失败
+    CIRCUIT_COOLDOWN = float(os.getenv('CIRCUIT_COOLDOWN', '60'))            # 首次隔离时长(秒)
+    CIRCUIT_MAX_COOLDOWN = float(os.getenv('CIRCUIT_MAX_COOLDOWN', '600'))   # 探测失败后加倍隔离的上限(秒)
+    
+    # 响应缓存配置
+    RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'false').lower() == 'true'
+    RESPONSE_CACHE_MAX_MB = int(os.getenv('RESPONSE_CACHE_MAX_MB', '256'))                # 内存层上限(MB)
+    RESPONSE_CACHE_TTL_KEYWORD = int(os.getenv('RESPONSE_CACHE_TTL_KEYWORD', '3600'))    # 关键字搜索缓存时间(秒)，0不缓存
+    RESPONSE_CACHE_TTL_AROUND = int(os.getenv('RESPONSE_CACHE_TTL_AROUND', '3600'))      # 周边搜索缓存时间(秒)
+    RESPONSE_CACHE_TTL_POLYGON = int(os.getenv('RESPONSE_CACHE_TTL_POLYGON', '86400'))   # 多边形搜索缓存时间(秒)
+    RESPONSE_CACHE_DIR = os.getenv('RESPONSE_CACHE_DIR') or None                          # 磁盘缓存目录，留空不启用
+    
+    # 并发相同请求合并配置
+    COALESCE_ENABLED = os.getenv('COALESCE_ENABLED', 'true').lower() == 'true'
+    COALESCE_MAX_WAIT = float(os.getenv('COALESCE_MAX_WAIT', '60'))   # 等待其他线程结果的最长时间(秒)，超时后单独请求
+    
+    # 批量搜索配置
+    BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '5000'))       # 单次批量请求最多包含的查询数
+    BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '8'))      # 单次批量请求的并发查询数
+    
+    # 异步网关配置 (app/asgi.py)
+    ASYNC_MAX_CONNECTIONS = int(os.getenv('ASYNC_MAX_CONNECTIONS', '200'))   # 每个worker到上游的最大并发连接数
+    ASYNC_WSGI_THREADS = int(os.getenv('ASYNC_WSGI_THREADS', '8'))          # 处理其他(Flask)请求的线程数
+    
+    # 运行指标配置
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'   # 是否开放 /metrics (Prometheus格式)
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')                               # 访问 /metrics 需携带的 Bearer token，留空不校验
+    METRICS_ALLOWED_IPS = os.getenv('METRICS_ALLOWED_IPS', '')                   # 允许访问 /metrics 的IP或网段(逗号分隔)，留空不限制
+    
+    # 使用次数写回配置
+    USAGE_FLUSH_INTERVAL = float(os.getenv('USAGE_FLUSH_INTERVAL', '5'))     # 写回间隔(秒)
+    USAGE_FLUSH_THRESHOLD = int(os.getenv('USAGE_FLUSH_THRESHOLD', '100'))   # 累积多少次后立即写回
+    
+    # 多边形任务配置
+    CRAWLER_CONCURRENCY = int(os.getenv('CRAWLER_CONCURRENCY', '4'))   # 单个任务同时请求的页数，不超过可用key的polygon QPS总和
+    CRAWLER_RESULT_CAP = int(os.getenv('CRAWLER_RESULT_CAP', '900'))   # 高德多边形搜索最多能翻到的结果数，首页count达到时拆分区域
+    CRAWLER_MAX_DEPTH = int(os.getenv('CRAWLER_MAX_DEPTH', '6'))       # 区域最多拆分的层数(每层一分为四)
+    CRAWLER_QUERY_PLAN = os.getenv('CRAWLER_QUERY_PLAN', 'false').lower() == 'true'  # 先探测总数，稀疏的类型组合并查询、密集的单独查询(按typecode标注类型组)，false为每组单独查询
+    CRAWLER_FSYNC = os.getenv('CRAWLER_FSYNC', 'false').lower() == 'true'   # 结果文件在每次提交进度前是否 fsync 落盘
+    CRAWLER_CHECKPOINT_PAGES = int(os.getenv('CRAWLER_CHECKPOINT_PAGES', '20'))          # 每写入多少页提交一次进度
+    CRAWLER_CHECKPOINT_SECONDS = float(os.getenv('CRAWLER_CHECKPOINT_SECONDS', '10'))    # 距上次提交超过多少秒时提交进度
+    CRAWLER_RESULT_FORMAT = os.getenv('CRAWLER_RESULT_FORMAT', 'csv')   # 新任务默认的结果格式: csv/csv.gz/csv.zst/ndjson.gz/ndjson.zst/parquet
+    
     # POI类型配置
 
     POI_TYPES = {'weight5': '060401|060402|060403|060404|060405|060406|060407|060408|060409|060413|060414|060415|141201|150104|150200',
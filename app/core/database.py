@@ -1,3 +1,31 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, literal, text
 
-db = SQLAlchemy() 
\ No newline at end of file
+db = SQLAlchemy()
+
+
+def add_missing_columns(model):
+    """给已存在的表补上模型中新增的列
+
+    db.create_all 只创建不存在的表，不会修改已有的表；新增的列需可为空或有标量默认值。
+    多个worker同时启动时其他进程可能已经加过，失败时忽略。
+    """
+    table = model.__table__
+    inspector = inspect(db.engine)
+    if not inspector.has_table(table.name):
+        return
+    existing = {column['name'] for column in inspector.get_columns(table.name)}
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=db.engine.dialect)}'
+        if column.default is not None and column.default.is_scalar:
+            default = literal(column.default.arg, column.type).compile(
+                dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+            ddl += f' DEFAULT {default}'
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(text(ddl))
+        except Exception:
+            if column.name not in {c['name'] for c in inspect(db.engine).get_columns(table.name)}:
+                raise
@@ -1,12 +1,66 @@
 from flask_sqlalchemy import SQLAlchemy
 from app.services.task_executor import TaskExecutor
+from app.services.key_pool import KeyPool
+from app.services.quota_scheduler import QuotaResetScheduler
+from app.services.usage_recorder import UsageRecorder
+from app.services.upstream_session import UpstreamSessionPool
+from app.services.response_cache import ResponseCache
+from app.services.single_flight import SingleFlight
+from app.services.metrics import MetricsRegistry
+from app.utils.http_client import HttpClient
 
 # 创建扩展实例
 
 # 直接创建 TaskExecutor 实例
 task_executor = TaskExecutor()
 
+# 进程内key池
+key_pool = KeyPool()
+
+# key使用次数延迟写入
+usage_recorder = UsageRecorder()
+
+# 上游长连接池
+upstream_pool = UpstreamSessionPool()
+
+# 固定IP的上游客户端（UPSTREAM_IP_PINNING 开启时代替 upstream_pool）
+upstream_client = HttpClient()
+
+# 搜索结果缓存
+response_cache = ResponseCache()
+
+# 并发相同请求合并
+request_coalescer = SingleFlight()
+
+# 每日额度重置调度器
+quota_scheduler = QuotaResetScheduler()
+
+# 运行指标 (/metrics)
+metrics = MetricsRegistry()
+metrics.gauge('amkm_key_used', '各key各服务今日已用次数', ('key_id', 'search_type'),
+              lambda: (((key_id, search_type), used) for key_id, search_type, used, _ in key_pool.quota_snapshot()))
+metrics.gauge('amkm_key_remaining', '各key各服务今日剩余次数(扣除预占)', ('key_id', 'search_type'),
+              lambda: (((key_id, search_type), remaining)
+                       for key_id, search_type, _, remaining in key_pool.quota_snapshot()))
+metrics.gauge('amkm_key_qps_limit', '各key各服务当前的QPS上限(含限流后的自适应调整)', ('key_id', 'search_type'),
+              key_pool.rate_snapshot)
+metrics.gauge('amkm_executor_queue_size', '任务执行器排队中的任务数', (),
+              lambda: [((), task_executor.get_queue_size())])
+metrics.gauge('amkm_executor_active_tasks', '任务执行器正在运行的任务数', (),
+              lambda: [((), task_executor.get_active_tasks_count())])
+
 def init_extensions(app):
     """初始化扩展"""
     # 不需要重新创建 TaskExecutor 实例
-    pass
\ No newline at end of file
+    upstream_pool.init_app(app)
+    upstream_client.init_app(app)
+    metrics.init_app(app)
+    response_cache.init_app(app)
+    request_coalescer.init_app(app)
+    usage_recorder.init_app(app)
+    # 先打开共享账本，启动时补做的额度重置需要同步到账本
+    key_pool.init_ledger(app)
+    quota_scheduler.add_pre_reset_hook(usage_recorder.flush)
+    quota_scheduler.add_listener(key_pool.on_quota_reset)
+    quota_scheduler.init_app(app)
+    key_pool.init_app(app)
@@ -0,0 +1,32 @@
+from app.core.database import db
+
+
+class KeyLedgerEntry(db.Model):
+    """多机共享的key额度与令牌桶账本
+
+    每个 (key_id, search_type) 一行；key_id 为 0 的行作为全局锁使用。
+    """
+    __tablename__ = 'key_quota_ledger'
+
+    key_id = db.Column(db.Integer, primary_key=True)
+    search_type = db.Column(db.String(20), primary_key=True)
+    used = db.Column(db.Integer, nullable=False, default=0)        # 当日已用次数
+    reserved = db.Column(db.Integer, nullable=False, default=0)    # 已预占未确认的次数
+    tokens = db.Column(db.Float, nullable=False, default=0)        # 令牌桶剩余令牌
+    updated = db.Column(db.Float, nullable=False, default=0)       # 令牌桶上次结算时间(unix时间戳)，0表示未初始化
+    reset_at = db.Column(db.Float, nullable=False, default=0)      # 计数所属的重置时间点(unix时间戳)
+
+
+class KeyLedgerReservation(db.Model):
+    """多机共享账本中各worker预占的次数
+
+    每个 (worker, key_id, search_type) 一行，worker 为 主机名:进程号。
+    worker 退出或长时间没有活动时，由其他worker把它预占的次数从 key_quota_ledger 中减去并删除这些行。
+    """
+    __tablename__ = 'key_quota_reservation'
+
+    owner = db.Column(db.String(100), primary_key=True)           # 主机名:进程号
+    key_id = db.Column(db.Integer, primary_key=True)
+    search_type = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)       # 预占未确认的次数
+    heartbeat = db.Column(db.Float, nullable=False, default=0)     # 最近一次活动时间(unix时间戳)
@@ -1,8 +1,13 @@
 from datetime import datetime, timedelta
 from app.core.database import db
+from app.models.polygon_task_progress import PolygonTaskProgress
+from sqlalchemy.exc import IntegrityError
 import json
+import logging
 import pytz
 
+logger = logging.getLogger(__name__)
+
 # 获取东八区时区
 tz = pytz.timezone('Asia/Shanghai')
 
@@ -25,38 +30,31 @@ class PolygonTask(db.Model):
     current_type = db.Column(db.String(50))              # 当前正在爬取的POI类型
     current_page = db.Column(db.Integer, default=1)      # 当前页码
     
-    # 进度记录 (使用Text存储JSON)
-    progress_data = db.Column(db.Text, default='{}')     # 各类型的进度数据
+    # 进度记录：各查询的进度见 PolygonTaskProgress，progress_data 为旧版本的JSON进度（启动时迁移）
+    progress_data = db.Column(db.Text, default='{}')
+    total_progress = db.Column(db.Float, default=0)      # 总体进度百分比（提交进度时更新）
     
     # 结果文件
-    result_file = db.Column(db.String(200))             # CSV文件路径
+    result_file = db.Column(db.String(200))             # 结果文件名（扩展名为格式）
     
     # 时间记录
     created_at = db.Column(db.DateTime, default=get_current_time)
     updated_at = db.Column(db.DateTime, default=get_current_time)
 
+    def load_progress(self):
+        """从进度表读取进度数据（按查询计划顺序），每次调用查询一次数据库"""
+        progress = PolygonTaskProgress.load(self.id) if self.id is not None else {}
+        if not progress:
+            return self.legacy_progress
+        return progress
+
     @property
-    def progress(self):
-        """获取进度数据"""
+    def legacy_progress(self):
+        """旧版本保存在 progress_data 中的进度"""
         try:
-            return json.loads(self.progress_data)
+            return json.loads(self.progress_data or '{}')
         except:
             return {}
-            
-    @progress.setter
-    def progress(self, value):
-        """设置进度数据"""
-        self.progress_data = json.dumps(value, ensure_ascii=False)
-
-    @property
-    def total_progress(self):
-        """计算总体进度百分比"""
-        progress = self.progress
-        total_pages = sum(type_data['total_pages'] for type_data in progress.values())
-        processed_pages = sum(type_data['processed_pages'] for type_data in progress.values())
-        if total_pages == 0:
-            return 0
-        return round(processed_pages / total_pages * 100, 2)
 
     def is_stalled(self, timeout_minutes=5):
         """检查任务是否已停滞"""
@@ -74,4 +72,27 @@ class PolygonTask(db.Model):
         stall_time = now - self.updated_at
         timeout = timedelta(minutes=timeout_minutes)
         
-        return stall_time > timeout
\ No newline at end of file
+        return stall_time > timeout
+
+
+def migrate_progress_data():
+    """把旧版本 progress_data 中的JSON进度迁移到 polygon_task_progress 表，并计算 total_progress
+
+    每个任务一个事务；多个worker同时迁移同一任务时唯一约束使后提交的失败，回滚后跳过；
+    其他错误回滚并记录日志，该任务保留旧进度，下次启动时再迁移。
+    """
+    tasks = PolygonTask.query.filter(PolygonTask.progress_data.isnot(None),
+                                     PolygonTask.progress_data.notin_(['', '{}'])).all()
+    for task in tasks:
+        progress = task.legacy_progress
+        try:
+            PolygonTaskProgress.save(task.id, progress)
+            task.total_progress = PolygonTaskProgress.percent(progress.values())
+            task.progress_data = '{}'
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"迁移任务 {task.task_id} 的进度失败: {str(e)}")
+
@@ -0,0 +1,117 @@
+import json
+from typing import Dict, Iterable, List
+from app.core.database import db
+
+# 进度中以 JSON 文本保存的列表字段
+_LIST_FIELDS = ('groups', 'region', 'splits')
+# 可选的标量字段，为空时不出现在进度数据中
+_OPTIONAL_FIELDS = ('region_pages', 'file_start', 'file_offset')
+# 列表接口需要的计数字段
+SUMMARY_FIELDS = ('total_pages', 'processed_pages', 'total_count', 'processed_count', 'completed')
+
+
+class PolygonTaskProgress(db.Model):
+    """多边形任务中一条查询的进度
+
+    每个 (任务, 查询) 一行，position 为查询在计划中的顺序。计数字段是普通列，
+    列表接口直接读取；类型组、区域路径等只在任务执行时用到的列表以 JSON 文本保存。
+    """
+    __tablename__ = 'polygon_task_progress'
+    __table_args__ = (db.UniqueConstraint('task_id', 'name'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.Integer, nullable=False, index=True)   # polygon_tasks.id
+    name = db.Column(db.String(100), nullable=False)              # 查询名
+    position = db.Column(db.Integer, nullable=False, default=0)
+    types = db.Column(db.Text)                                    # 类型代码，| 分隔
+    groups = db.Column(db.Text)                                   # 类型组(JSON)
+    total_pages = db.Column(db.Integer, nullable=False, default=0)
+    processed_pages = db.Column(db.Integer, nullable=False, default=0)
+    total_count = db.Column(db.Integer, nullable=False, default=0)
+    processed_count = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Boolean, nullable=False, default=False)
+    region = db.Column(db.Text)                                   # 正在写入的区域路径(JSON)
+    region_pages = db.Column(db.Integer)                          # 该区域的页数
+    splits = db.Column(db.Text)                                   # 已拆分的区域路径(JSON)
+    file_start = db.Column(db.BigInteger)                         # 查询开始写入的结果文件位置
+    file_offset = db.Column(db.BigInteger)                        # 最后一次提交时的结果文件位置
+
+    def to_entry(self) -> Dict:
+        """转为进度数据中的一项"""
+        entry = {field: getattr(self, field) for field in SUMMARY_FIELDS}
+        if self.types is not None:
+            entry['types'] = self.types
+        for field in _LIST_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                entry[field] = json.loads(value)
+        for field in _OPTIONAL_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                entry[field] = value
+        return entry
+
+    def update_from(self, entry: Dict):
+        for field in SUMMARY_FIELDS:
+            setattr(self, field, entry.get(field, False if field == 'completed' else 0))
+        self.types = entry.get('types')
+        for field in _LIST_FIELDS:
+            value = entry.get(field)
+            setattr(self, field, json.dumps(value, ensure_ascii=False) if value is not None else None)
+        for field in _OPTIONAL_FIELDS:
+            setattr(self, field, entry.get(field))
+
+    @staticmethod
+    def load(task_id: int) -> Dict[str, Dict]:
+        """任务的完整进度数据（按计划顺序）"""
+        rows = PolygonTaskProgress.query.filter_by(task_id=task_id)\
+            .order_by(PolygonTaskProgress.position).all()
+        return {row.name: row.to_entry() for row in rows}
+
+    @staticmethod
+    def summaries(task_ids: Iterable[int]) -> Dict[int, Dict[str, Dict]]:
+        """一批任务的进度计数，一次查询，不解析 JSON 字段"""
+        task_ids = list(task_ids)
+        result: Dict[int, Dict[str, Dict]] = {task_id: {} for task_id in task_ids}
+        if not task_ids:
+            return result
+        columns = [PolygonTaskProgress.task_id, PolygonTaskProgress.name] + \
+                  [getattr(PolygonTaskProgress, field) for field in SUMMARY_FIELDS]
+        rows = db.session.query(*columns)\
+            .filter(PolygonTaskProgress.task_id.in_(task_ids))\
+            .order_by(PolygonTaskProgress.task_id, PolygonTaskProgress.position).all()
+        for task_id, name, *values in rows:
+            result[task_id][name] = dict(zip(SUMMARY_FIELDS, values))
+        return result
+
+    @staticmethod
+    def save(task_id: int, progress: Dict[str, Dict], names: Iterable[str] = None, replace: bool = False):
+        """写入进度数据中 names 对应的项（默认全部，不提交）
+
+        replace 为 True 时先删除任务原有的进度（重新规划时）。
+        """
+        names = list(progress) if names is None else [name for name in names if name in progress]
+        positions = {name: index for index, name in enumerate(progress)}
+        if replace:
+            PolygonTaskProgress.query.filter_by(task_id=task_id).delete(synchronize_session=False)
+            rows: Dict[str, PolygonTaskProgress] = {}
+        else:
+            rows = {row.name: row for row in PolygonTaskProgress.query.filter(
+                PolygonTaskProgress.task_id == task_id, PolygonTaskProgress.name.in_(names)).all()} if names else {}
+        for name in names:
+            row = rows.get(name)
+            if row is None:
+                row = PolygonTaskProgress(task_id=task_id, name=name)
+                db.session.add(row)
+            row.position = positions[name]
+            row.update_from(progress[name])
+
+    @staticmethod
+    def percent(progress: Iterable[Dict]) -> float:
+        """总体进度百分比（已处理页数 / 总页数）"""
+        entries: List[Dict] = list(progress)
+        total_pages = sum(entry.get('total_pages', 0) for entry in entries)
+        processed_pages = sum(entry.get('processed_pages', 0) for entry in entries)
+        if total_pages == 0:
+            return 0
+        return round(processed_pages / total_pages * 100, 2)
@@ -0,0 +1,174 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+# 熔断器状态
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """单个key的熔断器
+
+    closed: 正常参与选择，统计最近 window 次调用的失败率（超过 slow_call 秒的调用也计为失败）；
+    open: 失败率超过阈值后隔离 cooldown 秒，不参与选择；
+    half_open: 冷却结束后只放行一次探测调用，成功则恢复，失败则加倍冷却时间重新隔离。
+    """
+
+    def __init__(self, window: int, min_calls: int, error_rate: float,
+                 slow_call: float, cooldown: float, max_cooldown: float):
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate
+        self.slow_call = slow_call
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = CLOSED
+        self.outcomes = deque(maxlen=window)
+        self.cooldown = cooldown
+        self.opened_at = 0.0
+        self.probe_started = None
+        self.last_error = None
+
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def retry_after(self, now: float) -> float:
+        """距离可以再次放行的秒数"""
+        if self.state == OPEN:
+            return max(0.0, self.opened_at + self.cooldown - now)
+        if self.state == HALF_OPEN and self.probe_started is not None:
+            # 探测调用没有回报结果时，超过一个冷却周期后允许再次探测
+            return max(0.0, self.probe_started + self.cooldown - now)
+        return 0.0
+
+    def allow(self, now: float) -> bool:
+        """当前是否可以参与选择（不改变状态）"""
+        return self.retry_after(now) <= 0
+
+    def acquire(self, now: float):
+        """key被选中时调用，冷却结束的key进入half_open并占用探测名额"""
+        if self.state == OPEN:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            self.probe_started = now
+
+    def record(self, success: bool, seconds: Optional[float], now: float, error: str = None) -> Optional[str]:
+        """记录一次调用结果
+
+        Returns:
+            状态发生变化时返回新状态，否则返回 None
+        """
+        if success and seconds is not None and seconds > self.slow_call:
+            success = False
+            error = f"slow call {seconds:.2f}s"
+        if not success:
+            self.last_error = error
+
+        if self.state == HALF_OPEN:
+            self.probe_started = None
+            if success:
+                self.state = CLOSED
+                self.outcomes.clear()
+                self.cooldown = self.base_cooldown
+                return CLOSED
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            self._open(now)
+            return OPEN
+
+        if self.state == OPEN:
+            # 被隔离前已发出的调用，结果不再影响状态
+            return None
+
+        self.outcomes.append(success)
+        if len(self.outcomes) >= self.min_calls and self.error_rate() >= self.error_rate_threshold:
+            self._open(now)
+            return OPEN
+        return None
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self.opened_at = now
+        self.outcomes.clear()
+
+    def snapshot(self, now: float) -> Dict:
+        return {
+            'state': self.state,
+            'error_rate': round(self.error_rate(), 3),
+            'calls': len(self.outcomes),
+            'retry_after': round(self.retry_after(now), 1),
+            'last_error': self.last_error
+        }
+
+
+class KeyHealthTracker:
+    """按 key_id 维护的熔断器集合"""
+
+    def __init__(self, window: int = 20, min_calls: int = 5, error_rate: float = 0.5,
+                 slow_call: float = 5.0, cooldown: float = 60.0, max_cooldown: float = 600.0):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        self._breakers: Dict[int, CircuitBreaker] = {}
+
+    def configure(self, config):
+        """从应用配置读取阈值"""
+        self.window = config.get('CIRCUIT_WINDOW', self.window)
+        self.min_calls = config.get('CIRCUIT_MIN_CALLS', self.min_calls)
+        self.error_rate = config.get('CIRCUIT_ERROR_RATE', self.error_rate)
+        self.slow_call = config.get('CIRCUIT_SLOW_CALL', self.slow_call)
+        self.cooldown = config.get('CIRCUIT_COOLDOWN', self.cooldown)
+        self.max_cooldown = config.get('CIRCUIT_MAX_COOLDOWN', self.max_cooldown)
+
+    def _breaker(self, key_id: int) -> CircuitBreaker:
+        breaker = self._breakers.get(key_id)
+        if breaker is None:
+            breaker = CircuitBreaker(self.window, self.min_calls, self.error_rate,
+                                     self.slow_call, self.cooldown, self.max_cooldown)
+            self._breakers[key_id] = breaker
+        return breaker
+
+    def allow(self, key_id: int) -> bool:
+        """key当前是否可以参与选择"""
+        with self._lock:
+            breaker = self._breakers.get(key_id)
+            return breaker is None or breaker.allow(time.monotonic())
+
+    def retry_after(self, key_id: int) -> float:
+        """被隔离的key还需等待的秒数"""
+        with self._lock:
+            breaker = self._breakers.get(key_id)
+            return 0.0 if breaker is None else breaker.retry_after(time.monotonic())
+
+    def acquire(self, key_id: int):
+        """key被选中"""
+        with self._lock:
+            breaker = self._breakers.get(key_id)
+            if breaker is not None:
+                breaker.acquire(time.monotonic())
+
+    def record(self, key_id: int, success: bool, seconds: Optional[float] = None,
+               error: str = None) -> Optional[str]:
+        """记录调用结果，状态变化时返回新状态"""
+        with self._lock:
+            return self._breaker(key_id).record(success, seconds, time.monotonic(), error)
+
+    def snapshot(self, key_id: int) -> Dict:
+        """key的健康状态（用于管理页面展示）"""
+        with self._lock:
+            breaker = self._breakers.get(key_id)
+            if breaker is None:
+                return {'state': CLOSED, 'error_rate': 0.0, 'calls': 0, 'retry_after': 0.0, 'last_error': None}
+            return breaker.snapshot(time.monotonic())
+
+    def remove(self, key_id: int):
+        """移除某个key的熔断器"""
+        with self._lock:
+            self._breakers.pop(key_id, None)
@@ -1,79 +1,145 @@
-from datetime import datetime, timedelta
-from typing import Optional, Dict
+import asyncio
+import time
+from flask import current_app
+from typing import Optional, Dict, Iterable
 from app.models.api_key import APIKey
 from app.core.database import db
 from app.core.logger import logger
-import pytz
 from app.core.config import Config
+from app.core.extensions import key_pool, usage_recorder
+from app.services.key_pool import PooledKey, SEARCH_TYPES
+from app.services.key_strategies import get_strategy
+from app.services.circuit_breaker import OPEN, CLOSED
 
 class KeyManager:
     """密钥管理服务"""
     
     @staticmethod
-    def get_available_key(search_type: str) -> Optional[APIKey]:
-        """获取一个可用的API key"""
+    def get_available_key(search_type: str, exclude: Optional[Iterable[int]] = None,
+                          max_wait: Optional[float] = None) -> Optional[PooledKey]:
+        """获取一个可用的API key，并预占一次额度
+
+        优先选择当前有QPS令牌且未被熔断隔离的key，只有所有可用key都在限速或隔离中时才等待，
+        最长等待 QPS_MAX_WAIT 秒（max_wait 更小时以 max_wait 为准）。
+        调用成功后需调用 increment_usage 确认，失败时调用 release_key 退还。
+        """
         try:
-            tz = pytz.timezone(Config.TIMEZONE)
-            now = datetime.now(tz)
-            today_reset_time = now.replace(
-                hour=Config.KEY_RESET_HOUR, 
-                minute=0, 
-                second=0, 
-                microsecond=0
-            )
+            if search_type not in SEARCH_TYPES:
+                raise ValueError(f"无效的搜索类型: {search_type}")
+
+            key_pool.ensure_loaded()
+            deadline = time.monotonic() + KeyManager._max_wait(max_wait)
+            while True:
+                key, wait = key_pool.try_reserve(search_type, exclude=exclude)
+                if key or wait <= 0:
+                    return key
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"所有key的{search_type}搜索都在限速或熔断隔离中, 等待超时")
+                    return None
+                time.sleep(min(wait, remaining))
             
-            # 确定重置时间
-            if now < today_reset_time:
-                reset_time = today_reset_time - timedelta(days=1)
-            else:
-                reset_time = today_reset_time
-
-            # 获取所有活跃的key
-            active_keys = APIKey.query.filter(
-                APIKey.is_active == True
-            ).all()
-
-            # 检查并重置需要重置的key
-            for key in active_keys:
-                if not key.last_reset or key.last_reset.astimezone(tz) < reset_time:
-                    key.keyword_search_used = 0
-                    key.around_search_used = 0
-                    key.polygon_search_used = 0
-                    key.last_reset = now
-                    logger.info(f"Key {key.masked_key} 使用计数已重置")
-
-            if active_keys:
-                db.session.commit()
+        except Exception as e:
+            logger.error(f"获取可用key失败: {str(e)}")
+            return None
 
-            # 根据搜索类型和限额查询可用的key
-            if search_type == 'keyword':
-                keys = APIKey.query.filter(
-                    APIKey.is_active == True,
-                    APIKey.keyword_search_used < APIKey.keyword_search_limit
-                ).all()
-            elif search_type == 'around':
-                keys = APIKey.query.filter(
-                    APIKey.is_active == True,
-                    APIKey.around_search_used < APIKey.around_search_limit
-                ).all()
-            elif search_type == 'polygon':
-                keys = APIKey.query.filter(
-                    APIKey.is_active == True,
-                    APIKey.polygon_search_used < APIKey.polygon_search_limit
-                ).all()
-            else:
+    @staticmethod
+    async def get_available_key_async(search_type: str, exclude: Optional[Iterable[int]] = None,
+                                      max_wait: Optional[float] = None) -> Optional[PooledKey]:
+        """get_available_key 的异步版本，等待QPS令牌时不占用线程（需要在应用上下文中调用）"""
+        try:
+            if search_type not in SEARCH_TYPES:
                 raise ValueError(f"无效的搜索类型: {search_type}")
 
-            # 从可用的keys中随机选择一个
-            import random
-            key = random.choice(keys) if keys else None
+            key_pool.ensure_loaded()
+            app = current_app._get_current_object()
+            deadline = time.monotonic() + KeyManager._max_wait(max_wait)
+            while True:
+                if key_pool.ledger.blocking:
+                    # 数据库账本需要在线程中使用独立的应用上下文（数据库会话）
+                    key, wait = await asyncio.to_thread(KeyManager._reserve_in_app, app, search_type, exclude)
+                else:
+                    key, wait = key_pool.try_reserve(search_type, exclude=exclude)
+                if key or wait <= 0:
+                    return key
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"所有key的{search_type}搜索都在限速或熔断隔离中, 等待超时")
+                    return None
+                await asyncio.sleep(min(wait, remaining))
 
-            return key
-            
         except Exception as e:
             logger.error(f"获取可用key失败: {str(e)}")
             return None
 
+    @staticmethod
+    def _max_wait(max_wait: Optional[float]) -> float:
+        if max_wait is None:
+            return Config.QPS_MAX_WAIT
+        return max(0.0, min(Config.QPS_MAX_WAIT, max_wait))
+
+    @staticmethod
+    def _reserve_in_app(app, search_type: str, exclude: Optional[Iterable[int]]):
+        with app.app_context():
+            return key_pool.try_reserve(search_type, exclude=exclude)
+
+    @staticmethod
+    def has_available_key(search_type: str) -> bool:
+        """检查是否有可用的key（不预占额度）"""
+        try:
+            key_pool.ensure_loaded()
+            return key_pool.has_available(search_type)
+        except Exception as e:
+            logger.error(f"检查可用key失败: {str(e)}")
+            return False
+
+    @staticmethod
+    def set_selection_strategy(name: str) -> None:
+        """按名称切换key选择策略"""
+        key_pool.set_strategy(get_strategy(name))
+        logger.info(f"Key选择策略已切换为: {name}")
+
+    @staticmethod
+    def record_latency(key_id: int, seconds: float) -> None:
+        """记录key的上游响应时间（供延迟优先策略使用）"""
+        key_pool.record_latency(key_id, seconds)
+
+    @staticmethod
+    def report_result(key_id: int, success: bool, seconds: float = None, error: str = None) -> None:
+        """上报一次上游调用结果，供熔断器判断key是否需要隔离"""
+        state = key_pool.health.record(key_id, success, seconds, error)
+        if state == OPEN:
+            logger.warning(f"Key {key_id} 已被熔断隔离, 原因: {error}")
+        elif state == CLOSED:
+            logger.info(f"Key {key_id} 探测成功, 恢复使用")
+
+    @staticmethod
+    def report_throttle(key_id: int, search_type: str) -> None:
+        """上游对key限流，降低该key该服务的发送速度"""
+        rate = key_pool.throttle(key_id, search_type)
+        if rate is not None:
+            logger.info(f"Key {key_id} 的{search_type}搜索被上游限流, QPS降为 {rate:.2f}")
+
+    @staticmethod
+    def get_health(key_id: int) -> Dict:
+        """获取key的熔断器状态"""
+        return key_pool.health.snapshot(key_id)
+
+    @staticmethod
+    def release_key(key_id: int, search_type: str) -> None:
+        """退还预占的额度"""
+        key_pool.refund(key_id, search_type)
+
+    @staticmethod
+    def sync_key(key: APIKey) -> None:
+        """key被修改后刷新key池"""
+        key_pool.sync_key(key)
+
+    @staticmethod
+    def remove_key(key_id: int) -> None:
+        """key被删除后从key池移除"""
+        key_pool.remove(key_id)
+
     @staticmethod
     def add_key(key: str, limits: Dict = None, description: str = None) -> APIKey:
         """添加新的API key
@@ -88,6 +154,8 @@ class KeyManager:
             if new_key and description:
                 new_key.description = description
                 db.session.commit()
+            if new_key:
+                key_pool.sync_key(new_key)
             logger.info(f"新key已添加: {new_key.masked_key}")
             return new_key
             
@@ -107,6 +175,7 @@ class KeyManager:
                 
             success = key.update_limits(limits)
             if success:
+                key_pool.sync_key(key)
                 logger.info(f"Key {key.masked_key} 的限额已更新")
             return success
             
@@ -128,13 +197,17 @@ class KeyManager:
             return {}
 
     @staticmethod
-    def disable_key(key: APIKey, reason: str = None) -> bool:
+    def disable_key(key: PooledKey, reason: str = None) -> bool:
         """永久禁用key"""
         try:
-            key.is_active = False
-            key.description = f"{key.description or ''} | 禁用原因: {reason}"
+            key_pool.remove(key.id)
+            api_key = APIKey.query.get(key.id)
+            if not api_key:
+                return False
+            api_key.is_active = False
+            api_key.description = f"{api_key.description or ''} | 禁用原因: {reason}"
             db.session.commit()
-            logger.warning(f"Key {key.masked_key} 已永久禁用, 原因: {reason}")
+            logger.warning(f"Key {api_key.masked_key} 已永久禁用, 原因: {reason}")
             return True
             
         except Exception as e:
@@ -144,41 +217,46 @@ class KeyManager:
 
     @classmethod
     def increment_usage(cls, key_id: int, search_type: str) -> bool:
-        """增加密钥使用次数"""
-        try:
-            key = APIKey.query.get(key_id)
-            if key:
-                success = key.increment_usage(search_type)
-                if success:
-                    logger.debug(f"Key {key.masked_key} {search_type} 搜索使用次数已增加")
-                return success
-            return False
-        except Exception as e:
-            logger.error(f"增加key使用次数失败: {str(e)}")
+        """增加密钥使用次数（先计入内存，由后台批量写回数据库）"""
+        if search_type not in SEARCH_TYPES:
             return False
+        key_pool.commit(key_id, search_type)
+        usage_recorder.record(key_id, search_type)
+        return True
 
     @classmethod
     def mark_daily_limit(cls, key_id: int, search_type: str) -> None:
         """标记某个key的某项服务达到每日限额"""
+        key_pool.mark_exhausted(key_id, search_type)
+        cls.apply_key_failures(search_type, exhausted=[key_id])
+
+    @staticmethod
+    def apply_key_failures(search_type: str, exhausted: Iterable[int] = (),
+                           invalid: Optional[Dict[int, str]] = None) -> None:
+        """把一次请求中发现的超限key和无效key一次写入数据库
+
+        超限key的使用次数直接设为限额值，无效key被永久禁用（invalid 为 key id 到禁用原因的映射）。
+        只更新数据库，key池中的状态需由调用方先行更新。
+        """
+        invalid = invalid or {}
+        exhausted = set(exhausted)
+        key_ids = exhausted | set(invalid)
+        if not key_ids:
+            return
         try:
-            key = APIKey.query.get(key_id)
-            if not key:
-                logger.warning(f"Key {key_id} not found when marking daily limit")
-                return
-
-            # 直接将使用次数设置为限额值
-            if search_type == 'keyword':
-                key.keyword_search_used = key.SEARCH_LIMITS['keyword']
-            elif search_type == 'around':
-                key.around_search_used = key.SEARCH_LIMITS['around']
-            elif search_type == 'polygon':
-                key.polygon_search_used = key.SEARCH_LIMITS['polygon']
-            
+            for key in APIKey.query.filter(APIKey.id.in_(key_ids)).all():
+                if key.id in exhausted:
+                    # 直接将使用次数设置为限额值
+                    setattr(key, f'{search_type}_search_used', key.SEARCH_LIMITS[search_type])
+                    logger.info(f"Key {key.masked_key} 已标记为{search_type}搜索达到每日限额")
+                if key.id in invalid:
+                    key.is_active = False
+                    key.description = f"{key.description or ''} | 禁用原因: {invalid[key.id]}"
+                    logger.warning(f"Key {key.masked_key} 已永久禁用, 原因: {invalid[key.id]}")
             db.session.commit()
-            logger.info(f"Key {key.masked_key} 已标记为{search_type}搜索达到每日限额")
-            
+
         except Exception as e:
-            logger.error(f"标记key每日限额失败: {str(e)}")
+            logger.error(f"更新超限/无效key失败: {str(e)}")
             db.session.rollback()
 
 
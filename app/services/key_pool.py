@@ -0,0 +1,352 @@
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from app.models.api_key import APIKey
+from app.core.database import db
+from app.core.logger import logger
+from app.core.config import Config
+from app.services.rate_limiter import AimdController, RateLimiter
+from app.services.circuit_breaker import KeyHealthTracker
+from app.services.quota_ledger import LocalLedger, create_ledger
+from app.services.key_strategies import KeySelectionStrategy, get_strategy
+
+# 支持的搜索类型
+SEARCH_TYPES = ('keyword', 'around', 'polygon')
+
+
+class PooledKey:
+    """内存中的key快照"""
+
+    def __init__(self, api_key: APIKey):
+        self.id = api_key.id
+        self.used = {search_type: 0 for search_type in SEARCH_TYPES}
+        # 已预占但尚未确认的次数
+        self.reserved = {search_type: 0 for search_type in SEARCH_TYPES}
+        # 上游响应时间的指数移动平均(秒)
+        self.latency = None
+        self.update_from(api_key, reset=True)
+
+    def update_from(self, api_key: APIKey, reset: bool = False):
+        """用数据库记录刷新快照
+
+        Args:
+            api_key: 数据库中的key记录
+            reset: 为True时直接采用数据库中的使用次数，否则取本地与数据库的较大值
+        """
+        self.key = api_key.key
+        self.masked_key = api_key.masked_key
+        self.search_limits = api_key.SEARCH_LIMITS
+        self.qps_limits = api_key.QPS_LIMITS
+        self.last_reset = api_key.last_reset
+        db_used = self.db_used(api_key)
+        for search_type in SEARCH_TYPES:
+            if reset:
+                self.used[search_type] = db_used[search_type]
+            else:
+                self.used[search_type] = max(self.used[search_type], db_used[search_type])
+
+    @staticmethod
+    def db_used(api_key: APIKey) -> Dict[str, int]:
+        """数据库中记录的使用次数"""
+        return {
+            'keyword': api_key.keyword_search_used or 0,
+            'around': api_key.around_search_used or 0,
+            'polygon': api_key.polygon_search_used or 0
+        }
+
+    def remaining(self, search_type: str) -> int:
+        """剩余可用次数（扣除预占）"""
+        return self.search_limits[search_type] - self.used[search_type] - self.reserved[search_type]
+
+
+class KeyPool:
+    """进程内的key池
+
+    选key和预占额度都在内存中完成，数据库只在后台同步时访问。
+    每个key的每种搜索服务都有独立的令牌桶，按 QPS_LIMITS 限速，上游限流时按 AIMD 自适应调整。
+    上游频繁出错或响应过慢的key由熔断器暂时隔离。
+    多worker部署时，已用/预占次数和令牌桶状态保存在共享账本（QUOTA_LEDGER）中，
+    每次操作都在账本事务内先读取最新计数再写回；预占记在各worker名下，已退出的worker的预占在同步时释放。
+    需要账本事务的操作先进入事务再取进程内的锁（顺序固定），数据库账本加锁的往返期间
+    不阻塞只访问内存的操作（记录耗时、限流降速、指标快照）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys: Dict[int, PooledKey] = {}
+        self._loaded = False
+        self._stop_event = threading.Event()
+        self._sync_thread = None
+        self.sync_interval = Config.KEY_POOL_SYNC_INTERVAL
+        self.rate_limiter = RateLimiter(capacity=Config.QPS_BURST)
+        self.aimd = AimdController(
+            enabled=Config.QPS_ADAPTIVE,
+            decrease=Config.QPS_DECREASE_FACTOR,
+            increase=Config.QPS_INCREASE,
+            max_factor=Config.QPS_MAX_FACTOR
+        )
+        self.health = KeyHealthTracker(
+            window=Config.CIRCUIT_WINDOW,
+            min_calls=Config.CIRCUIT_MIN_CALLS,
+            error_rate=Config.CIRCUIT_ERROR_RATE,
+            slow_call=Config.CIRCUIT_SLOW_CALL,
+            cooldown=Config.CIRCUIT_COOLDOWN,
+            max_cooldown=Config.CIRCUIT_MAX_COOLDOWN
+        )
+        self.strategy: KeySelectionStrategy = get_strategy(Config.KEY_SELECTION_STRATEGY)
+        self.ledger = LocalLedger()
+
+    def init_ledger(self, app):
+        """打开共享账本（需要在启动时的额度重置之前调用）"""
+        ledger = create_ledger(app.config.get('QUOTA_LEDGER', 'local'))
+        ledger.init_app(app)
+        with self._lock:
+            self.ledger = ledger
+            self.rate_limiter.clock = ledger.clock
+        logger.info(f"Key额度账本: {ledger.name}")
+
+    def init_app(self, app):
+        """加载key并启动后台同步线程"""
+        self.sync_interval = app.config.get('KEY_POOL_SYNC_INTERVAL', self.sync_interval)
+        self.rate_limiter.capacity = app.config.get('QPS_BURST', self.rate_limiter.capacity)
+        self.strategy = get_strategy(app.config.get('KEY_SELECTION_STRATEGY', self.strategy.name))
+        self.health.configure(app.config)
+        self.aimd.enabled = app.config.get('QPS_ADAPTIVE', self.aimd.enabled)
+        self.aimd.decrease = app.config.get('QPS_DECREASE_FACTOR', self.aimd.decrease)
+        self.aimd.increase = app.config.get('QPS_INCREASE', self.aimd.increase)
+        self.aimd.max_factor = app.config.get('QPS_MAX_FACTOR', self.aimd.max_factor)
+        try:
+            self.load()
+        except Exception as e:
+            logger.error(f"加载key池失败: {str(e)}")
+            db.session.rollback()
+
+        if self._sync_thread is None or not self._sync_thread.is_alive():
+            self._stop_event.clear()
+            self._sync_thread = threading.Thread(
+                target=self._sync_loop,
+                args=(app,),
+                name="KeyPool-Sync",
+                daemon=True
+            )
+            self._sync_thread.start()
+
+    def shutdown(self):
+        """停止后台同步"""
+        self._stop_event.set()
+
+    def _sync_loop(self, app):
+        """后台同步循环"""
+        while not self._stop_event.wait(self.sync_interval):
+            with app.app_context():
+                try:
+                    self.load()
+                except Exception as e:
+                    logger.error(f"同步key池失败: {str(e)}")
+                    db.session.rollback()
+
+    def load(self):
+        """从数据库同步活跃的key（需要在应用上下文中调用）"""
+        active_keys = APIKey.query.filter(APIKey.is_active == True).all()
+
+        with self.ledger.transaction(), self._lock:
+            # 被强制结束的worker来不及确认或退还预占，同步时释放
+            self.ledger.reclaim()
+            active_ids = set()
+            for api_key in active_keys:
+                active_ids.add(api_key.id)
+                self._sync(api_key)
+            for key_id in list(self._keys):
+                if key_id not in active_ids:
+                    del self._keys[key_id]
+                    self.rate_limiter.remove(key_id)
+                    self.aimd.remove(key_id)
+                    self.health.remove(key_id)
+            self._loaded = True
+        logger.debug(f"Key池已同步, 活跃key数: {len(active_ids)}")
+
+    def ensure_loaded(self):
+        """首次使用时加载"""
+        if not self._loaded:
+            self.load()
+
+    def _sync(self, api_key: APIKey):
+        """用数据库记录刷新快照（需要持有锁并处于账本事务中）"""
+        pooled = self._keys.get(api_key.id)
+        if pooled is None:
+            pooled = self._keys[api_key.id] = PooledKey(api_key)
+        else:
+            # 只有数据库记录了更晚的重置才采用数据库的计数（它不含尚未写回的使用次数）
+            reset = api_key.last_reset is not None and (pooled.last_reset is None
+                                                        or api_key.last_reset > pooled.last_reset)
+            pooled.update_from(api_key, reset=reset)
+        if self.ledger.shared:
+            self.ledger.merge(pooled, PooledKey.db_used(api_key), api_key.last_reset)
+
+    def sync_key(self, api_key: APIKey):
+        """管理端修改key后立即刷新对应快照"""
+        if not api_key.is_active:
+            self.remove(api_key.id)
+            return
+        with self.ledger.transaction(), self._lock:
+            self._sync(api_key)
+
+    def on_quota_reset(self, reset_time: datetime):
+        """每日额度重置后清零本地计数（预占保留）"""
+        self.ledger.reset(reset_time)
+        with self._lock:
+            for key in self._keys.values():
+                if key.last_reset is None or key.last_reset < reset_time:
+                    for search_type in SEARCH_TYPES:
+                        key.used[search_type] = 0
+                    key.last_reset = reset_time
+        logger.info("Key池已同步每日额度重置")
+
+    def remove(self, key_id: int):
+        """从池中移除key"""
+        with self._lock:
+            self._keys.pop(key_id, None)
+            self.rate_limiter.remove(key_id)
+            self.aimd.remove(key_id)
+            self.health.remove(key_id)
+
+    def _bucket(self, key: PooledKey, search_type: str):
+        rate = self.aimd.rate(key.id, search_type, key.qps_limits[search_type])
+        return self.rate_limiter.bucket(key.id, search_type, rate)
+
+    def _load(self, keys: Iterable[PooledKey], search_type: str):
+        """从共享账本读取最新计数（需要持有锁并处于账本事务中）"""
+        if self.ledger.shared:
+            self.ledger.load([(key, search_type, self._bucket(key, search_type)) for key in keys])
+
+    def _save(self, keys: Iterable[PooledKey], search_type: str):
+        """把计数写回共享账本（需要持有锁并处于账本事务中）"""
+        if self.ledger.shared:
+            self.ledger.save([(key, search_type, self._bucket(key, search_type)) for key in keys])
+
+    def try_reserve(self, search_type: str,
+                    exclude: Optional[Iterable[int]] = None) -> Tuple[Optional[PooledKey], float]:
+        """原子地选择一个当前有令牌的key，并预占一次额度和一个令牌
+
+        Returns:
+            (key, 0) 预占成功；
+            (None, wait) 所有可用key都在限速或熔断隔离中，wait 为最早可用的等待秒数；
+            (None, 0) 没有剩余额度的key。
+        """
+        excluded = set(exclude or ())
+        with self.ledger.transaction(), self._lock:
+            keys = [key for key in self._keys.values() if key.id not in excluded]
+            self._load(keys, search_type)
+            with_quota: List[PooledKey] = [key for key in keys if key.remaining(search_type) > 0]
+            if not with_quota:
+                return None, 0.0
+
+            candidates = [key for key in with_quota if self.health.allow(key.id)]
+            if not candidates:
+                return None, min(self.health.retry_after(key.id) for key in with_quota)
+
+            # 每个桶只读一次，避免先判断无令牌、计算等待时间时又补满而返回 0（被当作没有额度）
+            waits = [(key, self._bucket(key, search_type).wait_time()) for key in candidates]
+            ready = [key for key, wait in waits if wait <= 0]
+            if not ready:
+                return None, min(wait for _, wait in waits)
+
+            key = self.strategy.select(ready, search_type)
+            self._bucket(key, search_type).try_acquire()
+            self.health.acquire(key.id)
+            key.reserved[search_type] += 1
+            self._save([key], search_type)
+            return key, 0.0
+
+    def set_strategy(self, strategy: KeySelectionStrategy):
+        """切换key选择策略"""
+        with self._lock:
+            self.strategy = strategy
+
+    def record_latency(self, key_id: int, seconds: float, alpha: float = 0.2):
+        """记录一次上游响应时间"""
+        with self._lock:
+            key = self._keys.get(key_id)
+            if key is None:
+                return
+            if key.latency is None:
+                key.latency = seconds
+            else:
+                key.latency = alpha * seconds + (1 - alpha) * key.latency
+
+    def quota_snapshot(self) -> List[Tuple[int, str, int, int]]:
+        """各key各服务的 (key id, 搜索类型, 已用次数, 剩余次数)，取本进程最近一次读到的值，不访问账本"""
+        with self._lock:
+            return [
+                (key.id, search_type, key.used[search_type], key.remaining(search_type))
+                for key in self._keys.values()
+                for search_type in SEARCH_TYPES
+            ]
+
+    def has_available(self, search_type: str) -> bool:
+        """是否还有剩余额度的key（不预占）"""
+        with self.ledger.transaction(), self._lock:
+            self._load(self._keys.values(), search_type)
+            return any(key.remaining(search_type) > 0 for key in self._keys.values())
+
+    def total_rate(self, search_type: str) -> float:
+        """有剩余额度的key当前QPS上限之和（取本进程最近一次读到的额度，不访问账本）"""
+        with self._lock:
+            return sum(
+                self.aimd.rate(key.id, search_type, key.qps_limits[search_type])
+                for key in self._keys.values()
+                if key.remaining(search_type) > 0
+            )
+
+    def commit(self, key_id: int, search_type: str):
+        """调用成功，预占转为已用"""
+        with self.ledger.transaction(), self._lock:
+            key = self._keys.get(key_id)
+            if key is None:
+                return
+            self._load([key], search_type)
+            if key.reserved[search_type] > 0:
+                key.reserved[search_type] -= 1
+            key.used[search_type] += 1
+            self.aimd.on_success(key_id, search_type, key.qps_limits[search_type])
+            self._save([key], search_type)
+
+    def throttle(self, key_id: int, search_type: str) -> Optional[float]:
+        """上游对key限流，降低它的发送速度，返回降速后的QPS"""
+        with self._lock:
+            key = self._keys.get(key_id)
+            if key is None:
+                return None
+            rate = self.aimd.on_throttle(key_id, search_type, key.qps_limits[search_type])
+            self.rate_limiter.bucket(key_id, search_type, rate)
+            return rate
+
+    def rate_snapshot(self) -> List[Tuple[Tuple[int, str], float]]:
+        """各key各服务当前的QPS上限（含自适应调整）"""
+        with self._lock:
+            return [
+                ((key.id, search_type), self.aimd.rate(key.id, search_type, key.qps_limits[search_type]))
+                for key in self._keys.values()
+                for search_type in SEARCH_TYPES
+            ]
+
+    def refund(self, key_id: int, search_type: str):
+        """调用失败，退还预占的额度"""
+        with self.ledger.transaction(), self._lock:
+            key = self._keys.get(key_id)
+            if key is None:
+                return
+            self._load([key], search_type)
+            if key.reserved[search_type] > 0:
+                key.reserved[search_type] -= 1
+                self._save([key], search_type)
+
+    def mark_exhausted(self, key_id: int, search_type: str):
+        """标记某项服务的额度已用完"""
+        with self.ledger.transaction(), self._lock:
+            key = self._keys.get(key_id)
+            if key is None:
+                return
+            self._load([key], search_type)
+            key.used[search_type] = key.search_limits[search_type]
+            self._save([key], search_type)
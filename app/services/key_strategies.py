@@ -0,0 +1,72 @@
+import random
+from typing import Dict, List, Type
+
+
+class KeySelectionStrategy:
+    """key选择策略基类
+
+    select 在key池的锁内被调用，candidates 均有剩余额度且当前有QPS令牌。
+    """
+
+    name = None
+
+    def select(self, candidates: List, search_type: str):
+        raise NotImplementedError
+
+
+class RandomStrategy(KeySelectionStrategy):
+    """均匀随机选择"""
+
+    name = 'random'
+
+    def select(self, candidates: List, search_type: str):
+        return random.choice(candidates)
+
+
+class LeastUsedStrategy(KeySelectionStrategy):
+    """选择已用次数（含预占）最少的key"""
+
+    name = 'least_used'
+
+    def select(self, candidates: List, search_type: str):
+        fewest = min(key.used[search_type] + key.reserved[search_type] for key in candidates)
+        return random.choice([
+            key for key in candidates
+            if key.used[search_type] + key.reserved[search_type] == fewest
+        ])
+
+
+class WeightedRemainingStrategy(KeySelectionStrategy):
+    """按剩余额度加权随机选择，快用完的key被选中的概率更低"""
+
+    name = 'weighted_remaining'
+
+    def select(self, candidates: List, search_type: str):
+        weights = [key.remaining(search_type) for key in candidates]
+        return random.choices(candidates, weights=weights)[0]
+
+
+class LatencyAwareStrategy(KeySelectionStrategy):
+    """选择最近上游延迟最低的key，尚无延迟记录的key优先试探"""
+
+    name = 'latency'
+
+    def select(self, candidates: List, search_type: str):
+        unknown = [key for key in candidates if key.latency is None]
+        if unknown:
+            return random.choice(unknown)
+        return min(candidates, key=lambda key: key.latency)
+
+
+STRATEGIES: Dict[str, Type[KeySelectionStrategy]] = {
+    strategy.name: strategy
+    for strategy in (RandomStrategy, LeastUsedStrategy, WeightedRemainingStrategy, LatencyAwareStrategy)
+}
+
+
+def get_strategy(name: str) -> KeySelectionStrategy:
+    """按名称创建策略"""
+    strategy = STRATEGIES.get(name)
+    if strategy is None:
+        raise ValueError(f"未知的key选择策略: {name}, 可选: {', '.join(STRATEGIES)}")
+    return strategy()
@@ -0,0 +1,180 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+from app.core.config import Config
+
+# 默认的直方图分桶(秒)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Family:
+    """一组同名指标"""
+
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> Iterable[str]:
+        return []
+
+
+class Counter(_Family):
+    """只增不减的计数"""
+
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield f'{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}'
+
+
+class Histogram(_Family):
+    """分桶统计的耗时分布"""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # 每组标签: [各分桶计数(非累计，最后一个为 +Inf), 总和, 总数]
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        """统计 with 块的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def _samples(self):
+        with self._lock:
+            values = sorted((label_values, (list(state[0]), state[1], state[2]))
+                            for label_values, state in self._values.items())
+        for label_values, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, label_values, f'le="{_format_value(float(bound))}"')
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labels, label_values)
+            yield f'{self.name}_sum{labels} {_format_value(total)}'
+            yield f'{self.name}_count{labels} {count}'
+
+
+class Gauge(_Family):
+    """输出时通过回调读取的当前值"""
+
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...],
+                 collect: Callable[[], Iterable[Tuple[Tuple, float]]]):
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+
+    def _samples(self):
+        for label_values, value in self.collect():
+            yield f'{self.name}{_format_labels(self.labels, tuple(label_values))} {_format_value(value)}'
+
+
+class MetricsRegistry:
+    """进程内的运行指标，以 Prometheus 文本格式输出
+
+    计数和直方图在请求路径上直接更新（一次加锁和二分查找）；
+    key额度、任务队列等状态量在抓取时通过回调读取。
+    多worker部署时每个进程各自统计。
+    """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self._families: List[_Family] = []
+        self.enabled = Config.METRICS_ENABLED
+
+        self.request_seconds = self.histogram(
+            'amkm_proxy_request_seconds', '代理搜索请求的总耗时', ('search_type', 'source'))
+        self.stage_seconds = self.histogram(
+            'amkm_proxy_stage_seconds', '代理搜索请求各阶段的耗时(key_selection/upstream/serialization)',
+            ('stage', 'search_type'))
+        self.upstream_seconds = self.histogram(
+            'amkm_upstream_seconds', '每个key请求上游的耗时', ('key_id', 'search_type'))
+        self.upstream_responses = self.counter(
+            'amkm_upstream_responses_total', '上游响应的 infocode 计数', ('search_type', 'infocode'))
+        self.crawler_pages = self.counter(
+            'amkm_crawler_pages_total', '多边形任务已获取的页数', ('search_type',))
+
+    def init_app(self, app):
+        """读取应用配置"""
+        self.enabled = app.config.get('METRICS_ENABLED', self.enabled)
+
+    def counter(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name: str, documentation: str, labels: Tuple[str, ...],
+              collect: Callable[[], Iterable[Tuple[Tuple, float]]]) -> Gauge:
+        return self._register(Gauge(name, documentation, labels, collect))
+
+    def _register(self, family: _Family):
+        self._families.append(family)
+        return family
+
+    def render(self) -> str:
+        """Prometheus 文本格式"""
+        lines = []
+        for family in self._families:
+            lines.extend(family.render())
+        return '\n'.join(lines) + '\n'
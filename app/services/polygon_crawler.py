@@ -1,18 +1,19 @@
+import math
 import threading
 import time
-from typing import Dict, List
-import csv
-import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
 import requests
 from datetime import datetime, timedelta
 from app.models.polygon_task import PolygonTask
+from app.models.polygon_task_progress import PolygonTaskProgress
 from app.core.database import db
 from app.core.logger import logger
 from flask import current_app
-from app.core.extensions import task_executor
-from app.api.proxy import proxy_request  # 导入proxy模块的函数
-from flask import request, Request
-from werkzeug.test import EnvironBuilder
+from app.core.extensions import task_executor, key_pool, metrics
+from app.services.result_writer import open_result_writer, result_filename
+from app.services.search_client import SearchClient
+from app.utils.polygon import Point, format_polygon, parse_polygon, split_quadrants, sub_region
 import pytz
 
 from app.services.key_manager import KeyManager
@@ -20,6 +21,534 @@ from app.services.key_manager import KeyManager
 # 获取东八区时区
 tz = pytz.timezone('Asia/Shanghai')
 
+
+def _type_matches(code: str, typecode: str) -> bool:
+    """types 参数中的类型代码是否包含POI的 typecode（xx0000 为大类，xxxx00 为中类）"""
+    if code.endswith('0000'):
+        return typecode[:2] == code[:2]
+    if code.endswith('00'):
+        return typecode[:4] == code[:4]
+    return typecode == code
+
+
+class _TypeFetch:
+    """任务中一条查询在一个区域内的抓取状态
+
+    name 为查询名（进度数据的键），groups 为查询覆盖的类型组（用于给POI标注类型），
+    path 为区域在任务多边形中的四分路径（见 app.utils.polygon.sub_region），整个多边形为空路径。
+    """
+
+    def __init__(self, name: str, type_codes: str, groups: List[str], polygon: List[Point],
+                 first_page: int = 1, path: Tuple[int, ...] = ()):
+        self.poi_type = name
+        self.type_codes = type_codes
+        self.groups = groups
+        self.polygon = polygon
+        self.path = path
+        self.first_page = first_page
+        self.started = False                    # 首页是否已请求
+        self.total_pages: Optional[int] = None  # 首页返回后确定
+        self.next_page = first_page + 1         # 下一个要请求的页
+        self.next_write = first_page            # 下一个要写入的页
+        self.pages: Dict[int, Dict] = {}        # 已返回、等待按顺序写入的页
+        self.done = False
+
+
+class _TaskRun:
+    """一次任务执行：规划查询、并发抓取、按顺序写入
+
+    规划：所有类型组合并为一条查询并探测总数，探测请求就是该查询的第1页，结果直接复用；
+    POI的类型组按其 typecode 重新标注。查询计划写入进度数据（各查询的 types/groups），
+    任务恢复时沿用，不再探测。
+    抓取：见 PolygonCrawler.execute_task。
+    """
+
+    def __init__(self, task: PolygonTask, stop_event=None):
+        config = current_app.config
+        self.task = task
+        self.stop_event = stop_event
+        self.app = current_app._get_current_object()
+        self.poi_types: Dict[str, str] = config['POI_TYPES']
+        self.result_cap = config['CRAWLER_RESULT_CAP']
+        self.max_depth = config['CRAWLER_MAX_DEPTH']
+        self.plan_queries = config['CRAWLER_QUERY_PLAN']
+        self.workers = PolygonCrawler._concurrency()
+        self.polygon = parse_polygon(task.polygon.strip().replace('\n', '').replace('\r', '').replace(' ', ''))
+        # 类型组 -> 类型代码
+        self.group_codes: Dict[str, List[str]] = {group: codes.split('|') for group, codes in self.poi_types.items()}
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.units: List[_TypeFetch] = []
+        self.seen: Dict[str, set] = {}
+        # 各查询已拆分的区域路径，写入进度后恢复时直接展开，不再探测
+        self.splits: Dict[str, set] = {}
+        self.splits_changed = False
+        self.halt: Optional[str] = None     # 需要中止时任务的新状态
+        self.calls = 0                      # 本次执行的上游请求数（含探测）
+        self.writer = open_result_writer(task.result_file, config['CRAWLER_FSYNC'])
+        # 进度数据只在开始时读取一次，之后在内存中更新，按 _checkpoint 的条件批量提交
+        self.progress: Dict[str, Dict] = task.load_progress()
+        self.checkpoint_pages = config['CRAWLER_CHECKPOINT_PAGES']
+        self.checkpoint_seconds = config['CRAWLER_CHECKPOINT_SECONDS']
+        self.dirty = set()                  # 上次提交后有变化的查询
+        self.touched = set()                # 上次提交后写入过结果的查询
+        self.pending_pages = 0              # 上次提交后写入的页数
+        self.last_checkpoint = time.monotonic()
+        # 最后写入的 (查询, 页码)，提交进度时才写到任务上，失败时任务上保留的是已提交的位置
+        self.position: Optional[Tuple[str, int]] = None
+
+    def run(self) -> Optional[str]:
+        """执行任务，全部完成时返回 None，需要中止时返回任务的新状态"""
+        self.executor = ThreadPoolExecutor(max_workers=self.workers,
+                                           thread_name_prefix=f'Crawler-{self.task.task_id}')
+        try:
+            plan = self._load_plan()
+            planned = None
+            if plan is not None and not self._rewind(plan):
+                # 结果文件比进度记录的短，已记录的进度不可信，从头开始
+                self.writer.truncate(0)
+                plan = None
+            if plan is None:
+                plan, probes = self._plan()
+                if self.halt is not None:
+                    return self.halt
+                if self.plan_queries:
+                    # 结果数达到翻页上限时还要按区域拆分，实际请求数会更多
+                    planned = probes + sum(max(0, entry['total_pages'] - 1) for entry in plan)
+                    capped = any(entry['total_count'] >= self.result_cap for entry in plan)
+                    logger.info(f"Task {self.task.task_id} planned {len(plan)} queries for "
+                                f"{len(self.poi_types)} type groups, {'at least ' if capped else ''}"
+                                f"{planned} calls ({probes} probes)")
+            self._start(plan)
+            self._crawl()
+            # 停止或完成时提交剩余的进度
+            self._checkpoint(force=True)
+            if self.halt is None:
+                logger.info(f"Task {self.task.task_id} finished with {self.calls} calls"
+                            + (f", planned {planned}" if planned is not None else ''))
+            return self.halt
+        except Exception:
+            # 上次提交之后缓冲的行没有对应的进度，恢复时会重新抓取，不写入文件
+            self.writer.discard()
+            raise
+        finally:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.writer.close()
+
+    def fetch(self, polygon: List[Point], type_codes: str, page: int) -> Tuple[Dict, int]:
+        with self.app.app_context():
+            return PolygonCrawler._fetch_page(polygon=format_polygon(polygon), types=type_codes, page=page, offset=25)
+
+    def _no_key(self, result: Dict, status_code: int) -> bool:
+        return status_code == 503 and result.get('info_code') == '1008611'
+
+    # ---------- 规划 ----------
+
+    def _load_plan(self) -> Optional[List[Dict]]:
+        """进度数据中已有查询计划且包含当前查询时沿用（全部完成的计划也沿用，不再请求）"""
+        plan = [dict(entry, name=name) for name, entry in self.progress.items() if 'types' in entry]
+        if not any(entry['name'] == self.task.current_type for entry in plan):
+            return None
+        return plan
+
+    def _plan(self) -> Tuple[List[Dict], int]:
+        """生成查询计划并写入进度数据，返回 (计划, 探测请求数)
+
+        关闭 CRAWLER_QUERY_PLAN 时每个类型组一条查询，不探测。
+        开启时按类型组探测总数（见 _probe_groups）：稀疏的类型组合并为一条查询，密集的单独查询，
+        单个类型组仍达到翻页上限时由抓取阶段按区域拆分。探测返回的第1页直接作为查询的第1页。
+        """
+        calls = self.calls
+        if self.plan_queries:
+            nodes = self._probe_groups(list(self.poi_types))
+            if self.halt is not None:
+                return [], self.calls - calls
+        else:
+            nodes = [([group], None) for group in self.poi_types]
+
+        plan, progress = [], {}
+        # 记录规划时的文件位置，第一次提交进度前中断时恢复也能截掉之后写入的行
+        offset = self.writer.size
+        for groups, result in nodes:
+            count = int(result.get('count', 0)) if result is not None else 0
+            entry = {
+                'types': self._types(groups),
+                'groups': groups,
+                'total_pages': (min(count, self.result_cap) + 24) // 25,  # 每页25条
+                'processed_pages': 0,
+                'total_count': count,
+                'processed_count': 0,
+                'completed': False,
+                'file_offset': offset
+            }
+            name = self._query_name(groups)
+            progress[name] = entry
+            plan.append(dict(entry, name=name))
+            if result is not None:
+                plan[-1]['result'] = result
+        self.progress = progress
+        PolygonTaskProgress.save(self.task.id, progress, replace=True)
+        self.task.progress_data = '{}'
+        self.task.total_progress = 0
+        self.task.current_type = plan[0]['name']
+        self.task.current_page = 1
+        self.task.updated_at = datetime.now(tz)
+        db.session.commit()
+        return plan, self.calls - calls
+
+    def _probe_groups(self, groups: List[str]) -> List[Tuple[List[str], Dict]]:
+        """探测类型组合并查询的总数，返回 [(类型组, 探测返回的第1页)]
+
+        总数低于翻页上限（或只剩一个类型组）时作为一条查询；否则把类型组一分为二分别探测。
+        自上而下拆分：总数稀少的类型组一直留在合并查询中，只有密集的才逐级分出、单独探测。
+        逐组探测后再合并不会更省请求：各组的探测页已经取到，合并查询要从第1页重新请求。
+        """
+        result, status_code = self.fetch(self.polygon, self._types(groups), 1)
+        self.calls += 1
+        if self._no_key(result, status_code):
+            logger.warning(f"Task {self.task.task_id} received info_code 1008611 while planning")
+            self.halt = 'waiting'
+            return []
+        count = int(result.get('count', 0))
+        if count < self.result_cap or len(groups) == 1:
+            return [(groups, result)]
+        logger.info(f"Task {self.task.task_id} types {self._query_name(groups)} have {count} results, "
+                    f"probing {len(groups)} type groups in two halves")
+        middle = len(groups) // 2
+        nodes = self._probe_groups(groups[:middle])
+        if self.halt is None:
+            nodes += self._probe_groups(groups[middle:])
+        return nodes
+
+    def _types(self, groups: List[str]) -> str:
+        """类型组合并后的 types 参数（重复的代码只保留一次）"""
+        return '|'.join(dict.fromkeys(code for group in groups for code in self.group_codes[group]))
+
+    @staticmethod
+    def _query_name(groups: List[str]) -> str:
+        """查询名：单个类型组用组名，多个组用 + 连接（超过 current_type 的长度时缩写）"""
+        name = '+'.join(groups)
+        if len(name) > 50:
+            name = f"{groups[0]}+{len(groups) - 1}"
+        return name
+
+    def _rewind(self, plan: List[Dict]) -> bool:
+        """把结果文件截回最后一次提交进度时的位置，文件比该位置短时返回 False
+
+        写入结果后、提交进度前中断时，文件末尾是进度里没有记录的行，恢复后会被重新抓取，
+        截掉后不会重复写入。进度中没有记录文件位置时（旧任务）保留原文件。
+        """
+        offsets = [entry['file_offset'] for entry in plan if 'file_offset' in entry]
+        size = self.writer.size
+        if not offsets:
+            return True
+        checkpoint = max(offsets)
+        if size > checkpoint:
+            logger.warning(f"Task {self.task.task_id} truncating {self.task.result_file} from {size} "
+                           f"to {checkpoint} (rows written after the last checkpoint)")
+            self.writer.truncate(checkpoint)
+        elif size < checkpoint:
+            logger.warning(f"Task {self.task.task_id} {self.task.result_file} is shorter than the "
+                           f"checkpoint ({size} < {checkpoint}), restarting the task")
+            return False
+        return True
+
+    def _written_ids(self, entry: Dict) -> set:
+        """读出查询已写入结果文件的POI id（file_start 到 file_offset 之间的行）"""
+        start, end = entry.get('file_start'), entry.get('file_offset')
+        if start is None or end is None or end > self.writer.size:
+            return set()
+        return self.writer.ids(start, end)
+
+    def _start(self, plan: List[Dict]):
+        """生成抓取单元：跳过已完成的查询，当前查询从上次写到的区域和页码之后继续，
+        其余查询从头开始；已探测的第1页直接放入"""
+        probed = []
+        for entry in plan:
+            if entry.get('completed'):
+                continue
+            self.splits[entry['name']] = {tuple(path) for path in entry.get('splits', [])}
+            if (not self.units and 'result' not in entry and entry.get('processed_pages')
+                    and entry['name'] == self.task.current_type):
+                self.units += self._resume(entry)
+                continue
+            state = _TypeFetch(entry['name'], entry['types'], entry['groups'], self.polygon)
+            if 'result' in entry:
+                self.units.append(state)
+                probed.append((state, entry['result']))
+            else:
+                self.units += self._expand(state)
+        for state, result in probed:
+            state.started = True
+            self._accept(state, 1, result)
+
+    def _resume(self, entry: Dict) -> List[_TypeFetch]:
+        """从当前查询最后写入的页之后继续，已写入的POI id 用于去重，进度计数累加"""
+        self.seen[entry['name']] = self._written_ids(entry)
+        region = tuple(entry.get('region') or ())
+        page = self.task.current_page or 0
+        # 区域的最后一页已写入时从下一个区域开始
+        next_page = page + 1 if page < entry.get('region_pages', 0) else None
+        logger.info(f"Task {self.task.task_id} resuming {entry['name']} region {list(region)} "
+                    + (f"at page {next_page}" if next_page else "after its last page"))
+        return self._resume_regions(entry, region, next_page)
+
+    def _split(self, state: _TypeFetch) -> List[_TypeFetch]:
+        """把区域切成四个子区域（跳过与任务多边形不相交的）"""
+        return [
+            _TypeFetch(state.poi_type, state.type_codes, state.groups, quadrant, path=state.path + (index,))
+            for index, quadrant in enumerate(split_quadrants(state.polygon))
+            if quadrant
+        ]
+
+    def _expand(self, state: _TypeFetch) -> List[_TypeFetch]:
+        """按记录的拆分展开区域"""
+        if state.path not in self.splits.get(state.poi_type, ()):
+            return [state]
+        return [unit for child in self._split(state) for unit in self._expand(child)]
+
+    def _resume_regions(self, entry: Dict, path: Tuple[int, ...], page: Optional[int]) -> List[_TypeFetch]:
+        """从 path 区域的 page 页继续（page 为 None 时该区域已取完），之后依次是各级祖先中排在它后面的子区域"""
+        name, type_codes, groups = entry['name'], entry['types'], entry['groups']
+        leaf = sub_region(self.polygon, path)
+        if not leaf:
+            # 区域已不存在（任务多边形或拆分方式改变），从整个多边形重新开始
+            return self._expand(_TypeFetch(name, type_codes, groups, self.polygon))
+        regions = [_TypeFetch(name, type_codes, groups, leaf, page, path)] if page else []
+        for depth in range(len(path), 0, -1):
+            parent = path[:depth - 1]
+            quadrants = split_quadrants(sub_region(self.polygon, parent))
+            for index in range(path[depth - 1] + 1, len(quadrants)):
+                if quadrants[index]:
+                    regions += self._expand(_TypeFetch(name, type_codes, groups, quadrants[index],
+                                                       path=parent + (index,)))
+        return regions
+
+    # ---------- 抓取 ----------
+
+    def _crawl(self):
+        """每条查询的首页返回总数后，其余页和后面查询的首页并发请求，按顺序写入
+
+        收到停止信号后不再请求新的页，但已返回、排在未请求的页之后的页（并发时提前取到的）
+        写不进去，恢复时要重新请求；因此先补齐它们之前缺的页，让这些页写入后再停止。
+        补请求的页都会写入，不多用额度，且只在已缓存的页之前选，很快结束。没有可用key时不补。
+        """
+        in_flight = {}
+        head = self._write_ready(0)    # 第一个还没写完的区域
+        drain = False                  # 停止后是否补齐缺页
+        while head < len(self.units):
+            if self.halt is None and self.stop_event and self.stop_event.is_set():
+                self.halt = 'pending'
+                drain = True
+            # 提交请求，中止时只等待已发出的请求
+            while len(in_flight) < self.workers:
+                if self.halt is None:
+                    item = self._next_page(head, len(in_flight))
+                elif drain:
+                    item = self._drain_page(head, len(in_flight))
+                else:
+                    item = None
+                if item is None:
+                    break
+                state, page = item
+                in_flight[self.executor.submit(self.fetch, state.polygon, state.type_codes, page)] = (state, page)
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                state, page = in_flight.pop(future)
+                result, status_code = future.result()
+                self.calls += 1
+                # 没有可用key：首页放回等待队列，其余页暂停
+                if self._no_key(result, status_code):
+                    if self.halt is None:
+                        logger.warning(f"Task {self.task.task_id} received info_code 1008611 on "
+                                       f"{state.poi_type} page {page}, stopping")
+                    self.halt = self.halt or ('waiting' if page == state.first_page else 'pending')
+                    drain = False
+                    continue
+                self._accept(state, page, result)
+            head = self._write_ready(head)
+
+    def _accept(self, state: _TypeFetch, page: int, result: Dict):
+        """收下一页结果；区域首页的结果数达到翻页上限时拆成四个子区域"""
+        if state.done:
+            return
+        if page == state.first_page:
+            total_count = int(result.get('count', 0))
+            if page == 1 and total_count >= self.result_cap:
+                if len(state.path) < self.max_depth:
+                    children = self._split(state)
+                    logger.info(f"Task {self.task.task_id} {state.poi_type} region {list(state.path)} has "
+                                f"{total_count} results, split into {len(children)} sub-regions")
+                    state.done = True
+                    self.splits.setdefault(state.poi_type, set()).add(state.path)
+                    self.splits_changed = True
+                    index = self.units.index(state)
+                    self.units[index:index + 1] = children
+                    return
+                logger.warning(f"Task {self.task.task_id} {state.poi_type} region {list(state.path)} has "
+                               f"{total_count} results at max depth {self.max_depth}, "
+                               f"only the first {self.result_cap} can be fetched")
+            # 超过翻页上限的页取不到，不请求
+            state.total_pages = (min(total_count, self.result_cap) + 24) // 25  # 每页25条
+        state.pages[page] = result
+
+    def _next_page(self, head: int, in_flight: int, end: int = None) -> Optional[Tuple[_TypeFetch, int]]:
+        """选出下一个要请求的 (区域, 页码)，没有可请求的页时返回 None
+
+        优先请求靠前的区域，保证写入不被阻塞；已返回但还不能写入的页
+        超过 workers * 4 时只请求正在写入的区域，限制内存占用。end 为只考虑的区域上限（不含）。
+        """
+        buffered = in_flight + sum(len(state.pages) for state in self.units[head:])
+        for index in range(head, len(self.units) if end is None else end):
+            state = self.units[index]
+            if state.done:
+                continue
+            if index > head and buffered >= self.workers * 4:
+                return None
+            if not state.started:
+                state.started = True
+                return state, state.first_page
+            if state.total_pages is not None and state.next_page <= state.total_pages:
+                page = state.next_page
+                state.next_page += 1
+                return state, page
+        return None
+
+    def _drain_page(self, head: int, in_flight: int) -> Optional[Tuple[_TypeFetch, int]]:
+        """停止后要补请求的页：只在已返回、还不能写入的页之前选，没有这样的页时返回 None"""
+        waiting = [index for index in range(head, len(self.units))
+                   if self.units[index].pages and not self.units[index].done]
+        if not waiting:
+            return None
+        # 最后一个有缓存页的区域自身缺的页已经请求过（同一区域按页码顺序请求）
+        return self._next_page(head, in_flight, waiting[-1])
+
+    def _labels(self, poi: Dict, groups: List[str]) -> List[str]:
+        """POI所属的类型组：查询中类型代码与 typecode 匹配（完整代码、中类或大类）的每个组，
+        匹配不到时取查询的第一个组
+
+        与每个类型组单独查询时一致，同时属于多个类型组的POI在每个组下各写一行。
+        """
+        typecodes = [code for code in (poi.get('typecode') or '').split('|') if code]
+        labels = [
+            group for group in groups
+            if any(_type_matches(code, typecode) for code in self.group_codes[group] for typecode in typecodes)
+        ]
+        return labels or groups[:1]
+
+    def _write_ready(self, head: int) -> int:
+        """按查询、区域、页码顺序写入已连续返回的页并更新进度，返回第一个还没写完的区域
+
+        seen 记录各查询已写入的POI id，相邻子区域边界上重复返回的POI只写一次；
+        查询第一次写入时重置它的进度计数，之后的子区域（以及恢复后的页）累加。
+        进度中记录当前区域的页数、结果文件的位置（file_start 为查询开始写入的位置）和
+        已拆分的区域，恢复时据此从下一页继续、截掉进度之后写入的行、不再探测已拆分的区域。
+        """
+        task, units, progress = self.task, self.units, self.progress
+        written = False
+        while head < len(units):
+            state = units[head]
+            while not state.done and state.next_write in state.pages:
+                page = state.next_write
+                result = state.pages.pop(page)
+                pois = result.get('pois')
+                state.next_write += 1
+                if not pois:
+                    # 首页为空则跳过该区域，其余页为空说明该区域已取完
+                    state.done = True
+                    break
+                ids = self.seen.get(state.poi_type)
+                if ids is None:
+                    # 初始化当前查询的进度数据
+                    ids = self.seen[state.poi_type] = set()
+                    progress[state.poi_type] = dict(
+                        progress.get(state.poi_type, {}),
+                        total_pages=0,
+                        processed_pages=0,
+                        total_count=0,
+                        processed_count=0,
+                        completed=False,  # 添加完成标识
+                        file_start=self.writer.boundary()
+                    )
+                type_progress = progress[state.poi_type]
+                if page == 1:
+                    # 恢复时从中间页开始的区域，总数在第一次执行时已经计入
+                    type_progress['total_pages'] += state.total_pages
+                    type_progress['total_count'] += int(result.get('count', 0))
+                new_pois = [poi for poi in pois if poi.get('id') not in ids]
+                ids.update(poi.get('id') for poi in new_pois)
+                rows = [(poi, label) for poi in new_pois for label in self._labels(poi, state.groups)]
+                self.writer.write([poi for poi, _ in rows], [label for _, label in rows])
+                type_progress['processed_pages'] += 1
+                type_progress['processed_count'] += len(new_pois)
+                type_progress['region_pages'] = state.total_pages
+                self.touched.add(state.poi_type)
+                self.dirty.add(state.poi_type)
+                self.pending_pages += 1
+                if state.path:
+                    type_progress['region'] = list(state.path)
+                else:
+                    type_progress.pop('region', None)
+                self.position = (state.poi_type, page)
+                written = True
+                if state.next_write > state.total_pages:
+                    state.done = True
+            if not state.done:
+                break
+            state.pages.clear()
+            head += 1
+            if head == len(units) or units[head].poi_type != state.poi_type:
+                # 查询的最后一个区域已写完
+                type_progress = progress.setdefault(state.poi_type, {
+                    'total_pages': 0, 'processed_pages': 0, 'total_count': 0, 'processed_count': 0
+                })
+                type_progress['completed'] = True  # 标记为已完成
+                type_progress.pop('region', None)
+                type_progress.pop('splits', None)
+                self.splits.pop(state.poi_type, None)
+                self.dirty.add(state.poi_type)
+                written = True
+                logger.info(f"Task {task.task_id} {state.poi_type} completed")
+        if self.splits_changed:
+            for name, paths in self.splits.items():
+                if paths:
+                    progress.setdefault(name, {})['splits'] = sorted(list(path) for path in paths)
+                    self.dirty.add(name)
+            self.splits_changed = False
+            written = True
+        if written:
+            self._checkpoint()
+        return head
+
+    def _checkpoint(self, force: bool = False):
+        """提交进度
+
+        距上次提交已写入 CRAWLER_CHECKPOINT_PAGES 页或超过 CRAWLER_CHECKPOINT_SECONDS 秒时
+        （force 为 True 时立即）先把缓冲的结果写入文件，再写入有变化的查询进度、总体进度和
+        当前位置，一次提交。进程在两次提交之间中断时，恢复后截掉未提交的结果重新抓取。
+        """
+        if not self.dirty:
+            return
+        if not force and self.pending_pages < self.checkpoint_pages \
+                and time.monotonic() - self.last_checkpoint < self.checkpoint_seconds:
+            return
+        task = self.task
+        offset = self.writer.checkpoint()
+        for name in self.touched:
+            self.progress[name]['file_offset'] = offset
+        PolygonTaskProgress.save(task.id, self.progress, self.dirty)
+        if self.position is not None:
+            task.current_type, task.current_page = self.position
+        task.progress_data = '{}'
+        task.total_progress = PolygonTaskProgress.percent(self.progress.values())
+        task.updated_at = datetime.now(tz)
+        db.session.commit()
+        self.dirty, self.touched = set(), set()
+        self.pending_pages = 0
+        self.last_checkpoint = time.monotonic()
+
+
 class PolygonCrawler:
     """多边形POI爬取服务"""
     _lock = threading.Lock()
@@ -31,14 +560,20 @@ class PolygonCrawler:
         return current_app.config['POI_TYPES']
     
     @staticmethod
-    def create_task(task_id: str, name: str, polygon: str, priority: int = 0) -> PolygonTask:
-        """创建新任务"""
+    def create_task(task_id: str, name: str, polygon: str, priority: int = 0,
+                    result_format: str = None) -> PolygonTask:
+        """创建新任务
+
+        result_format 为结果文件格式（见 result_writer.RESULT_FORMATS），默认取 CRAWLER_RESULT_FORMAT，
+        体现在结果文件的扩展名上；格式不支持或缺少依赖时抛出 ValueError。
+        """
+        result_file = result_filename(task_id, result_format or current_app.config['CRAWLER_RESULT_FORMAT'])
         task = PolygonTask(
             task_id=task_id,
             name=name,
             polygon=polygon,
             priority=priority,
-            result_file=f"{task_id}_poi.csv",
+            result_file=result_file,
             status='waiting'
         )
         db.session.add(task)
@@ -83,8 +618,7 @@ class PolygonCrawler:
             if active_task_count >= 3 and current_hour >= 9:
                 return False
             # 检查是否有可用的key
-            key_manager = KeyManager()
-            if not key_manager.get_available_key(search_type='polygon'):
+            if not KeyManager.has_available_key(search_type='polygon'):
                 logger.error("No available API key")
                 return False
                 
@@ -120,7 +654,13 @@ class PolygonCrawler:
 
     @staticmethod
     def execute_task(task_id: str,stop_event=None) -> bool:
-        """执行任务（供任务执行器调用）"""
+        """执行任务（供任务执行器调用）
+
+        先规划查询（见 _TaskRun），再并发抓取：每条查询的首页返回总数后，其余页和后面查询的首页
+        并发请求（并发数见 _concurrency），结果按查询、区域、页码顺序写入CSV并记录进度，
+        current_page 是最后一次提交进度时已连续写入的最后一页。
+        恢复执行时跳过已完成的查询，从最后写入的页之后继续，结果文件截回最后一次提交的进度。
+        """
         task = PolygonTask.query.filter_by(task_id=task_id).first()
         if not task:
             return False
@@ -129,115 +669,15 @@ class PolygonCrawler:
             task.status = 'running'
             task.updated_at = datetime.now(tz)
             db.session.commit()
-            
-            # 获取所有POI类型
-            poi_types = PolygonCrawler.get_poi_types()
-            
-            # 如果没有当前类型，从第一个开始
-            if not task.current_type or task.current_type not in poi_types:
-                task.current_type = next(iter(poi_types))
-                task.current_page = 1
-                db.session.commit()
-            
-            # 从当前类型开始遍历
-            current_found = False
-            for poi_type, type_codes in poi_types.items():
-                # 跳过直到找到当前类型
-                if not current_found and poi_type != task.current_type:
-                    continue
-                current_found = True
-                
-                task.current_type = poi_type
-                # 使用当前页码继续执行，不重置为1
-                if poi_type not in task.progress:
-                    task.current_page = 1
-                # 否则保持当前页码
-                db.session.commit()
-                
-                if stop_event and stop_event.is_set():
-                    task.status = 'pending'
-                    db.session.commit()
-                    return False
-                # 获取当前页数据
-                polygon = task.polygon.strip().replace('\n', '').replace('\r', '').replace(' ', '')
-                result, status_code = PolygonCrawler._fetch_page(
-                    polygon= polygon,
-                    types=type_codes,
-                    page=task.current_page,
-                    offset=25
-                )
-                # 检查是否返回503或info_code为1008611
-                if status_code == 503 and (result and result.get('info_code') == '1008611'):
-                    logger.warning(f"Task {task.task_id} received info_code 1008611, setting to waiting")
-                    task.status = 'waiting'
-                    db.session.commit()
-                    return False
-                if status_code != 200:
-                    raise Exception(f"Proxy request failed with status {status_code}")
-                if not result or not result.get('pois'):
-                    continue
-                    
-                # 保存第一页数据
-                PolygonCrawler._save_to_csv(task.result_file, result['pois'], task.current_type)
-                
-                # 计算总页数并初始化进度数据
-                total_count = int(result.get('count', 0))
-                total_pages = (total_count + 24) // 25  # 修改为25条
-                
-                # 初始化或更新当前类型的进度数据
-                progress = task.progress
-                progress[task.current_type] = {
-                    'total_pages': total_pages,
-                    'processed_pages': 1,  # 第一页已处理
-                    'total_count': total_count,
-                    'processed_count': len(result['pois']),
-                    'completed': False  # 添加完成标识
-                }
-                task.progress = progress  # 使用setter方法
-                task.updated_at = datetime.now(tz)
+
+            halt = _TaskRun(task, stop_event).run()
+            if halt is not None:
+                logger.warning(f"Task {task.task_id} stopped at {task.current_type} page {task.current_page}, "
+                               f"setting to {halt}")
+                task.status = halt
                 db.session.commit()
-                time.sleep(0.2)
-                # 获取剩页面
-                for page in range(2, total_pages + 1):
-                    task.current_page = page
-                    result, status_code = PolygonCrawler._fetch_page(
-                        polygon=polygon,
-                        types=type_codes,
-                        page=page,
-                        offset=25
-                    )
-                    
-                    # 检查是否返回503或info_code为1008611
-                    if status_code == 503 and (result and result.get('info_code') == '1008611'):
-                        logger.warning(f"Task {task.task_id} received info_code 1008611, setting to pending")
-                        task.status = 'pending'
-                        db.session.commit()
-                        return False
-                    if status_code != 200:
-                        raise Exception(f"Proxy request failed with status {status_code}")
-                    if not result or not result.get('pois'):
-                        progress = task.progress
-                        progress[task.current_type]['completed'] = True  # 标记为已完成
-                        task.progress = progress
-                        task.updated_at = datetime.now(tz)
-                        time.sleep(1)
-                        logger.info(f"Task {task.task_id} {task.current_type} completed")
-                        break
-                    PolygonCrawler._save_to_csv(task.result_file, result['pois'], task.current_type)
-                    
-                    # 更新进度数据
-                    progress = task.progress
-                    progress[task.current_type]['processed_pages'] += 1
-                    progress[task.current_type]['processed_count'] += len(result['pois'])
-                    task.current_page = page
-                    task.progress = progress
-                    task.updated_at = datetime.now(tz)
-                    #print(f"Task {task.task_id} updated at {task.updated_at}")
-                    db.session.commit()
-                    time.sleep(0.2)
-                time.sleep(1)
-                
-                
+                return False
+
             task.status = 'completed'
             db.session.commit()
             
@@ -246,11 +686,14 @@ class PolygonCrawler:
         except requests.exceptions.HTTPError as e:
             if e.response.status_code == 503:
                 logger.warning(f"Task {task.task_id} received 503 error, setting to pending")
+                # 丢弃未提交的修改，只更新状态，任务上保留最后一次提交的进度
+                db.session.rollback()
                 task.status = 'pending'
                 db.session.commit()
                 return False
             raise
         except Exception as e:
+            db.session.rollback()
             if 'No available API key' in str(e):
                 logger.error(f"No available API key: {str(e)}")
                 task.status = 'waiting'
@@ -262,89 +705,49 @@ class PolygonCrawler:
             raise
 
     @staticmethod
-    def _fetch_page(polygon: str, types: str, page: int, offset: int = 25, max_retries: int = 3) -> List[Dict]:
-        """获取单页数据"""
+    def _concurrency() -> int:
+        """单个任务的并发请求数
+
+        每页至少要拿到一个QPS令牌，并发数超过可用key的polygon QPS总和只会让线程排队等令牌。
+        """
+        configured = max(1, current_app.config['CRAWLER_CONCURRENCY'])
+        return max(1, min(configured, math.ceil(key_pool.total_rate('polygon'))))
+
+    @staticmethod
+    def _fetch_page(polygon: str, types: str, page: int, offset: int = 25, max_retries: int = 3) -> Tuple[Dict, int]:
+        """获取单页数据
+
+        直接调用搜索服务（不经过 Flask 请求上下文）。没有可用key时返回 503 和 info_code 1008611，
+        由调用方把任务放回等待队列；其他失败重试 max_retries 次。
+        Returns:
+            (解析后的响应, 状态码)
+        """
+        params = [
+            ('polygon', polygon),
+            ('types', types),
+            ('offset', str(offset)),
+            ('page', str(page)),
+            ('extensions', 'all')
+        ]
         retry_count = 0
-        while retry_count < max_retries:
+        while True:
             try:
-                # 构造请求参数
-                params = {
-                    'polygon': polygon,
-                    'types': types,
-                    'offset': offset,
-                    'page': page,
-                    'extensions': 'all'
-                }
-                
-                # 构造请求环境
-                builder = EnvironBuilder(
-                    path=f'/amap/v3/place/polygon',
-                    method='GET',
-                    query_string=params
-                )
-                env = builder.get_environ()
-                request_ctx = current_app.request_context(env)
-                
-                with request_ctx:
-                    # 调用proxy_request
-                    response = proxy_request('v3/place/polygon')
-                if response.status_code == 503 and (response and response.get('info_code') == '1008611'):
-                    raise Exception("No available API key")
-                if not response:
-                    raise Exception("Proxy request returned None")
-                if response.status_code != 200:
-                    raise Exception(f"Proxy request failed with status {response.status_code}")
-                if isinstance(response, tuple):
-                    return response[0].json, response[1]
-                return response.json, response.status_code
-                    
+                result, _ = SearchClient.search('v3/place/polygon', params)
+                data = result.json()
+                if result.status == 503 and isinstance(data, dict) and data.get('info_code') == '1008611':
+                    return data, result.status
+                if result.status != 200:
+                    raise Exception(f"Search failed with status {result.status}: {data}")
+                metrics.crawler_pages.inc('polygon')
+                return data, result.status
+
             except Exception as e:
                 retry_count += 1
-                if 'No available API key' in str(e) or retry_count >= max_retries:
+                if retry_count >= max_retries:
                     logger.error(f"Request failed after {retry_count} retries: {str(e)}")
                     raise
                 logger.warning(f"Request failed (attempt {retry_count}/{max_retries}): {str(e)}")
-                time.sleep(15)  # 固定5秒重试间隔
-                continue
-
-    @staticmethod
-    def _save_to_csv(filename: str, pois: List[Dict], poi_type: str):
-        """保存POI数据到CSV"""
-        # 获取当前脚本所在目录的上级目录
-        current_dir = os.path.dirname(os.path.abspath(__file__))  # app/services
-        results_dir = os.path.join(os.path.dirname(current_dir), 'results')  # app/results
-        os.makedirs(results_dir, exist_ok=True)
-        
-        # 构建文件完整路径
-        filepath = os.path.join(results_dir, filename)
-        
-        file_exists = os.path.exists(filepath)
-        
-        with open(filepath, 'a', newline='', encoding='utf-8-sig') as f:
-            writer = csv.writer(f)
-            
-            if not file_exists:
-                writer.writerow([
-                    'id', 'name', 'type', 'type_code', 'address',
-                    'location', 'tel', 'business_area', 'poi_type',
-                    'province', 'city', 'district'
-                ])
-            
-            for poi in pois:
-                writer.writerow([
-                    poi.get('id', ''),
-                    poi.get('name', ''),
-                    poi.get('type', ''),
-                    poi.get('typecode', ''),
-                    poi.get('address', ''),
-                    poi.get('location', ''),
-                    poi.get('tel', ''),
-                    poi.get('business_area', ''),
-                    poi_type,
-                    poi.get('pname', ''),
-                    poi.get('cityname', ''),
-                    poi.get('adname', '')
-                ])
+                time.sleep(15)  # 固定15秒重试间隔
 
     @staticmethod
     def resume_task(task_id: str) -> bool:
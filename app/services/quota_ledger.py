@@ -0,0 +1,483 @@
+import mmap
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from app.core.database import db
+from app.core.logger import logger
+from app.models.key_ledger import KeyLedgerEntry, KeyLedgerReservation
+
+# 与 key_pool.SEARCH_TYPES 保持一致（避免循环导入）
+SEARCH_TYPES = ('keyword', 'around', 'polygon')
+
+
+def _stamp(moment: Optional[datetime]) -> float:
+    """把数据库中不带时区的本地时间编码为可比较的时间戳（与机器时区无关）"""
+    if moment is None:
+        return 0.0
+    return moment.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _pid_alive(pid: int) -> bool:
+    """本机上的进程是否还在运行"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class LocalLedger:
+    """进程内账本
+
+    计数直接保存在 PooledKey 和令牌桶上，不做任何跨进程同步，只适用于单个worker。
+    load/save/merge 的参数 entries 为 (PooledKey, search_type, TokenBucket) 列表。
+    """
+
+    name = 'local'
+    shared = False
+    # 操作是否涉及网络I/O（异步模式下需要放到线程中执行）
+    blocking = False
+    clock = staticmethod(time.monotonic)
+
+    def init_app(self, app):
+        pass
+
+    @contextmanager
+    def transaction(self):
+        yield
+
+    def load(self, entries: List[Tuple]):
+        """从账本读取计数到内存对象"""
+
+    def save(self, entries: List[Tuple]):
+        """把内存对象上的计数写回账本"""
+
+    def merge(self, key, db_used: Dict[str, int], db_reset: Optional[datetime]):
+        """把数据库中的使用次数并入账本（取较大值），并读回到 key 上"""
+
+    def reset(self, reset_time: datetime):
+        """每日额度重置"""
+
+    def reclaim(self):
+        """释放已退出的worker预占的次数（需要处于账本事务中）"""
+
+
+class MmapLedger(LocalLedger):
+    """单机多进程共享账本
+
+    计数和令牌桶状态保存在一个 mmap 文件中（默认位于 /dev/shm），
+    以 flock 在进程间互斥。槽位按 (key_id, search_type) 开放寻址，
+    一经分配不再移动，因此每个进程可以缓存槽位下标。
+    令牌桶使用 time.monotonic，同一台机器上各进程的取值可以直接比较。
+    槽位之后是同样数量的预占记录 (pid, 槽位, 次数)，记下每个进程预占的次数，
+    进程被强制结束、来不及确认或退还时，由其他进程在打开或同步账本时释放。
+    """
+
+    name = 'mmap'
+    shared = True
+
+    MAGIC = b'AMKMLDG2'
+    LEGACY_MAGICS = (b'AMKMLDG1',)          # 没有预占记录的旧版本，打开时重建
+    HEADER = struct.Struct('<8sq')          # magic, slots
+    SLOT = struct.Struct('<qqqqddd')        # key_id, type, used, reserved, tokens, updated, reset_at
+    OWNER = struct.Struct('<qqq')           # pid, slot, reserved
+
+    def __init__(self):
+        self._thread_lock = threading.Lock()
+        self._fd = None
+        self._map = None
+        self._slots = 0
+        self._index: Dict[Tuple[int, int], int] = {}
+        self._reset_at = 0.0
+        self._pid = os.getpid()
+        self._owned: Dict[int, int] = {}    # 槽位 -> 本进程的预占记录下标
+
+    def init_app(self, app):
+        path = app.config.get('QUOTA_LEDGER_PATH') or self.default_path()
+        self.open(path, app.config.get('QUOTA_LEDGER_SLOTS', 1024))
+
+    @staticmethod
+    def default_path() -> str:
+        directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        return os.path.join(directory, 'amkm_quota_ledger')
+
+    def open(self, path: str, slots: int):
+        """打开（必要时创建）账本文件"""
+        import fcntl
+        self._fcntl = fcntl
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(self._fd, self.HEADER.size, 0)
+            if len(header) < self.HEADER.size or header[:len(self.MAGIC)] in self.LEGACY_MAGICS:
+                # 新文件，或旧版本的账本（已用次数在同步时从数据库并入）
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self._size(slots))
+                os.pwrite(self._fd, self.HEADER.pack(self.MAGIC, slots), 0)
+            magic, existing_slots = self.HEADER.unpack(os.pread(self._fd, self.HEADER.size, 0))
+            if magic != self.MAGIC:
+                raise RuntimeError(f"无效的账本文件: {path}")
+            self._slots = existing_slots
+            self._map = mmap.mmap(self._fd, self._size(self._slots))
+            self.reclaim()
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        logger.info(f"共享账本已打开: {path}, 槽位数: {self._slots}")
+
+    @contextmanager
+    def transaction(self):
+        with self._thread_lock:
+            self._fcntl.flock(self._fd, self._fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+
+    def _size(self, slots: int) -> int:
+        return self.HEADER.size + slots * (self.SLOT.size + self.OWNER.size)
+
+    def _offset(self, index: int) -> int:
+        return self.HEADER.size + index * self.SLOT.size
+
+    def _owner_offset(self, index: int) -> int:
+        return self.HEADER.size + self._slots * self.SLOT.size + index * self.OWNER.size
+
+    def _own(self, slot: int, delta: int):
+        """把预占次数的变化记到本进程名下（需要持有锁）"""
+        pid = os.getpid()
+        if pid != self._pid:
+            # fork 出的子进程不继承父进程的记录
+            self._pid, self._owned = pid, {}
+        index = self._owned.get(slot)
+        if index is None:
+            if delta <= 0:
+                return
+            start = (pid * len(SEARCH_TYPES) + slot) % self._slots
+            for probe in range(self._slots):
+                candidate = (start + probe) % self._slots
+                if struct.unpack_from('<q', self._map, self._owner_offset(candidate))[0] == 0:
+                    index = self._owned[slot] = candidate
+                    self.OWNER.pack_into(self._map, self._owner_offset(index), pid, slot, 0)
+                    break
+            else:
+                raise RuntimeError(f"共享账本预占记录已满({self._slots})，请调大 QUOTA_LEDGER_SLOTS")
+        offset = self._owner_offset(index)
+        count = self.OWNER.unpack_from(self._map, offset)[2] + delta
+        if count > 0:
+            self.OWNER.pack_into(self._map, offset, pid, slot, count)
+        else:
+            # 额度重置清零后再确认的预占，不会小于0
+            self.OWNER.pack_into(self._map, offset, 0, 0, 0)
+            del self._owned[slot]
+
+    def _find(self, key_id: int, search_type: str) -> int:
+        """查找或分配槽位（需要持有锁）"""
+        type_index = SEARCH_TYPES.index(search_type)
+        index = self._index.get((key_id, type_index))
+        if index is not None:
+            return index
+        start = (key_id * len(SEARCH_TYPES) + type_index) % self._slots
+        for probe in range(self._slots):
+            index = (start + probe) % self._slots
+            slot_key, slot_type = struct.unpack_from('<qq', self._map, self._offset(index))
+            if slot_key == 0:
+                self.SLOT.pack_into(self._map, self._offset(index),
+                                    key_id, type_index, 0, 0, 0.0, 0.0, self._reset_at)
+            elif slot_key != key_id or slot_type != type_index:
+                continue
+            self._index[(key_id, type_index)] = index
+            return index
+        raise RuntimeError(f"共享账本槽位已满({self._slots})，请调大 QUOTA_LEDGER_SLOTS")
+
+    def _read(self, key_id: int, search_type: str) -> list:
+        return list(self.SLOT.unpack_from(self._map, self._offset(self._find(key_id, search_type))))
+
+    def _write(self, values: list, key_id: int, search_type: str):
+        self.SLOT.pack_into(self._map, self._offset(self._find(key_id, search_type)), *values)
+
+    def load(self, entries: List[Tuple]):
+        for key, search_type, bucket in entries:
+            _, _, used, reserved, tokens, updated, _ = self._read(key.id, search_type)
+            key.used[search_type] = used
+            key.reserved[search_type] = reserved
+            if updated:
+                bucket.tokens = tokens
+                bucket.updated = updated
+
+    def save(self, entries: List[Tuple]):
+        for key, search_type, bucket in entries:
+            index = self._find(key.id, search_type)
+            values = list(self.SLOT.unpack_from(self._map, self._offset(index)))
+            delta = key.reserved[search_type] - values[3]
+            values[2:6] = key.used[search_type], key.reserved[search_type], bucket.tokens, bucket.updated
+            self.SLOT.pack_into(self._map, self._offset(index), *values)
+            if delta:
+                self._own(index, delta)
+
+    def merge(self, key, db_used: Dict[str, int], db_reset: Optional[datetime]):
+        db_stamp = _stamp(db_reset)
+        for search_type in SEARCH_TYPES:
+            values = self._read(key.id, search_type)
+            # 数据库记录早于账本的重置点时，说明是前一天的计数，不能并入
+            if db_stamp >= values[6]:
+                values[2] = max(values[2], db_used[search_type])
+                self._write(values, key.id, search_type)
+            key.used[search_type] = values[2]
+            key.reserved[search_type] = values[3]
+
+    def reset(self, reset_time: datetime):
+        stamp = _stamp(reset_time)
+        with self.transaction():
+            self._reset_at = max(self._reset_at, stamp)
+            cleared = set()
+            for index in range(self._slots):
+                offset = self._offset(index)
+                values = list(self.SLOT.unpack_from(self._map, offset))
+                if values[0] and values[6] < stamp:
+                    values[2:4] = 0, 0
+                    values[6] = stamp
+                    self.SLOT.pack_into(self._map, offset, *values)
+                    cleared.add(index)
+            # 预占已清零，记录保留给所属进程（它可能缓存了记录下标）
+            for index in range(self._slots):
+                offset = self._owner_offset(index)
+                pid, slot, count = self.OWNER.unpack_from(self._map, offset)
+                if pid and slot in cleared:
+                    self.OWNER.pack_into(self._map, offset, pid, slot, 0)
+
+    def reclaim(self):
+        released = 0
+        for index in range(self._slots):
+            offset = self._owner_offset(index)
+            pid, slot, count = self.OWNER.unpack_from(self._map, offset)
+            if pid == 0 or pid == os.getpid() or _pid_alive(pid):
+                continue
+            values = list(self.SLOT.unpack_from(self._map, self._offset(slot)))
+            freed = min(count, values[3])
+            values[3] -= freed
+            self.SLOT.pack_into(self._map, self._offset(slot), *values)
+            self.OWNER.pack_into(self._map, offset, 0, 0, 0)
+            released += freed
+        if released:
+            logger.warning(f"已释放退出的worker预占的额度: {released} 次")
+
+
+class DatabaseLedger(LocalLedger):
+    """多机共享账本
+
+    计数和令牌桶状态保存在 key_quota_ledger 表中。每次操作在独立连接上开启事务，
+    先以 SELECT ... FOR UPDATE 锁住全局锁行，因此各机器上的操作完全串行。
+    令牌桶改用 time.time，要求各机器时钟同步。
+    各worker（主机名:进程号）预占的次数记在 key_quota_reservation 表中，同步时刷新活动时间；
+    本机上已退出的worker，以及超过 QUOTA_LEDGER_OWNER_TIMEOUT 秒没有活动的worker，预占的次数由其他worker释放。
+    """
+
+    name = 'database'
+    shared = True
+    blocking = True
+    clock = staticmethod(time.time)
+
+    LOCK_KEY_ID = 0
+    LOCK_SEARCH_TYPE = '*'
+
+    def __init__(self):
+        self._thread_lock = threading.Lock()
+        self._engine = None
+        self._conn = None
+        self._reset_at = 0.0
+        self._table = KeyLedgerEntry.__table__
+        self._reservations = KeyLedgerReservation.__table__
+        self._seen: Dict[Tuple[int, str], int] = {}     # 本次事务中读到的预占次数
+        self.owner_timeout = 300
+
+    def init_app(self, app):
+        """需要在应用上下文中调用"""
+        self._engine = db.engine
+        self.owner_timeout = app.config.get('QUOTA_LEDGER_OWNER_TIMEOUT', self.owner_timeout)
+        self._table.create(self._engine, checkfirst=True)
+        self._reservations.create(self._engine, checkfirst=True)
+        try:
+            with self._engine.begin() as conn:
+                if conn.execute(self._lock_query()).first() is None:
+                    conn.execute(self._table.insert().values(
+                        key_id=self.LOCK_KEY_ID, search_type=self.LOCK_SEARCH_TYPE
+                    ))
+        except IntegrityError:
+            # 其他worker已创建锁行
+            pass
+        with self.transaction():
+            self.reclaim()
+
+    @staticmethod
+    def _owner() -> str:
+        """当前worker的标识（fork 后重新取进程号）"""
+        return f"{socket.gethostname()[:80]}:{os.getpid()}"
+
+    def _lock_query(self):
+        table = self._table
+        return select(table.c.key_id).where(
+            table.c.key_id == self.LOCK_KEY_ID,
+            table.c.search_type == self.LOCK_SEARCH_TYPE
+        )
+
+    @contextmanager
+    def transaction(self):
+        with self._thread_lock, self._engine.begin() as conn:
+            conn.execute(self._lock_query().with_for_update())
+            self._conn = conn
+            self._seen = {}
+            try:
+                yield
+            finally:
+                self._conn = None
+
+    def _rows(self, key_ids, search_types) -> Dict[Tuple[int, str], dict]:
+        """读取账本行，缺失的行按当前重置点创建（需要持有锁）"""
+        table = self._table
+        rows = {
+            (row.key_id, row.search_type): dict(row._mapping)
+            for row in self._conn.execute(select(table).where(
+                table.c.key_id.in_(set(key_ids)),
+                table.c.search_type.in_(set(search_types))
+            ))
+        }
+        missing = [
+            {'key_id': key_id, 'search_type': search_type, 'used': 0, 'reserved': 0,
+             'tokens': 0.0, 'updated': 0.0, 'reset_at': self._reset_at}
+            for key_id in set(key_ids) for search_type in set(search_types)
+            if (key_id, search_type) not in rows
+        ]
+        if missing:
+            self._conn.execute(table.insert(), missing)
+            rows.update({(row['key_id'], row['search_type']): row for row in missing})
+        return rows
+
+    def _update(self, key_id: int, search_type: str, **values):
+        table = self._table
+        self._conn.execute(update(table).where(
+            table.c.key_id == key_id,
+            table.c.search_type == search_type
+        ).values(**values))
+
+    def load(self, entries: List[Tuple]):
+        if not entries:
+            return
+        rows = self._rows([key.id for key, _, _ in entries], [search_type for _, search_type, _ in entries])
+        for key, search_type, bucket in entries:
+            row = rows[(key.id, search_type)]
+            key.used[search_type] = row['used']
+            key.reserved[search_type] = row['reserved']
+            self._seen[(key.id, search_type)] = row['reserved']
+            if row['updated']:
+                bucket.tokens = row['tokens']
+                bucket.updated = row['updated']
+
+    def save(self, entries: List[Tuple]):
+        for key, search_type, bucket in entries:
+            self._update(key.id, search_type,
+                         used=key.used[search_type], reserved=key.reserved[search_type],
+                         tokens=bucket.tokens, updated=bucket.updated)
+            # 调用方在同一事务中先 load 再 save，差值就是本worker的预占变化
+            delta = key.reserved[search_type] - self._seen.get((key.id, search_type), key.reserved[search_type])
+            self._seen[(key.id, search_type)] = key.reserved[search_type]
+            if delta:
+                self._own(key.id, search_type, delta)
+
+    def _own(self, key_id: int, search_type: str, delta: int):
+        """把预占次数的变化记到本worker名下（需要持有锁）"""
+        table = self._reservations
+        owner = self._owner()
+        # 额度重置清零后再确认的预占，不会小于0
+        result = self._conn.execute(update(table).where(
+            table.c.owner == owner,
+            table.c.key_id == key_id,
+            table.c.search_type == search_type,
+            table.c.count + delta >= 0
+        ).values(count=table.c.count + delta, heartbeat=self.clock()))
+        if result.rowcount == 0 and delta > 0:
+            self._conn.execute(table.insert().values(
+                owner=owner, key_id=key_id, search_type=search_type, count=delta, heartbeat=self.clock()
+            ))
+
+    def merge(self, key, db_used: Dict[str, int], db_reset: Optional[datetime]):
+        db_stamp = _stamp(db_reset)
+        rows = self._rows([key.id], SEARCH_TYPES)
+        for search_type in SEARCH_TYPES:
+            row = rows[(key.id, search_type)]
+            if db_stamp >= row['reset_at'] and db_used[search_type] > row['used']:
+                row['used'] = db_used[search_type]
+                self._update(key.id, search_type, used=row['used'])
+            key.used[search_type] = row['used']
+            key.reserved[search_type] = row['reserved']
+
+    def reset(self, reset_time: datetime):
+        stamp = _stamp(reset_time)
+        table = self._table
+        with self.transaction():
+            self._reset_at = max(self._reset_at, stamp)
+            # 预占随账本行一起清零
+            reservations = self._reservations
+            self._conn.execute(delete(reservations).where(
+                select(table.c.key_id).where(
+                    table.c.key_id == reservations.c.key_id,
+                    table.c.search_type == reservations.c.search_type,
+                    table.c.reset_at < stamp
+                ).exists()
+            ))
+            self._conn.execute(update(table).where(
+                table.c.key_id != self.LOCK_KEY_ID,
+                table.c.reset_at < stamp
+            ).values(used=0, reserved=0, reset_at=stamp))
+
+    def reclaim(self):
+        table = self._reservations
+        owner, now = self._owner(), self.clock()
+        self._conn.execute(update(table).where(table.c.owner == owner).values(heartbeat=now))
+        owners: Dict[str, float] = {}
+        for row in self._conn.execute(select(table.c.owner, table.c.heartbeat)):
+            owners[row.owner] = max(owners.get(row.owner, 0.0), row.heartbeat)
+        host = owner.rpartition(':')[0]
+        dead = []
+        for other, heartbeat in owners.items():
+            other_host, _, pid = other.rpartition(':')
+            if other == owner:
+                continue
+            if heartbeat < now - self.owner_timeout or (other_host == host and not _pid_alive(int(pid))):
+                dead.append(other)
+        if not dead:
+            return
+        reserved = [row for row in self._conn.execute(select(table).where(table.c.owner.in_(dead)))
+                    if row.count > 0]
+        released = 0
+        if reserved:
+            rows = self._rows([row.key_id for row in reserved], [row.search_type for row in reserved])
+            for row in reserved:
+                ledger_row = rows[(row.key_id, row.search_type)]
+                freed = min(row.count, ledger_row['reserved'])
+                ledger_row['reserved'] -= freed
+                self._update(row.key_id, row.search_type, reserved=ledger_row['reserved'])
+                released += freed
+        self._conn.execute(delete(table).where(table.c.owner.in_(dead)))
+        if released:
+            logger.warning(f"已释放退出的worker预占的额度: {released} 次 ({', '.join(dead)})")
+
+
+LEDGERS = {ledger.name: ledger for ledger in (LocalLedger, MmapLedger, DatabaseLedger)}
+
+
+def create_ledger(name: str) -> LocalLedger:
+    """按名称创建账本"""
+    ledger = LEDGERS.get(name)
+    if ledger is None:
+        raise ValueError(f"未知的额度账本类型: {name}, 可选: {', '.join(LEDGERS)}")
+    return ledger()
@@ -0,0 +1,131 @@
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, List
+import pytz
+from app.models.api_key import APIKey
+from app.core.database import db
+from app.core.logger import logger
+from app.core.config import Config
+
+
+class QuotaResetScheduler:
+    """每日额度重置调度器
+
+    在重置时间点批量重置所有活跃key的使用次数，启动时补做错过的重置，
+    并通知进程内的缓存（如key池）。
+    """
+
+    # 最长检查间隔(秒)，避免系统时间调整后长时间不触发
+    MAX_WAIT_SECONDS = 60
+
+    def __init__(self):
+        self._listeners: List[Callable[[datetime], None]] = []
+        self._pre_reset_hooks: List[Callable[[], None]] = []
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add_listener(self, callback: Callable[[datetime], None]):
+        """注册重置回调，参数为本次重置时间"""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def add_pre_reset_hook(self, callback: Callable[[], None]):
+        """注册重置前回调（如写回尚未落库的使用次数）"""
+        if callback not in self._pre_reset_hooks:
+            self._pre_reset_hooks.append(callback)
+
+    @staticmethod
+    def _now() -> datetime:
+        return datetime.now(pytz.timezone(Config.TIMEZONE))
+
+    @staticmethod
+    def last_reset_boundary(now: datetime = None) -> datetime:
+        """最近一次应当发生重置的时间点"""
+        now = now or QuotaResetScheduler._now()
+        today_reset_time = now.replace(
+            hour=Config.KEY_RESET_HOUR,
+            minute=0,
+            second=0,
+            microsecond=0
+        )
+        if now < today_reset_time:
+            return today_reset_time - timedelta(days=1)
+        return today_reset_time
+
+    def init_app(self, app):
+        """补做错过的重置并启动调度线程"""
+        try:
+            self.reset_keys()
+        except Exception as e:
+            logger.error(f"启动时重置key额度失败: {str(e)}")
+            db.session.rollback()
+
+        if self._thread is None or not self._thread.is_alive():
+            self._stop_event.clear()
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(app,),
+                name="QuotaResetScheduler",
+                daemon=True
+            )
+            self._thread.start()
+
+    def shutdown(self):
+        """停止调度"""
+        self._stop_event.set()
+
+    def _run(self, app):
+        """等待下一个重置时间点并执行重置"""
+        next_reset = self.last_reset_boundary() + timedelta(days=1)
+        while True:
+            wait_seconds = (next_reset - self._now()).total_seconds()
+            if wait_seconds > 0:
+                if self._stop_event.wait(min(wait_seconds, self.MAX_WAIT_SECONDS)):
+                    return
+                continue
+
+            with app.app_context():
+                try:
+                    self.reset_keys()
+                except Exception as e:
+                    logger.error(f"定时重置key额度失败: {str(e)}")
+                    db.session.rollback()
+            next_reset = self.last_reset_boundary() + timedelta(days=1)
+
+    def reset_keys(self) -> int:
+        """批量重置上次重置早于当前重置点的key（需要在应用上下文中调用）
+
+        Returns:
+            被重置的key数量
+        """
+        for callback in self._pre_reset_hooks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"额度重置前回调失败: {str(e)}")
+
+        # 数据库中保存的是不带时区的本地时间；记录重置点而不是执行时间，
+        # 与通知给key池的时间一致，key池同步时不会把它当作又一次重置
+        boundary = self.last_reset_boundary().replace(tzinfo=None)
+
+        reset_count = APIKey.query.filter(
+            APIKey.is_active == True,
+            db.or_(APIKey.last_reset == None, APIKey.last_reset < boundary)
+        ).update({
+            APIKey.keyword_search_used: 0,
+            APIKey.around_search_used: 0,
+            APIKey.polygon_search_used: 0,
+            APIKey.last_reset: boundary
+        }, synchronize_session=False)
+        db.session.commit()
+
+        if reset_count:
+            logger.info(f"已重置 {reset_count} 个key的使用计数")
+
+        # 多进程部署时其他进程可能已完成数据库重置，仍需通知本进程的缓存
+        for callback in self._listeners:
+            try:
+                callback(boundary)
+            except Exception as e:
+                logger.error(f"额度重置回调失败: {str(e)}")
+        return reset_count
@@ -0,0 +1,141 @@
+import threading
+import time
+from typing import Callable, Dict, Tuple
+
+
+class TokenBucket:
+    """令牌桶
+
+    以 rate 的速度补充令牌，最多积累 capacity 个。
+    clock 默认为 time.monotonic，多台机器共享令牌桶状态时需要改用 time.time。
+    """
+
+    def __init__(self, rate: float, capacity: float = 1, clock: Callable[[], float] = time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def set_rate(self, rate: float):
+        """调整补充速度（先按旧速度结算已积累的令牌）"""
+        self._refill(self.clock())
+        self.rate = float(rate)
+
+    def available(self) -> bool:
+        """当前是否有可用令牌"""
+        self._refill(self.clock())
+        return self.tokens >= 1
+
+    def try_acquire(self) -> bool:
+        """尝试取走一个令牌"""
+        self._refill(self.clock())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self) -> float:
+        """距离下一个令牌可用还需等待的秒数"""
+        self._refill(self.clock())
+        if self.tokens >= 1:
+            return 0.0
+        if self.rate <= 0:
+            return float('inf')
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """按 (key_id, search_type) 维护的令牌桶集合"""
+
+    def __init__(self, capacity: float = 1, clock: Callable[[], float] = time.monotonic):
+        self.capacity = capacity
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._buckets: Dict[Tuple[int, str], TokenBucket] = {}
+
+    def bucket(self, key_id: int, search_type: str, rate: float) -> TokenBucket:
+        """获取令牌桶，速度变化时同步更新"""
+        with self._lock:
+            bucket = self._buckets.get((key_id, search_type))
+            if bucket is None:
+                bucket = TokenBucket(rate, self.capacity, self.clock)
+                self._buckets[(key_id, search_type)] = bucket
+            elif bucket.rate != rate:
+                bucket.set_rate(rate)
+            return bucket
+
+    def remove(self, key_id: int):
+        """移除某个key的所有令牌桶"""
+        with self._lock:
+            for bucket_key in [k for k in self._buckets if k[0] == key_id]:
+                del self._buckets[bucket_key]
+
+
+class AimdController:
+    """按 (key_id, search_type) 的 AIMD 速率控制
+
+    从配置的QPS上限开始；上游返回限流时把速度乘以 decrease（同一个key在 hold 秒内
+    只降一次，避免同一批并发请求连续降速），每次调用成功时加性增加 increase / rate，
+    即满速运行时每秒约增加 increase 个QPS，最高到配置上限的 max_factor 倍。
+    不加锁，需要在 KeyPool 的锁内调用。
+    """
+
+    def __init__(self, enabled: bool = True, decrease: float = 0.5, increase: float = 0.5,
+                 max_factor: float = 1.0, min_rate: float = 0.1, hold: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.enabled = enabled
+        self.decrease = decrease
+        self.increase = increase
+        self.max_factor = max_factor
+        self.min_rate = min_rate
+        self.hold = hold
+        self.clock = clock
+        # (key_id, search_type) -> [当前速度, 上次降速时间]
+        self._rates: Dict[Tuple[int, str], list] = {}
+
+    def rate(self, key_id: int, search_type: str, limit: float) -> float:
+        """当前允许的速度"""
+        state = self._rates.get((key_id, search_type))
+        if not self.enabled or state is None:
+            return limit
+        return min(state[0], limit * self.max_factor)
+
+    def on_throttle(self, key_id: int, search_type: str, limit: float) -> float:
+        """上游返回限流，乘性降速"""
+        if not self.enabled:
+            return limit
+        now = self.clock()
+        state = self._rates.setdefault((key_id, search_type), [float(limit), float('-inf')])
+        if now - state[1] >= self.hold:
+            state[0] = max(self.min_rate, state[0] * self.decrease)
+            state[1] = now
+        return state[0]
+
+    def on_success(self, key_id: int, search_type: str, limit: float) -> float:
+        """调用成功，加性提速"""
+        if not self.enabled:
+            return limit
+        state = self._rates.get((key_id, search_type))
+        if state is None:
+            if self.max_factor <= 1:
+                return limit
+            # 允许超过配置上限时，从配置上限开始向上试探
+            state = self._rates[(key_id, search_type)] = [float(limit), float('-inf')]
+        ceiling = limit * self.max_factor
+        state[0] = min(ceiling, state[0] + self.increase / max(state[0], self.min_rate))
+        if state[0] >= ceiling and self.max_factor <= 1:
+            # 回到配置上限后不再单独记录
+            del self._rates[(key_id, search_type)]
+        return state[0]
+
+    def remove(self, key_id: int):
+        """移除某个key的速度记录"""
+        for rate_key in [k for k in self._rates if k[0] == key_id]:
+            del self._rates[rate_key]
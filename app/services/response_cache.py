@@ -0,0 +1,208 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import urlencode
+from app.core.config import Config
+from app.core.logger import logger
+
+# 不参与缓存键的参数
+IGNORED_PARAMS = ('key', 'sig', 'callback')
+
+
+class ResponseCache:
+    """高德搜索结果缓存
+
+    以去掉 key 后规范化的查询参数为键，只缓存 infocode 为 10000 的原始响应。
+    内存层按 LRU 淘汰，总大小不超过 max_bytes；可选的磁盘层（cache_dir）
+    在内存未命中时读取，多个worker可以共享。各搜索类型有独立的过期时间。
+    """
+
+    # 每写入多少个磁盘文件清理一次过期文件
+    DISK_PRUNE_EVERY = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, Tuple[float, bytes, str]]' = OrderedDict()
+        self._bytes = 0
+        self.enabled = Config.RESPONSE_CACHE_ENABLED
+        self.max_bytes = Config.RESPONSE_CACHE_MAX_MB * 1024 * 1024
+        self.ttls: Dict[str, int] = {
+            'keyword': Config.RESPONSE_CACHE_TTL_KEYWORD,
+            'around': Config.RESPONSE_CACHE_TTL_AROUND,
+            'polygon': Config.RESPONSE_CACHE_TTL_POLYGON
+        }
+        self.cache_dir: Optional[str] = Config.RESPONSE_CACHE_DIR
+        self._disk_puts = 0
+        self.stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0
+        }
+
+    def init_app(self, app):
+        """读取应用配置"""
+        self.enabled = app.config.get('RESPONSE_CACHE_ENABLED', self.enabled)
+        self.max_bytes = app.config.get('RESPONSE_CACHE_MAX_MB', Config.RESPONSE_CACHE_MAX_MB) * 1024 * 1024
+        for search_type in self.ttls:
+            self.ttls[search_type] = app.config.get(f'RESPONSE_CACHE_TTL_{search_type.upper()}', self.ttls[search_type])
+        self.cache_dir = app.config.get('RESPONSE_CACHE_DIR', self.cache_dir)
+        if self.enabled:
+            if self.cache_dir:
+                os.makedirs(self.cache_dir, exist_ok=True)
+            logger.info(f"响应缓存已开启, 内存上限: {self.max_bytes // 1024 // 1024}MB, "
+                        f"磁盘: {self.cache_dir or '关闭'}, 过期时间: {self.ttls}")
+
+    @staticmethod
+    def make_key(endpoint: str, params: Iterable[Tuple[str, str]]) -> str:
+        """规范化查询参数生成缓存键（忽略 key 等与结果无关的参数，参数顺序无关）"""
+        normalized = sorted(
+            (name, value.strip())
+            for name, value in params
+            if name not in IGNORED_PARAMS
+        )
+        return f"{endpoint}?{urlencode(normalized)}"
+
+    def get(self, cache_key: str) -> Optional[Tuple[bytes, str]]:
+        """查找缓存，返回 (响应内容, content-type)"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                expires_at, body, content_type = entry
+                if expires_at > now:
+                    self._entries.move_to_end(cache_key)
+                    self.stats['memory_hits'] += 1
+                    return body, content_type
+                self._remove(cache_key)
+
+        entry = self._read_disk(cache_key, now)
+        with self._lock:
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['disk_hits'] += 1
+            self._store(cache_key, entry)
+        return entry[1], entry[2]
+
+    def put(self, cache_key: str, search_type: str, body: bytes, content_type: str):
+        """缓存一次成功的响应"""
+        ttl = self.ttls.get(search_type, 0)
+        if ttl <= 0:
+            return
+        entry = (time.time() + ttl, body, content_type)
+        with self._lock:
+            self._store(cache_key, entry)
+            self.stats['stores'] += 1
+        self._write_disk(cache_key, entry)
+
+    def _store(self, cache_key: str, entry: Tuple[float, bytes, str]):
+        """写入内存层并按LRU淘汰（需要持有锁）"""
+        if len(entry[1]) > self.max_bytes:
+            return
+        self._remove(cache_key)
+        self._entries[cache_key] = entry
+        self._bytes += len(entry[1])
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats['evictions'] += 1
+
+    def _remove(self, cache_key: str):
+        entry = self._entries.pop(cache_key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    def _disk_path(self, cache_key: str) -> str:
+        digest = hashlib.sha1(cache_key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def _read_disk(self, cache_key: str, now: float) -> Optional[Tuple[float, bytes, str]]:
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(cache_key)
+        try:
+            with open(path, 'rb') as f:
+                expires_at = float(f.readline())
+                stored_key = f.readline().decode('utf-8').rstrip('\n')
+                content_type = f.readline().decode('utf-8').rstrip('\n')
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        if stored_key != cache_key:
+            return None
+        if expires_at <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return expires_at, body, content_type
+
+    def _write_disk(self, cache_key: str, entry: Tuple[float, bytes, str]):
+        """文件格式: 过期时间、缓存键、content-type 各占一行，之后是响应内容"""
+        if not self.cache_dir:
+            return
+        expires_at, body, content_type = entry
+        path = self._disk_path(cache_key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再改名，避免其他worker读到写了一半的文件
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(f"{expires_at}\n{cache_key}\n{content_type}\n".encode('utf-8'))
+                f.write(body)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入磁盘缓存失败: {str(e)}")
+            return
+
+        with self._lock:
+            self._disk_puts += 1
+            prune = self._disk_puts % self.DISK_PRUNE_EVERY == 0
+        if prune:
+            self.prune_disk()
+
+    def prune_disk(self) -> int:
+        """删除磁盘上已过期的缓存文件"""
+        if not self.cache_dir:
+            return 0
+        removed = 0
+        now = time.time()
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    with open(path, 'rb') as f:
+                        expires_at = float(f.readline())
+                    if expires_at <= now:
+                        os.remove(path)
+                        removed += 1
+                except (OSError, ValueError):
+                    continue
+        if removed:
+            logger.debug(f"已清理 {removed} 个过期的磁盘缓存")
+        return removed
+
+    def clear(self):
+        """清空内存层（磁盘层只清理过期文件）"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        self.prune_disk()
+
+    def get_stats(self) -> Dict:
+        """命中统计"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 4) if lookups else 0.0
+        stats['enabled'] = self.enabled
+        return stats
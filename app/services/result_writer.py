@@ -0,0 +1,404 @@
+import codecs
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+from typing import Dict, Iterable, List, Optional
+
+# 结果文件目录 app/results
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'results')
+
+# CSV 表头（文件以 UTF-8 BOM 开头，便于 Excel 打开）
+CSV_HEADER = [
+    'id', 'name', 'type', 'type_code', 'address',
+    'location', 'tel', 'business_area', 'poi_type',
+    'province', 'city', 'district'
+]
+
+# Parquet 的固定列：与CSV相同，location 拆成经纬度两列
+PARQUET_COLUMNS = [
+    'id', 'name', 'type', 'type_code', 'address',
+    'lng', 'lat', 'tel', 'business_area', 'poi_type',
+    'province', 'city', 'district'
+]
+# Parquet 每个行组的行数
+PARQUET_ROW_GROUP = 10000
+
+# 需要 requirements-formats.txt 的格式缺少依赖时的提示
+MISSING_DEPENDENCY = '{format} result format requires {module} (pip install -r requirements-formats.txt)'
+
+
+def result_path(filename: str) -> str:
+    """结果文件的完整路径"""
+    return os.path.join(RESULTS_DIR, filename)
+
+
+def _csv_row(poi: Dict, poi_type: str) -> List:
+    return [
+        poi.get('id', ''),
+        poi.get('name', ''),
+        poi.get('type', ''),
+        poi.get('typecode', ''),
+        poi.get('address', ''),
+        poi.get('location', ''),
+        poi.get('tel', ''),
+        poi.get('business_area', ''),
+        poi_type,
+        poi.get('pname', ''),
+        poi.get('cityname', ''),
+        poi.get('adname', '')
+    ]
+
+
+class _Plain:
+    """不压缩"""
+
+    @staticmethod
+    def compress(data: bytes) -> bytes:
+        return data
+
+    @staticmethod
+    def decompress(data: bytes) -> bytes:
+        return data
+
+
+class _Gzip:
+    """gzip：每次写入一个完整的 member，多个 member 首尾相接仍是合法的 gzip 文件"""
+
+    @staticmethod
+    def compress(data: bytes) -> bytes:
+        return gzip.compress(data, mtime=0)
+
+    @staticmethod
+    def decompress(data: bytes) -> bytes:
+        return gzip.decompress(data)
+
+
+class _Zstd:
+    """zstd：每次写入一个完整的 frame，多个 frame 首尾相接仍是合法的 zstd 文件"""
+
+    def __init__(self):
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError(MISSING_DEPENDENCY.format(format='zstd', module='zstandard'))
+        self.zstandard = zstandard
+        self.compressor = zstandard.ZstdCompressor(level=3)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        reader = self.zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True)
+        return reader.read()
+
+
+class ResultWriter:
+    """一个任务的结果文件写入器（CSV，可压缩）
+
+    整个任务执行期间只打开一次文件，行先编码到内存缓冲，调用 checkpoint 时一次写入文件
+    （flush，开启 fsync 时再落盘），调用方在 checkpoint 之后提交进度。
+    文件位置以字节计：boundary 返回已写入行的结束位置，可以记录到进度中，之后用 truncate 截回、
+    用 ids 读出其间写入的POI id。压缩格式在每个 boundary 处结束一个压缩块，截断后仍是完整的文件。
+    """
+
+    def __init__(self, filename: str, fsync: bool = False, codec=None):
+        self.path = result_path(filename)
+        self.fsync = fsync
+        self.codec = codec or _Plain()
+        self._file: Optional[io.BufferedWriter] = None
+        self._raw: List[bytes] = []      # 还没压缩的行
+        self._chunks: List[bytes] = []   # 已压缩、等待写入文件的块
+        self.size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        self._empty = self.size == 0
+
+    def write(self, pois: List[Dict], poi_types: List[str]):
+        """写入一页POI，poi_types 为各POI所属的类型组"""
+        self._raw.append(self._encode(pois, poi_types))
+
+    def _encode(self, pois: List[Dict], poi_types: List[str]) -> bytes:
+        buffer = io.StringIO(newline='')
+        writer = csv.writer(buffer)
+        prefix = b''
+        if self._empty:
+            writer.writerow(CSV_HEADER)
+            prefix = codecs.BOM_UTF8
+            self._empty = False
+        writer.writerows(_csv_row(poi, poi_type) for poi, poi_type in zip(pois, poi_types))
+        return prefix + buffer.getvalue().encode('utf-8')
+
+    def _parse_ids(self, data: bytes, at_start: bool) -> Iterable[str]:
+        rows = csv.reader(io.StringIO(data.decode('utf-8-sig'), newline=''))
+        if at_start:
+            next(rows, None)  # 表头
+        return (row[0] for row in rows if row)
+
+    def boundary(self) -> int:
+        """已写入行的结束位置（含缓冲）"""
+        if self._raw:
+            self._chunks.append(self.codec.compress(b''.join(self._raw)))
+            self._raw = []
+        return self.size + sum(len(chunk) for chunk in self._chunks)
+
+    def checkpoint(self) -> int:
+        """把缓冲的行写入文件，返回文件位置"""
+        position = self.boundary()
+        if self._chunks:
+            if self._file is None:
+                os.makedirs(RESULTS_DIR, exist_ok=True)
+                self._file = open(self.path, 'ab')
+            self._file.write(b''.join(self._chunks))
+            self._chunks = []
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self.size = position
+        return self.size
+
+    def truncate(self, position: int):
+        """丢弃缓冲并把文件截到 position（恢复到某次 checkpoint）"""
+        self._raw, self._chunks = [], []
+        if self._file is not None:
+            self._file.truncate(position)
+        elif os.path.exists(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(position)
+        self.size = position
+        self._empty = position == 0
+
+    def discard(self):
+        """丢弃还没写入文件的行（执行失败时，这些行的进度没有提交）"""
+        self._raw, self._chunks = [], []
+
+    def ids(self, start: int, end: int) -> set:
+        """读出文件中 start 到 end 之间写入的POI id"""
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            data = self.codec.decompress(f.read(end - start))
+        return set(self._parse_ids(data, start == 0))
+
+    def close(self):
+        """写入剩余的缓冲并关闭文件"""
+        try:
+            self.checkpoint()
+        finally:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class NdjsonResultWriter(ResultWriter):
+    """每行一个完整的POI JSON（保留高德返回的所有字段），poi_type 为所属的类型组"""
+
+    def _encode(self, pois: List[Dict], poi_types: List[str]) -> bytes:
+        return b''.join(
+            json.dumps(dict(poi, poi_type=poi_type), ensure_ascii=False).encode('utf-8') + b'\n'
+            for poi, poi_type in zip(pois, poi_types)
+        )
+
+    def _parse_ids(self, data: bytes, at_start: bool) -> Iterable[str]:
+        return (json.loads(line).get('id') for line in data.splitlines() if line)
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError(MISSING_DEPENDENCY.format(format='parquet', module='pyarrow'))
+    return pyarrow, pyarrow.parquet
+
+
+class ParquetResultWriter:
+    """Parquet 结果文件（固定列，见 PARQUET_COLUMNS）
+
+    文件位置以行计。Parquet 的文件尾在关闭时才写入，中途不可读，所以每次 checkpoint
+    把缓冲的行写成 <结果文件>.parts 目录下一个完整的小文件（以起始行号命名，先写临时文件再改名），
+    关闭时把原文件和各分片合并成每 PARQUET_ROW_GROUP 行一个行组的新文件，替换原文件后删除分片。
+    进程被强制结束时已提交的行都在分片中，恢复执行时从进度记录的行数继续。
+    """
+
+    def __init__(self, filename: str, fsync: bool = False):
+        self.pa, self.pq = _import_pyarrow()
+        self.schema = self.pa.schema([
+            (name, self.pa.float64() if name in ('lng', 'lat') else self.pa.string())
+            for name in PARQUET_COLUMNS
+        ])
+        self.path = result_path(filename)
+        self.parts_dir = self.path + '.parts'
+        self.fsync = fsync
+        self._rows: List[Dict] = []
+        # 原文件的行数，读取失败（旧版本没有正常关闭）时为0
+        self._base = 0
+        if os.path.exists(self.path):
+            try:
+                self._base = self.pq.ParquetFile(self.path).metadata.num_rows
+            except Exception:
+                self._base = 0
+        self._parts = self._load_parts()    # [(起始行, 行数, 路径)]
+        self.size = self._base + sum(rows for _, rows, _ in self._parts)
+
+    def _load_parts(self) -> List:
+        """读取上次未合并的分片，只保留与原文件首尾相接的部分"""
+        if not os.path.isdir(self.parts_dir):
+            return []
+        parts = []
+        position = self._base
+        for name in sorted(os.listdir(self.parts_dir)):
+            path = os.path.join(self.parts_dir, name)
+            if not name.endswith('.parquet') or int(name.split('.')[0]) != position:
+                # 临时文件，或合并后还没删除的分片（起始行在原文件之内）
+                os.remove(path)
+                continue
+            rows = self.pq.ParquetFile(path).metadata.num_rows
+            parts.append((position, rows, path))
+            position += rows
+        return parts
+
+    def write(self, pois: List[Dict], poi_types: List[str]):
+        """写入一页POI，poi_types 为各POI所属的类型组"""
+        for poi, poi_type in zip(pois, poi_types):
+            row = dict(zip(CSV_HEADER, _csv_row(poi, poi_type)))
+            location = row.pop('location') or ''
+            lng, _, lat = location.partition(',')
+            row['lng'] = float(lng) if lng else None
+            row['lat'] = float(lat) if lat else None
+            self._rows.append(row)
+
+    def boundary(self) -> int:
+        """已写入的行数（含缓冲）"""
+        return self.size + len(self._rows)
+
+    def checkpoint(self) -> int:
+        """把缓冲的行写成一个分片，返回已写入的行数"""
+        if self._rows:
+            os.makedirs(self.parts_dir, exist_ok=True)
+            path = os.path.join(self.parts_dir, f'{self.size:012d}.parquet')
+            self._write_file(path, [self.pa.Table.from_pylist(self._rows, schema=self.schema)])
+            self._parts.append((self.size, len(self._rows), path))
+            self.size += len(self._rows)
+            self._rows = []
+        return self.size
+
+    def truncate(self, position: int):
+        """丢弃缓冲并截到 position 行（恢复到某次 checkpoint）"""
+        self._rows = []
+        while self._parts and self._parts[-1][0] >= position:
+            os.remove(self._parts.pop()[2])
+        if self._parts:
+            start, rows, path = self._parts[-1]
+            if start + rows > position:
+                # 位置都来自 checkpoint，正常不会落在分片中间
+                table = self.pq.read_table(path).slice(0, position - start)
+                self._write_file(path, [table])
+                self._parts[-1] = (start, table.num_rows, path)
+        elif position < self._base:
+            if position:
+                table = self.pq.read_table(self.path).slice(0, position)
+                self._write_file(self.path, self._batches([table]))
+            else:
+                os.remove(self.path)
+            self._base = position
+        self.size = position
+
+    def discard(self):
+        """丢弃还没写入分片的行（执行失败时，这些行的进度没有提交）"""
+        self._rows = []
+
+    def ids(self, start: int, end: int) -> set:
+        """读出第 start 到 end 行的POI id"""
+        ids = []
+        if self._base:
+            ids.extend(self.pq.read_table(self.path, columns=['id']).column('id').to_pylist())
+        for _, _, path in self._parts:
+            ids.extend(self.pq.read_table(path, columns=['id']).column('id').to_pylist())
+        return set(ids[start:end])
+
+    def _batches(self, tables: Iterable) -> Iterable:
+        """把若干表重新切成 PARQUET_ROW_GROUP 行一组"""
+        pending, rows = [], 0
+        for table in tables:
+            pending.append(table)
+            rows += table.num_rows
+            if rows >= PARQUET_ROW_GROUP:
+                yield self.pa.concat_tables(pending)
+                pending, rows = [], 0
+        if pending:
+            yield self.pa.concat_tables(pending)
+
+    def _write_file(self, path: str, tables: Iterable):
+        """写入临时文件后替换 path"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            writer = self.pq.ParquetWriter(f, self.schema, compression='zstd')
+            try:
+                for table in tables:
+                    writer.write_table(table, row_group_size=PARQUET_ROW_GROUP)
+            finally:
+                writer.close()
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    def close(self):
+        """写入剩余的行，把原文件和分片合并后替换原文件"""
+        self.checkpoint()
+        if not self._parts:
+            return
+        sources = ([self.path] if self._base else []) + [path for _, _, path in self._parts]
+        tables = (self.pa.Table.from_batches([batch], schema=self.schema)
+                  for source in sources
+                  for batch in self.pq.ParquetFile(source).iter_batches(batch_size=PARQUET_ROW_GROUP))
+        self._write_file(self.path, self._batches(tables))
+        # 替换后、删除前中断时，分片的起始行在新文件之内，下次打开时删除
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+        self._base, self._parts = self.size, []
+
+
+# 结果格式 -> (写入器, 压缩, 下载时的 MIME 类型)
+RESULT_FORMATS = {
+    'csv': (ResultWriter, None, 'text/csv'),
+    'csv.gz': (ResultWriter, _Gzip, 'application/gzip'),
+    'csv.zst': (ResultWriter, _Zstd, 'application/zstd'),
+    'ndjson.gz': (NdjsonResultWriter, _Gzip, 'application/gzip'),
+    'ndjson.zst': (NdjsonResultWriter, _Zstd, 'application/zstd'),
+    'parquet': (ParquetResultWriter, None, 'application/vnd.apache.parquet'),
+}
+
+
+def result_format(filename: str) -> str:
+    """按结果文件的扩展名确定格式，无法识别时为 csv"""
+    for name in sorted(RESULT_FORMATS, key=len, reverse=True):
+        if filename.endswith('.' + name):
+            return name
+    return 'csv'
+
+
+def result_filename(task_id: str, result_format_name: str) -> str:
+    """任务的结果文件名，格式不支持或缺少依赖时抛出 ValueError"""
+    if result_format_name not in RESULT_FORMATS:
+        raise ValueError(f'Unsupported result format: {result_format_name}, '
+                         f'expected one of {", ".join(RESULT_FORMATS)}')
+    writer_class, codec, _ = RESULT_FORMATS[result_format_name]
+    # 提前检查可选依赖
+    if codec is not None:
+        codec()
+    elif writer_class is ParquetResultWriter:
+        _import_pyarrow()
+    return f'{task_id}_poi.{result_format_name}'
+
+
+def open_result_writer(filename: str, fsync: bool = False):
+    """按结果文件的格式创建写入器"""
+    writer_class, codec, _ = RESULT_FORMATS[result_format(filename)]
+    if codec is not None:
+        return writer_class(filename, fsync, codec())
+    return writer_class(filename, fsync)
+
+
+def result_mimetype(filename: str) -> str:
+    return RESULT_FORMATS[result_format(filename)][2]
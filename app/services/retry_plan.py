@@ -0,0 +1,88 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Set
+from app.core.extensions import key_pool
+from app.core.logger import logger
+from app.services.key_manager import KeyManager
+from app.services.key_pool import PooledKey
+
+
+class RetryPlan:
+    """一次代理请求内的换key重试计划
+
+    限制尝试次数和总耗时，记录本次请求已经用过的key（之后不再选取）。
+    被限流的key降速后换key重试。
+    期间发现的超限/无效key立即在key池中下线，避免其他请求再选到；
+    数据库更新先收集起来，请求结束时调用 flush 一次写入。
+    """
+
+    def __init__(self, search_type: str, max_attempts: int, budget: float):
+        self.search_type = search_type
+        self.max_attempts = max_attempts
+        self.deadline = time.monotonic() + budget
+        self.attempts = 0
+        self.tried: Set[int] = set()
+        self.exhausted: List[int] = []
+        self.invalid: Dict[int, str] = {}
+        # 被限流的最近一次上游响应，重试用尽时原样返回
+        self.throttled = None
+        # 各阶段累计耗时(秒)
+        self.timings: Dict[str, float] = {'key_selection': 0.0, 'upstream': 0.0}
+
+    def remaining(self) -> float:
+        """剩余的时间预算(秒)"""
+        return max(0.0, self.deadline - time.monotonic())
+
+    def can_retry(self) -> bool:
+        return self.attempts < self.max_attempts and self.remaining() > 0
+
+    def add_timing(self, stage: str, seconds: float):
+        """累计某个阶段的耗时"""
+        self.timings[stage] += seconds
+
+    @contextmanager
+    def timed(self, stage: str):
+        """累计 with 块的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(stage, time.perf_counter() - start)
+
+    def finish(self, result):
+        """在最终结果上记录尝试次数和各阶段耗时"""
+        result.attempts = self.attempts
+        result.timings = dict(self.timings)
+        return result
+
+    def start(self, key: PooledKey):
+        """开始用 key 进行一次尝试"""
+        self.attempts += 1
+        self.tried.add(key.id)
+
+    def mark_exhausted(self, key: PooledKey):
+        """key的当日额度已用完"""
+        key_pool.mark_exhausted(key.id, self.search_type)
+        self.exhausted.append(key.id)
+
+    def mark_invalid(self, key: PooledKey, reason: str):
+        """key已失效，需要永久禁用"""
+        key_pool.remove(key.id)
+        self.invalid[key.id] = reason
+        logger.warning(f"Key {key.masked_key} is invalid, reason: {reason}")
+
+    def mark_throttled(self, key: PooledKey, result):
+        """key被上游限流，降速后换key重试"""
+        KeyManager.report_throttle(key.id, self.search_type)
+        self.throttled = result
+
+    @property
+    def pending(self) -> bool:
+        return bool(self.exhausted or self.invalid)
+
+    def flush(self):
+        """把收集到的key状态变化一次写入数据库（需要应用上下文）"""
+        if not self.pending:
+            return
+        KeyManager.apply_key_failures(self.search_type, self.exhausted, self.invalid)
+        self.exhausted, self.invalid = [], {}
@@ -0,0 +1,331 @@
+import gzip
+import json
+import re
+import time
+from functools import partial
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import requests
+from flask import Response, current_app, jsonify
+from app.core.extensions import upstream_pool, upstream_client, response_cache, request_coalescer, metrics
+from app.core.logger import logger
+from app.services.key_manager import KeyManager
+from app.services.response_cache import ResponseCache
+from app.services.retry_plan import RetryPlan
+from app.utils.http_client import HttpClientError
+
+# 搜索服务的端点映射
+SEARCH_ENDPOINTS = {
+    'v3/place/text': 'keyword',      # 关键字搜索
+    'v3/place/around': 'around',     # 周边搜索
+    'v3/place/polygon': 'polygon'    # 多边形搜索
+}
+
+# 高德返回的瞬时限流错误（计入key的熔断统计）
+THROTTLE_INFOS = ('EXCEEDED_THE_LIMIT', 'ACCESS_TOO_FREQUENT')
+
+# 高德响应顶层的 info / infocode 字段
+INFO_FIELD = re.compile(rb'"(info|infocode)"\s*:\s*"([^"\\]*)"')
+# 只在响应开头的这些字节内查找
+PEEK_BYTES = 1024
+
+# 原样转发上游响应内容时附带的上游响应头（Content-Type、Content-Encoding 单独处理，其余为逐跳头或由本服务生成）
+RELAYED_HEADERS = ('Cache-Control', 'Expires')
+
+# 结果来源对应的响应头
+SOURCE_HEADERS = {
+    'cache': ('X-Cache', 'HIT'),
+    'coalesced': ('X-Coalesced', '1')
+}
+
+
+class UpstreamResult:
+    """一次上游调用的结果
+
+    不含任何 Flask 对象，可以在合并的并发请求之间共享。
+    data 不为 None 时以 JSON 返回，否则原样返回 content。
+    attempts 为本次结果向上游尝试的次数（换key重试会增加，缓存命中为0），
+    key_id 为产生该结果的key，timings 为各阶段累计耗时(秒)：key_selection / upstream。
+    原样转发上游响应时，upstream_headers 为要附带的上游响应头（见 RELAYED_HEADERS），
+    content_encoding 为上游响应的压缩方式（content 已由HTTP客户端解压）。
+    """
+
+    def __init__(self, status: int, data: dict = None, content: bytes = None,
+                 content_type: str = 'application/json', attempts: int = 0, key_id: int = None,
+                 upstream_headers: List[Tuple[str, str]] = None, content_encoding: str = None):
+        self.status = status
+        self.data = data
+        self.content = content
+        self.content_type = content_type
+        self.attempts = attempts
+        self.key_id = key_id
+        self.upstream_headers = upstream_headers or []
+        self.content_encoding = content_encoding
+        self.timings: Dict[str, float] = {}
+
+    def to_response(self, source: str = 'upstream', accept_encoding: str = ''):
+        if self.data is not None:
+            response = jsonify(self.data)
+            response.status_code = self.status
+        else:
+            content, encoding = self.encoded_content(accept_encoding)
+            response = Response(content, status=self.status, content_type=self.content_type)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        for name, value in self.headers(source):
+            response.headers[name] = value
+        return response
+
+    def headers(self, source: str = 'upstream') -> List[Tuple[str, str]]:
+        """附加的响应头（结果来源、上游尝试次数和转发的上游响应头）"""
+        headers = []
+        if source in SOURCE_HEADERS:
+            headers.append(SOURCE_HEADERS[source])
+        if self.attempts:
+            headers.append(('X-Attempts', str(self.attempts)))
+        if self.data is None:
+            headers.extend(self.upstream_headers)
+            if self.content_encoding == 'gzip':
+                headers.append(('Vary', 'Accept-Encoding'))
+        return headers
+
+    def encoded_content(self, accept_encoding: str = '') -> Tuple[bytes, Optional[str]]:
+        """原样转发的内容和 Content-Encoding：上游以 gzip 返回且客户端接受 gzip 时重新压缩"""
+        if self.content_encoding == 'gzip' and 'gzip' in accept_encoding:
+            return gzip.compress(self.content, compresslevel=1, mtime=0), 'gzip'
+        return self.content, None
+
+    def body(self, accept_encoding: str = '') -> Tuple[bytes, str, Optional[str]]:
+        """响应内容、content-type 和 Content-Encoding（不依赖 Flask，供异步网关使用）"""
+        if self.data is not None:
+            return json.dumps(self.data, ensure_ascii=False).encode('utf-8'), 'application/json', None
+        content, encoding = self.encoded_content(accept_encoding)
+        return content, self.content_type, encoding
+
+    def json(self):
+        """解析后的响应内容（非JSON时返回文本）"""
+        if self.data is not None:
+            return self.data
+        try:
+            return json.loads(self.content)
+        except ValueError:
+            return self.content.decode('utf-8', errors='replace')
+
+
+def peek_info(content: bytes) -> Tuple[str, str]:
+    """不解析整个响应，读取顶层的 (infocode, info)
+
+    高德把 status/count/info/infocode 放在 pois 等嵌套内容之前，只在第一个嵌套的
+    [ 或 { 之前查找，不会误读POI里的同名字段；找不到时退回完整解析。
+    """
+    head = content[:PEEK_BYTES]
+    nested = [pos for pos in (head.find(b'[', 1), head.find(b'{', 1)) if pos != -1]
+    if nested:
+        head = head[:min(nested)]
+    fields = {name: value for name, value in INFO_FIELD.findall(head)}
+    if b'infocode' in fields and b'info' in fields:
+        return fields[b'infocode'].decode('utf-8'), fields[b'info'].decode('utf-8')
+    result = json.loads(content)
+    return result.get('infocode'), result.get('info', '')
+
+
+class ResponseOutcome:
+    """handle_response 的结果
+
+    result 为要返回的结果，为 None 时需要换key重试；consumed 为是否消耗了预占的额度。
+    actions 为还要依次执行的 (函数, 参数, 类别)，类别为 'ledger'（额度账本和key状态）
+    或 'cache'（响应缓存），异步网关据此决定是否放到线程中执行。
+    """
+
+    def __init__(self, result: Optional[UpstreamResult], consumed: bool = False,
+                 actions: List[Tuple[Callable, tuple, str]] = None):
+        self.result = result
+        self.consumed = consumed
+        self.actions = actions or []
+
+
+def upstream_failed(key, search_type: str, elapsed: float, error: Exception):
+    """上游请求出错（连接失败、超时等）时记录到key的熔断统计和指标"""
+    KeyManager.report_result(key.id, False, elapsed, error=type(error).__name__)
+    metrics.upstream_responses.inc(search_type, 'error')
+
+
+def handle_response(search_type: str, key, plan: RetryPlan, cache_key: Optional[str], status: int,
+                    content: bytes, headers, elapsed: float, passthrough: bool) -> ResponseOutcome:
+    """处理一次上游响应：记录耗时和指标，判断成功、换key重试或直接返回错误
+
+    同步接口（SearchClient）和异步网关（AsyncProxy）共用，只有发送请求的方式不同。
+    headers 为上游响应头（不区分大小写的 .get）。原样返回上游内容时（错误响应和 passthrough）
+    同时转发上游的状态码、content-type、压缩方式和 RELAYED_HEADERS。
+    本身不访问数据库和磁盘，这些操作放在返回的 actions 中由调用方执行。
+    """
+    content_type = headers.get('content-type', 'application/json')
+
+    def relay(relay_status: int) -> UpstreamResult:
+        return UpstreamResult(relay_status, content=content, content_type=content_type, key_id=key.id,
+                              upstream_headers=[(name, headers.get(name)) for name in RELAYED_HEADERS
+                                                if headers.get(name)],
+                              content_encoding=headers.get('content-encoding'))
+
+    plan.add_timing('upstream', elapsed)
+    KeyManager.record_latency(key.id, elapsed)
+    metrics.stage_seconds.observe(elapsed, 'upstream', search_type)
+    metrics.upstream_seconds.observe(elapsed, key.id, search_type)
+
+    if status != 200:
+        metrics.upstream_responses.inc(search_type, f"HTTP_{status}")
+        if status >= 500:
+            KeyManager.report_result(key.id, False, elapsed, error=f"HTTP {status}")
+        return ResponseOutcome(relay(status))
+
+    infocode, info = peek_info(content)
+    metrics.upstream_responses.inc(search_type, infocode)
+    if infocode == '10000':
+        # 增加对应搜索服务的使用次数
+        logger.info(f"Incrementing usage for {search_type} search")
+        KeyManager.report_result(key.id, True, elapsed)
+        actions = [(KeyManager.increment_usage, (key.id, search_type), 'ledger')]
+        if cache_key:
+            actions.append((response_cache.put, (cache_key, search_type, content, content_type), 'cache'))
+        if passthrough:
+            # 原样转发上游的响应内容
+            result = relay(200)
+        else:
+            result = UpstreamResult(200, data=json.loads(content), key_id=key.id)
+        return ResponseOutcome(result, consumed=True, actions=actions)
+
+    if 'DAILY_QUERY_OVER_LIMIT' in info:
+        # 标记key对应服务超出限额，换key重试
+        return ResponseOutcome(None, actions=[(plan.mark_exhausted, (key,), 'ledger')])
+    if 'INVALID_USER_KEY' in info:
+        # 禁用无效key，换key重试
+        return ResponseOutcome(None, actions=[(plan.mark_invalid, (key, info), 'ledger')])
+    result = relay(400)
+    if any(code in info for code in THROTTLE_INFOS):
+        # 限流计为失败，降低该key的速度后换key重试
+        KeyManager.report_result(key.id, False, elapsed, error=info)
+        plan.mark_throttled(key, result)
+        return ResponseOutcome(None)
+    # 其他错误多为请求参数问题，不影响key的健康状态
+    KeyManager.report_result(key.id, True, elapsed)
+    return ResponseOutcome(result)
+
+
+def give_up(plan: RetryPlan, info: str) -> UpstreamResult:
+    """没有key可用或重试用尽时的响应：有被限流的上游响应则原样返回，否则返回503"""
+    if plan.throttled is not None:
+        return plan.finish(plan.throttled)
+    return plan.finish(UpstreamResult(503, data={
+        'status': '0',
+        'info': info,
+        'info_code': '1008611'
+    }))
+
+
+class SearchClient:
+    """高德搜索的服务层入口
+
+    依次尝试缓存、合并中的相同请求和上游，负责选key、换key重试和额度记录，
+    不依赖请求上下文（只需要应用上下文），/amap 代理接口、批量接口和多边形任务共用。
+    """
+
+    @staticmethod
+    def search(endpoint: str, params: Iterable[Tuple[str, str]],
+               use_cache: bool = True) -> Tuple[UpstreamResult, str]:
+        """搜索一次
+
+        Args:
+            endpoint: SEARCH_ENDPOINTS 中的端点，如 v3/place/polygon
+            params: 查询参数（不含key）
+            use_cache: 为 False 时跳过缓存读取（结果仍会写入缓存）
+        Returns:
+            (结果, 来源) 来源为 cache / coalesced / upstream
+        """
+        search_type = SEARCH_ENDPOINTS.get(endpoint)
+        if not search_type:
+            raise ValueError(f'Invalid endpoint: {endpoint}')
+        params = list(params)
+        request_key = ResponseCache.make_key(endpoint, params)
+
+        # 相同查询命中缓存时直接返回，不占用key额度
+        cache_key = None
+        if response_cache.enabled:
+            cache_key = request_key
+            if use_cache:
+                cached = response_cache.get(cache_key)
+                if cached:
+                    body, content_type = cached
+                    return UpstreamResult(200, content=body, content_type=content_type), 'cache'
+
+        forward = partial(SearchClient._forward, endpoint, search_type, dict(params), cache_key)
+        if request_coalescer.enabled:
+            # 并发的相同查询只向上游发送一次
+            result, shared = request_coalescer.do(request_key, forward)
+            return result, 'coalesced' if shared else 'upstream'
+        return forward(), 'upstream'
+
+    @staticmethod
+    def _forward(endpoint: str, search_type: str, args: dict, cache_key: str = None) -> UpstreamResult:
+        """选取key并请求上游
+
+        key超限、无效或被限流时换一个本次请求还没用过的key重试，尝试次数和总耗时受
+        RETRY_MAX_ATTEMPTS、RETRY_BUDGET 限制；期间发现的超限/无效key在请求结束时一次写入数据库。
+        """
+        plan = RetryPlan(search_type, current_app.config['RETRY_MAX_ATTEMPTS'],
+                         current_app.config['RETRY_BUDGET'])
+        try:
+            while True:
+                # 获取可用的key（已预占一次额度）
+                with metrics.stage_seconds.time('key_selection', search_type), plan.timed('key_selection'):
+                    key = KeyManager.get_available_key(search_type, exclude=plan.tried, max_wait=plan.remaining())
+                if not key:
+                    return give_up(plan, f'No available API key for {search_type} search')
+                plan.start(key)
+                result = SearchClient._attempt(endpoint, search_type, args, cache_key, key, plan)
+                if result is not None:
+                    if plan.attempts > 1:
+                        logger.info(f"{search_type} search finished after {plan.attempts} attempts")
+                    return plan.finish(result)
+                if not plan.can_retry():
+                    logger.warning(f"{search_type} search gave up after {plan.attempts} attempts")
+                    return give_up(plan, f'Retry limit reached for {search_type} search after {plan.attempts} attempts')
+        finally:
+            plan.flush()
+
+    @staticmethod
+    def _attempt(endpoint: str, search_type: str, args: dict, cache_key: Optional[str],
+                 key, plan: RetryPlan) -> Optional[UpstreamResult]:
+        """用指定的key请求一次上游，key超限、无效或被限流需要换key时返回 None"""
+        logger.info(f"Searching for {search_type} in {endpoint}, using key {key.masked_key},params: {args}")
+
+        # 未成功消耗额度时需要退还预占
+        consumed = False
+        try:
+            # 构建请求URL和参数
+            url = f"{current_app.config['AMAP_BASE_URL']}/{endpoint}"
+            params = dict(args)
+            params['key'] = key.key
+
+            # 通过长连接池发送请求（代理设置在连接池初始化时读取）
+            timeout = current_app.config['REQUEST_TIMEOUT'] / 1000  # 转换为秒
+            start_time = time.time()
+            try:
+                if upstream_client.enabled:
+                    # 直连最快的上游IP，跳过DNS解析
+                    response = upstream_client.get(f"/{endpoint}", params=params, timeout=timeout,
+                                                   retries=current_app.config['UPSTREAM_RETRIES'])
+                else:
+                    response = upstream_pool.get(url, params=params, timeout=timeout)
+            except (requests.RequestException, HttpClientError) as e:
+                upstream_failed(key, search_type, time.time() - start_time, e)
+                raise
+            outcome = handle_response(search_type, key, plan, cache_key, response.status_code, response.content,
+                                      response.headers, time.time() - start_time,
+                                      current_app.config['PROXY_PASSTHROUGH'])
+            for func, action_args, kind in outcome.actions:
+                func(*action_args)
+                if kind == 'ledger':
+                    consumed = outcome.consumed
+            return outcome.result
+        finally:
+            if not consumed:
+                KeyManager.release_key(key.id, search_type)
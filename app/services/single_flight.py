@@ -0,0 +1,86 @@
+import threading
+from typing import Any, Callable, Dict, Tuple
+from app.core.config import Config
+from app.core.logger import logger
+
+
+class _Call:
+    """一次进行中的调用"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """合并并发的相同请求
+
+    同一个键同时只有一个线程（leader）真正执行，其余线程等待并共享它的结果；
+    leader 抛出的异常同样传给所有等待者。等待超过 max_wait 秒的线程不再等待，
+    自行执行一次。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self.enabled = Config.COALESCE_ENABLED
+        self.max_wait = Config.COALESCE_MAX_WAIT
+        self.stats = {
+            'leaders': 0,
+            'shared': 0,
+            'timeouts': 0
+        }
+
+    def init_app(self, app):
+        """读取应用配置"""
+        self.enabled = app.config.get('COALESCE_ENABLED', self.enabled)
+        self.max_wait = app.config.get('COALESCE_MAX_WAIT', self.max_wait)
+
+    def do(self, key: str, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """执行或加入对 key 的调用
+
+        Returns:
+            (结果, 是否共享了其他线程的结果)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats['leaders'] += 1
+            else:
+                call.waiters += 1
+
+        if leader:
+            try:
+                call.result = func()
+                return call.result, False
+            except Exception as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.done.set()
+
+        if not call.done.wait(self.max_wait):
+            with self._lock:
+                self.stats['timeouts'] += 1
+            logger.warning(f"等待相同请求超时({self.max_wait}s), 改为单独请求: {key}")
+            return func(), False
+
+        with self._lock:
+            self.stats['shared'] += 1
+        if call.error is not None:
+            raise call.error
+        return call.result, True
+
+    def get_stats(self) -> Dict:
+        """合并统计"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['in_flight'] = len(self._calls)
+        stats['enabled'] = self.enabled
+        return stats
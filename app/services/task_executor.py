@@ -29,7 +29,7 @@ class TaskExecutor:
             self.stop_flag = False
             self.workers = []
             self.stop_tasks_flag = False
-            self.semaphore = threading.Semaphore(5)
+            self.semaphore = threading.Semaphore(self.max_workers)
             
             # 启动工作线程
             for _ in range(self.max_workers):
@@ -102,7 +102,7 @@ class TaskExecutor:
     
     def get_active_tasks_count(self) -> int:
         """获取当前活动的任务数"""
-        return 3 - self.semaphore._value
+        return self.max_workers - self.semaphore._value
     
     def shutdown(self):
         """关闭任务执行器"""
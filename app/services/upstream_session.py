@@ -0,0 +1,137 @@
+import socket
+import threading
+from typing import Dict, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.connection import HTTPConnection
+from app.core.config import Config
+from app.core.logger import logger
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """为直连和代理连接都加上 TCP keep-alive 选项的 HTTPAdapter"""
+
+    def __init__(self, socket_options=None, **kwargs):
+        self.socket_options = socket_options
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.socket_options:
+            kwargs['socket_options'] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        if self.socket_options:
+            proxy_kwargs['socket_options'] = self.socket_options
+        return super().proxy_manager_for(proxy, **proxy_kwargs)
+
+
+class UpstreamSessionPool:
+    """访问高德上游的长连接池
+
+    每个线程持有自己的 requests.Session（cookie等状态互不影响），
+    所有 Session 挂载同一个 HTTPAdapter，因此共享底层的 keep-alive 连接池。
+    代理设置在初始化时读取一次，启用代理时 HTTPS 请求通过 CONNECT 隧道转发。
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._adapter: Optional[HTTPAdapter] = None
+        self.proxies: Optional[Dict[str, str]] = None
+        self.verify = False
+
+    def init_app(self, app):
+        """按应用配置创建连接池"""
+        proxies = None
+        if app.config.get('PROXY_ENABLED'):
+            proxies = {
+                'http': app.config.get('HTTP_PROXY'),
+                'https': app.config.get('HTTPS_PROXY')
+            }
+        self.configure(
+            pool_size=app.config.get('UPSTREAM_POOL_SIZE', Config.UPSTREAM_POOL_SIZE),
+            retries=app.config.get('UPSTREAM_RETRIES', Config.UPSTREAM_RETRIES),
+            keepalive_idle=app.config.get('UPSTREAM_KEEPALIVE_IDLE', Config.UPSTREAM_KEEPALIVE_IDLE),
+            proxies=proxies
+        )
+
+    def configure(self, pool_size: int = 10, retries: int = 1, keepalive_idle: int = 60,
+                  proxies: Optional[Dict[str, str]] = None, verify: bool = False):
+        """创建（或重建）共享连接池
+
+        Args:
+            pool_size: 每个目标主机最多保持的连接数，应不小于worker的线程数
+            retries: 连接失败或连接被重置时的重试次数（只对GET重试）
+            keepalive_idle: TCP keep-alive 探测前的空闲秒数，0表示不开启
+            proxies: requests 格式的代理设置
+            verify: 是否校验上游证书
+        """
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=0,
+            other=0,
+            allowed_methods=frozenset(['GET']),
+            backoff_factor=0.1,
+            raise_on_status=False
+        )
+        socket_options = None
+        if keepalive_idle:
+            socket_options = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+            if hasattr(socket, 'TCP_KEEPIDLE'):
+                socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, int(keepalive_idle)))
+        # pool_connections 为缓存的目标主机数（高德上游和代理服务器）
+        adapter = KeepAliveAdapter(
+            socket_options=socket_options,
+            pool_connections=4,
+            pool_maxsize=pool_size,
+            max_retries=retry
+        )
+
+        with self._lock:
+            old_adapter = self._adapter
+            self._adapter = adapter
+            self.proxies = proxies
+            self.verify = verify
+            # 让各线程在下次请求时重新创建 Session
+            self._local = threading.local()
+        if old_adapter is not None:
+            old_adapter.close()
+        logger.info(f"上游连接池已创建, 连接数: {pool_size}, 重试: {retries}, 代理: {'开启' if proxies else '关闭'}")
+
+    def session(self) -> requests.Session:
+        """当前线程的 Session"""
+        local = self._local
+        session = getattr(local, 'session', None)
+        if session is None:
+            if self._adapter is None:
+                self.configure(
+                    pool_size=Config.UPSTREAM_POOL_SIZE,
+                    retries=Config.UPSTREAM_RETRIES,
+                    keepalive_idle=Config.UPSTREAM_KEEPALIVE_IDLE
+                )
+                local = self._local
+            session = requests.Session()
+            session.mount('http://', self._adapter)
+            session.mount('https://', self._adapter)
+            if self.proxies:
+                session.proxies.update(self.proxies)
+            local.session = session
+        return session
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """通过连接池发送GET请求"""
+        # verify 需要逐次传入，否则会被 REQUESTS_CA_BUNDLE 等环境变量覆盖
+        kwargs.setdefault('verify', self.verify)
+        return self.session().get(url, **kwargs)
+
+    def close(self):
+        """关闭所有连接"""
+        with self._lock:
+            if self._adapter is not None:
+                self._adapter.close()
+                self._adapter = None
+            self._local = threading.local()
@@ -0,0 +1,121 @@
+import atexit
+import threading
+from typing import Dict, Tuple
+from app.models.api_key import APIKey
+from app.core.database import db
+from app.core.logger import logger
+from app.core.config import Config
+
+# 搜索类型对应的使用次数字段
+USAGE_COLUMNS = {
+    'keyword': APIKey.keyword_search_used,
+    'around': APIKey.around_search_used,
+    'polygon': APIKey.polygon_search_used
+}
+
+
+class UsageRecorder:
+    """使用次数的延迟写入器
+
+    请求线程只在内存中累加，后台线程定期（或累积到一定次数时）
+    以 used = used + delta 的方式批量写回数据库，进程退出时也会写回。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[int, str], int] = {}
+        self._pending_count = 0
+        self._flush_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._app = None
+        self.flush_interval = Config.USAGE_FLUSH_INTERVAL
+        self.flush_threshold = Config.USAGE_FLUSH_THRESHOLD
+
+    def init_app(self, app):
+        """启动后台写回线程"""
+        self._app = app
+        self.flush_interval = app.config.get('USAGE_FLUSH_INTERVAL', self.flush_interval)
+        self.flush_threshold = app.config.get('USAGE_FLUSH_THRESHOLD', self.flush_threshold)
+
+        if self._thread is None or not self._thread.is_alive():
+            self._stop_event.clear()
+            self._thread = threading.Thread(
+                target=self._run,
+                name="UsageRecorder-Flush",
+                daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.shutdown)
+
+    def record(self, key_id: int, search_type: str, delta: int = 1):
+        """记录一次使用"""
+        with self._lock:
+            bucket = (key_id, search_type)
+            self._pending[bucket] = self._pending.get(bucket, 0) + delta
+            self._pending_count += delta
+            if self._pending_count >= self.flush_threshold:
+                self._flush_event.set()
+
+    def pending_count(self) -> int:
+        """尚未写回的使用次数"""
+        with self._lock:
+            return self._pending_count
+
+    def _run(self):
+        """后台写回循环"""
+        while not self._stop_event.is_set():
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            self.flush_in_context()
+
+    def flush_in_context(self):
+        """在应用上下文中写回"""
+        if self._app is None:
+            return
+        with self._app.app_context():
+            self.flush()
+
+    def flush(self) -> int:
+        """将累积的使用次数写回数据库（需要在应用上下文中调用）
+
+        Returns:
+            写回的使用次数
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._pending_count = 0
+        if not pending:
+            return 0
+
+        try:
+            for (key_id, search_type), delta in pending.items():
+                column = USAGE_COLUMNS[search_type]
+                APIKey.query.filter(APIKey.id == key_id).update(
+                    {column: column + delta},
+                    synchronize_session=False
+                )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"写回key使用次数失败: {str(e)}")
+            # 放回队列等待下次写回
+            with self._lock:
+                for bucket, delta in pending.items():
+                    self._pending[bucket] = self._pending.get(bucket, 0) + delta
+                    self._pending_count += delta
+            return 0
+
+        total = sum(pending.values())
+        logger.debug(f"已写回 {total} 次key使用记录")
+        return total
+
+    def shutdown(self):
+        """停止后台线程并写回剩余记录"""
+        self._stop_event.set()
+        self._flush_event.set()
+        try:
+            self.flush_in_context()
+        except Exception as e:
+            logger.error(f"退出时写回key使用次数失败: {str(e)}")
@@ -1,141 +1,356 @@
 import http.client
 import json
-import ssl
+import random
 import socket
-from typing import Dict, Optional, Tuple, Any, Union
-from urllib.parse import urlencode
-from app.core.logger import logger
+import ssl
+import threading
 import time
+import zlib
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+from app.core.config import Config
+from app.core.logger import logger
+
+# 复用的空闲连接可能已被服务端关闭，出现这些异常时换一个新连接重试一次
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                           ConnectionResetError, BrokenPipeError)
+
+
+class HttpClientError(IOError):
+    """所有上游IP都请求失败"""
 
-class ProxyHTTPSConnection(http.client.HTTPSConnection):
-    """支持代理的HTTPS连接"""
-    
-    def __init__(self, host, port=None, timeout=None, context=None):
+
+class PinnedHTTPSConnection(http.client.HTTPSConnection):
+    """连接到指定IP（可经代理 CONNECT 隧道）的HTTPS连接，TLS握手使用域名作为SNI"""
+
+    def __init__(self, host, port=None, timeout=None, context=None, server_hostname=None):
         super().__init__(host, port, timeout=timeout, context=context)
-        # 保存原始目标信息
-        self._real_host = host
-        self._real_port = port
-    
+        self.server_hostname = server_hostname
+
     def connect(self):
-        """建立代理连接"""
-        # 创建到代理服务器的socket
-        sock = socket.create_connection((self._real_host, self._real_port), self.timeout)
-        
-        if self._tunnel_host:
-            self.sock = sock
-            self._tunnel()
-        
-        # 包装SSL
-        self.sock = self._context.wrap_socket(sock, server_hostname=self._real_host)
+        # 建立TCP连接（有代理时完成隧道），再包装SSL
+        http.client.HTTPConnection.connect(self)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = self._context.wrap_socket(self.sock, server_hostname=self.server_hostname or self.host)
+
+
+class HttpResponse:
+    """一次请求的响应（接口与 requests.Response 的常用部分一致）"""
+
+    def __init__(self, status_code: int, headers, content: bytes, elapsed: float, ip: str):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.elapsed = elapsed
+        self.ip = ip
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+
+class UpstreamIP:
+    """一个上游IP的连接池和延迟统计"""
+
+    def __init__(self, ip: str):
+        self.ip = ip
+        self.idle: Deque[Tuple[http.client.HTTPConnection, float]] = deque()
+        self.latency: Optional[float] = None
+        self.requests = 0
+        self.failures = 0
+        self.down_until = 0.0
+
+    def record(self, seconds: float, alpha: float):
+        self.requests += 1
+        self.latency = seconds if self.latency is None else alpha * seconds + (1 - alpha) * self.latency
+
+    def snapshot(self, now: float) -> Dict:
+        return {
+            'ip': self.ip,
+            'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+            'requests': self.requests,
+            'failures': self.failures,
+            'healthy': self.down_until <= now,
+            'idle_connections': len(self.idle)
+        }
+
 
 class HttpClient:
-    """HTTP客户端工具类"""
-    
-    def __init__(
-        self, 
-        timeout: int = 5,
-        use_ssl: bool = True,
-        verify_ssl: bool = False
-    ):
+    """固定IP的上游HTTP客户端
+
+    把上游域名解析出的多个IP（或配置的IP列表）分别维护持久连接，请求时跳过DNS，
+    复用已完成TCP/TLS握手的连接。按指数加权平均延迟选择最快的健康IP，
+    失败的IP隔离 cooldown 秒；少量请求随机发往其他IP以刷新它们的延迟。
+    启用代理时通过 CONNECT 隧道连接到目标IP。
+    """
+
+    # 延迟的指数加权系数
+    ALPHA = 0.2
+    # 随机探测其他IP的请求比例
+    EXPLORE_RATE = 0.05
+    # 空闲连接超过这个秒数后不再复用
+    IDLE_TIMEOUT = 30
+
+    def __init__(self, timeout: float = 5, use_ssl: bool = True, verify_ssl: bool = False):
+        self._lock = threading.Lock()
         self.timeout = timeout
         self.use_ssl = use_ssl
-        self.verify_ssl = verify_ssl
-        
-        if self.use_ssl:
+        self.enabled = False
+        self.host: Optional[str] = None
+        self.port = 443 if use_ssl else 80
+        self.base_path = ''
+        self.static_ips: List[str] = []
+        self.pool_size = 10
+        self.cooldown = 30.0
+        self.resolve_interval = 300.0
+        self.proxy: Optional[Tuple[str, int]] = None
+        self._ips: Dict[str, UpstreamIP] = {}
+        self._resolved_at = 0.0
+
+        if verify_ssl:
+            self.ssl_context = ssl.create_default_context()
+        else:
             self.ssl_context = ssl._create_unverified_context()
             self.ssl_context.check_hostname = False
             self.ssl_context.verify_mode = ssl.CERT_NONE
-        
-    def request(
-        self,
-        method: str,
-        ip: str,
-        host: str,
-        path: str,
-        port: int = 443,
-        params: Optional[Dict] = None,
-        headers: Optional[Dict] = None,
-        body: Any = None,
-        parse_json: bool = True,
-        proxy: Optional[Dict[str, Union[str, int]]] = None  # 代理配置
-    ) -> Tuple[Union[Dict, bytes], float]:
-        try:
-            url = path
-            if params:
-                url = f"{path}?{urlencode(params)}"
-            
-            default_headers = {
-                'Host': host,
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                'Accept': 'text/html,application/json',
-                'Connection': 'keep-alive'
-            }
-            if headers:
-                default_headers.update(headers)
-            
-            # 创建连接
-            if self.use_ssl:
-                if proxy:
-                    # 使用代理的HTTPS连接
-                    conn = ProxyHTTPSConnection(
-                        proxy['host'],
-                        proxy['port'],
-                        timeout=self.timeout,
-                        context=self.ssl_context
-                    )
-                    # 设置实际目标
-                    conn._tunnel_host = ip
-                    conn._tunnel_port = port
-                else:
-                    # 直接HTTPS连接
-                    conn = http.client.HTTPSConnection(
-                        ip,
-                        port,
-                        timeout=self.timeout,
-                        context=self.ssl_context
-                    )
-            else:
-                if proxy:
-                    conn = http.client.HTTPConnection(
-                        proxy['host'],
-                        proxy['port'],
-                        timeout=self.timeout
-                    )
-                else:
-                    conn = http.client.HTTPConnection(
-                        ip,
-                        port,
-                        timeout=self.timeout
-                    )
-            
-            logger.debug(f"Request: {method} {'https' if self.use_ssl else 'http'}://{ip}:{port}{url}")
-            logger.debug(f"Host Header: {host}")
-            logger.debug(f"Headers: {default_headers}")
+
+    def init_app(self, app):
+        """按应用配置初始化（UPSTREAM_IP_PINNING 关闭时不使用）"""
+        proxy = None
+        if app.config.get('PROXY_ENABLED'):
+            proxy = app.config.get('HTTPS_PROXY') or app.config.get('HTTP_PROXY')
+        ips = app.config.get('UPSTREAM_IPS', Config.UPSTREAM_IPS)
+        self.configure(
+            base_url=app.config.get('AMAP_BASE_URL'),
+            enabled=app.config.get('UPSTREAM_IP_PINNING', Config.UPSTREAM_IP_PINNING),
+            ips=[ip.strip() for ip in ips.split(',') if ip.strip()] if ips else [],
+            pool_size=app.config.get('UPSTREAM_POOL_SIZE', Config.UPSTREAM_POOL_SIZE),
+            cooldown=app.config.get('UPSTREAM_IP_COOLDOWN', Config.UPSTREAM_IP_COOLDOWN),
+            resolve_interval=app.config.get('UPSTREAM_RESOLVE_INTERVAL', Config.UPSTREAM_RESOLVE_INTERVAL),
+            proxy=proxy
+        )
+
+    def configure(self, base_url: Optional[str], enabled: bool = True, ips: Optional[List[str]] = None,
+                  pool_size: int = 10, cooldown: float = 30, resolve_interval: float = 300,
+                  proxy: Optional[str] = None):
+        """设置上游地址
+
+        Args:
+            base_url: 上游地址，如 https://restapi.amap.com
+            ips: 固定使用的IP列表，为空时解析域名
+            pool_size: 每个IP最多保留的空闲连接数
+            cooldown: 请求失败的IP的隔离秒数
+            resolve_interval: 重新解析域名的间隔(秒)
+            proxy: 代理地址，如 http://127.0.0.1:10809
+        """
+        parts = urlsplit(base_url or '')
+        self.close()
+        with self._lock:
+            self.enabled = enabled and bool(parts.hostname)
+            self.host = parts.hostname
+            self.use_ssl = parts.scheme != 'http'
+            self.port = parts.port or (443 if self.use_ssl else 80)
+            self.base_path = parts.path.rstrip('/')
+            self.static_ips = list(ips or [])
+            self.pool_size = pool_size
+            self.cooldown = cooldown
+            self.resolve_interval = resolve_interval
+            self.proxy = None
             if proxy:
-                logger.debug(f"Using proxy: {proxy['host']}:{proxy['port']}")
-            
-            start_time = time.time()
-            conn.request(method, url, body, default_headers)
-            
-            response = conn.getresponse()
-            response_data = response.read()
-            response_time = time.time() - start_time
-            
-            logger.debug(f"Response Status: {response.status}")
-            logger.debug(f"Response Time: {response_time:.3f}s")
-            
+                proxy_parts = urlsplit(proxy)
+                self.proxy = (proxy_parts.hostname, proxy_parts.port or 80)
+            self._ips = {}
+            self._resolved_at = 0.0
+        if self.enabled:
+            self.resolve()
+            logger.info(f"上游固定IP连接池已启用, {self.host}: {', '.join(self._ips) or '无可用IP'}, "
+                        f"代理: {'开启' if self.proxy else '关闭'}")
+
+    def resolve(self):
+        """解析上游域名，合并到IP列表（已有IP的连接和统计保留）"""
+        ips = list(self.static_ips)
+        if not ips:
+            try:
+                # 只取IPv4地址（CONNECT隧道和Host拼接不处理IPv6格式）
+                infos = socket.getaddrinfo(self.host, self.port, family=socket.AF_INET, type=socket.SOCK_STREAM)
+                ips = list(dict.fromkeys(info[4][0] for info in infos))
+            except OSError as e:
+                logger.warning(f"解析上游域名 {self.host} 失败: {str(e)}")
+        with self._lock:
+            self._resolved_at = time.monotonic()
+            if not ips:
+                return
+            for ip in ips:
+                self._ips.setdefault(ip, UpstreamIP(ip))
+            for ip in list(self._ips):
+                if ip not in ips:
+                    self._close_idle(self._ips.pop(ip))
+
+    def _choose(self, exclude: List[str]) -> Optional[UpstreamIP]:
+        """选择延迟最低的健康IP（需要持有锁）"""
+        now = time.monotonic()
+        candidates = [ip for name, ip in self._ips.items() if name not in exclude]
+        if not candidates:
+            return None
+        healthy = [ip for ip in candidates if ip.down_until <= now]
+        if not healthy:
+            # 全部隔离时选最早恢复的
+            return min(candidates, key=lambda ip: ip.down_until)
+        # 还没有延迟数据的IP优先
+        unmeasured = [ip for ip in healthy if ip.latency is None]
+        if unmeasured:
+            return random.choice(unmeasured)
+        if len(healthy) > 1 and random.random() < self.EXPLORE_RATE:
+            return random.choice(healthy)
+        return min(healthy, key=lambda ip: ip.latency)
+
+    def _new_connection(self, ip: str, timeout: float) -> http.client.HTTPConnection:
+        if self.proxy:
+            host, port = self.proxy
+        else:
+            host, port = ip, self.port
+        if self.use_ssl:
+            conn = PinnedHTTPSConnection(host, port, timeout=timeout, context=self.ssl_context,
+                                         server_hostname=self.host)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        if self.proxy:
+            conn.set_tunnel(ip, self.port)
+        return conn
+
+    def _acquire(self, upstream: UpstreamIP, timeout: float) -> Tuple[http.client.HTTPConnection, bool]:
+        """取一个空闲连接，没有时新建，返回 (连接, 是否复用)"""
+        now = time.monotonic()
+        with self._lock:
+            while upstream.idle:
+                conn, idle_since = upstream.idle.pop()
+                if now - idle_since < self.IDLE_TIMEOUT:
+                    conn.timeout = timeout
+                    if conn.sock is not None:
+                        conn.sock.settimeout(timeout)
+                    return conn, True
+                conn.close()
+        return self._new_connection(upstream.ip, timeout), False
+
+    def _release(self, upstream: UpstreamIP, conn: http.client.HTTPConnection):
+        with self._lock:
+            if upstream.ip in self._ips and len(upstream.idle) < self.pool_size:
+                upstream.idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    @staticmethod
+    def _close_idle(upstream: UpstreamIP):
+        while upstream.idle:
+            upstream.idle.pop()[0].close()
+
+    def _send(self, upstream: UpstreamIP, method: str, url: str, body: Any,
+              headers: Dict[str, str], timeout: float) -> HttpResponse:
+        """在一个IP上发送请求，复用的连接已失效时用新连接重试一次"""
+        conn, reused = self._acquire(upstream, timeout)
+        while True:
+            try:
+                if conn.sock is None:
+                    # 连接（和TLS握手）不计入延迟统计
+                    conn.connect()
+                start_time = time.monotonic()
+                conn.request(method, url, body, headers)
+                response = conn.getresponse()
+                content = response.read()
+                elapsed = time.monotonic() - start_time
+                break
+            except STALE_CONNECTION_ERRORS:
+                conn.close()
+                if not reused:
+                    raise
+                conn, reused = self._new_connection(upstream.ip, timeout), False
+            except Exception:
+                conn.close()
+                raise
+
+        if response.will_close:
             conn.close()
-            
-            if parse_json:
-                try:
-                    result = json.loads(response_data.decode('utf-8'))
-                    return result, response_time
-                except json.JSONDecodeError:
-                    return response_data, response_time
-            else:
-                return response_data, response_time
-            
-        except Exception as e:
-            logger.error(f"Request failed: {str(e)}")
-            raise
-          
\ No newline at end of file
+        else:
+            self._release(upstream, conn)
+        if response.getheader('Content-Encoding') == 'gzip':
+            content = zlib.decompress(content, 16 + zlib.MAX_WBITS)
+        return HttpResponse(response.status, response.headers, content, elapsed, upstream.ip)
+
+    def request(self, method: str, path: str, params: Optional[Dict] = None,
+                headers: Optional[Dict] = None, body: Any = None,
+                timeout: Optional[float] = None, retries: int = 1) -> HttpResponse:
+        """向上游发送请求
+
+        Args:
+            path: 请求路径（相对 base_url）
+            retries: 请求失败时换IP重试的次数
+        """
+        if time.monotonic() - self._resolved_at > self.resolve_interval:
+            self.resolve()
+
+        url = f"{self.base_path}{path}"
+        if params:
+            url = f"{url}?{urlencode(params)}"
+        request_headers = {
+            'Host': self.host if self.port in (80, 443) else f"{self.host}:{self.port}",
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+            'Accept': 'text/html,application/json',
+            'Accept-Encoding': 'gzip',
+            'Connection': 'keep-alive'
+        }
+        if headers:
+            request_headers.update(headers)
+
+        tried: List[str] = []
+        last_error: Optional[Exception] = None
+        for _ in range(retries + 1):
+            with self._lock:
+                upstream = self._choose(tried)
+            if upstream is None:
+                break
+            tried.append(upstream.ip)
+            try:
+                response = self._send(upstream, method, url, body, request_headers, timeout or self.timeout)
+            except (OSError, http.client.HTTPException) as e:
+                last_error = e
+                with self._lock:
+                    upstream.failures += 1
+                    upstream.down_until = time.monotonic() + self.cooldown
+                    self._close_idle(upstream)
+                logger.warning(f"上游IP {upstream.ip} 请求失败, 隔离{self.cooldown}秒: {type(e).__name__}: {str(e)}")
+                continue
+
+            with self._lock:
+                upstream.record(response.elapsed, self.ALPHA)
+                if response.status_code >= 500:
+                    upstream.failures += 1
+                else:
+                    upstream.down_until = 0.0
+            return response
+
+        raise HttpClientError(f"请求上游 {self.host} 失败(尝试IP: {', '.join(tried) or '无'}): {last_error}")
+
+    def get(self, path: str, params: Optional[Dict] = None, timeout: Optional[float] = None,
+            retries: int = 1) -> HttpResponse:
+        """发送GET请求"""
+        return self.request('GET', path, params=params, timeout=timeout, retries=retries)
+
+    def get_stats(self) -> Dict:
+        """各上游IP的延迟和健康状态"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'host': self.host,
+                'proxy': f"{self.proxy[0]}:{self.proxy[1]}" if self.proxy else None,
+                'ips': sorted(
+                    (ip.snapshot(now) for ip in self._ips.values()),
+                    key=lambda item: (item['latency_ms'] is None, item['latency_ms'] or 0)
+                )
+            }
+
+    def close(self):
+        """关闭所有空闲连接"""
+        with self._lock:
+            for upstream in self._ips.values():
+                self._close_idle(upstream)
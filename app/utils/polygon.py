@@ -0,0 +1,95 @@
+from typing import List, Sequence, Tuple
+
+# 经纬度坐标 (lng, lat)
+Point = Tuple[float, float]
+# 矩形 (min_lng, min_lat, max_lng, max_lat)
+Box = Tuple[float, float, float, float]
+
+
+def parse_polygon(text: str) -> List[Point]:
+    """解析高德 polygon 参数（lng,lat|lng,lat|...）
+
+    只有两个点时按矩形的对角处理；去掉与首点相同的尾点。
+    """
+    points = [tuple(float(value) for value in pair.split(',')) for pair in text.split('|') if pair]
+    if len(points) == 2:
+        (x1, y1), (x2, y2) = points
+        points = [(x1, y1), (x2, y1), (x2, y2), (x1, y2)]
+    if len(points) > 1 and points[0] == points[-1]:
+        points = points[:-1]
+    return points
+
+
+def format_polygon(points: Sequence[Point]) -> str:
+    """格式化为高德 polygon 参数（首尾闭合，保留6位小数）"""
+    closed = list(points) + [points[0]]
+    return '|'.join(f'{x:.6f},{y:.6f}' for x, y in closed)
+
+
+def bounding_box(points: Sequence[Point]) -> Box:
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _at_x(a: Point, b: Point, x: float) -> Point:
+    t = (x - a[0]) / (b[0] - a[0])
+    return x, a[1] + t * (b[1] - a[1])
+
+
+def _at_y(a: Point, b: Point, y: float) -> Point:
+    t = (y - a[1]) / (b[1] - a[1])
+    return a[0] + t * (b[0] - a[0]), y
+
+
+def clip_to_box(points: Sequence[Point], box: Box) -> List[Point]:
+    """把多边形裁剪到矩形内（Sutherland-Hodgman），与矩形不相交时返回空列表"""
+    min_x, min_y, max_x, max_y = box
+    edges = (
+        (lambda p: p[0] >= min_x, lambda a, b: _at_x(a, b, min_x)),
+        (lambda p: p[0] <= max_x, lambda a, b: _at_x(a, b, max_x)),
+        (lambda p: p[1] >= min_y, lambda a, b: _at_y(a, b, min_y)),
+        (lambda p: p[1] <= max_y, lambda a, b: _at_y(a, b, max_y)),
+    )
+    output = list(points)
+    for inside, intersect in edges:
+        if not output:
+            break
+        subject, output = output, []
+        previous = subject[-1]
+        for current in subject:
+            if inside(current):
+                if not inside(previous):
+                    output.append(intersect(previous, current))
+                output.append(current)
+            elif inside(previous):
+                output.append(intersect(previous, current))
+            previous = current
+    # 去掉相邻的重复点
+    clipped = [point for index, point in enumerate(output) if index == 0 or point != output[index - 1]]
+    if len(clipped) > 1 and clipped[0] == clipped[-1]:
+        clipped.pop()
+    return clipped if len(clipped) >= 3 else []
+
+
+def split_quadrants(points: Sequence[Point]) -> List[List[Point]]:
+    """按外接矩形的中线切成四块，顺序为西南、东南、西北、东北；与多边形不相交的块为空列表"""
+    min_x, min_y, max_x, max_y = bounding_box(points)
+    mid_x, mid_y = (min_x + max_x) / 2, (min_y + max_y) / 2
+    boxes = (
+        (min_x, min_y, mid_x, mid_y),
+        (mid_x, min_y, max_x, mid_y),
+        (min_x, mid_y, mid_x, max_y),
+        (mid_x, mid_y, max_x, max_y),
+    )
+    return [clip_to_box(points, box) for box in boxes]
+
+
+def sub_region(points: Sequence[Point], path: Sequence[int]) -> List[Point]:
+    """按四分路径（每级为 split_quadrants 的下标）取子区域，不存在时返回空列表"""
+    region = list(points)
+    for index in path:
+        if not region:
+            break
+        region = split_quadrants(region)[index]
+    return region
@@ -0,0 +1,103 @@
+"""key选择策略基准测试
+
+模拟多个worker进程共享一批key：每个worker只在同步时看到真实使用量，
+其他应用也在消耗同一批key的额度。统计每1万次请求中因key实际已超额
+而浪费的上游调用次数（对应 DAILY_QUERY_OVER_LIMIT），以及平均上游延迟。
+
+运行: python benchmarks/bench_key_strategies.py
+"""
+import os
+import random
+import statistics
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DB_PASS', '')
+os.environ.setdefault('REQUEST_TIMEOUT', '180000')
+
+from app.services.key_strategies import STRATEGIES, get_strategy  # noqa: E402
+
+SEARCH_TYPE = 'polygon'
+REQUESTS = 10000
+KEYS = 40
+LIMIT = 400
+WORKERS = 4
+SYNC_EVERY = 200        # 每个worker每处理多少次请求与数据库同步一次
+EXTERNAL_RATE = 0.15    # 每次请求期间其他应用消耗额度的概率
+SEEDS = 20
+
+
+class SimKey:
+    """worker视角下的key"""
+
+    def __init__(self, key_id, limit):
+        self.id = key_id
+        self.search_limits = {SEARCH_TYPE: limit}
+        self.used = {SEARCH_TYPE: 0}
+        self.reserved = {SEARCH_TYPE: 0}
+        self.latency = None
+
+    def remaining(self, search_type):
+        return self.search_limits[search_type] - self.used[search_type] - self.reserved[search_type]
+
+
+def run(strategy_name, seed):
+    rng = random.Random(seed)
+    random.seed(seed)
+    true_used = [0] * KEYS
+    # 部分key被其他应用共用
+    shared = [rng.random() < 0.3 for _ in range(KEYS)]
+    base_latency = [rng.uniform(0.03, 0.3) for _ in range(KEYS)]
+    views = [[SimKey(i, LIMIT) for i in range(KEYS)] for _ in range(WORKERS)]
+    strategies = [get_strategy(strategy_name) for _ in range(WORKERS)]
+
+    wasted = served = failed = 0
+    latencies = []
+    for n in range(REQUESTS):
+        if rng.random() < EXTERNAL_RATE:
+            victims = [i for i in range(KEYS) if shared[i] and true_used[i] < LIMIT]
+            if victims:
+                true_used[rng.choice(victims)] += 1
+
+        worker = n % WORKERS
+        view = views[worker]
+        if n // WORKERS % SYNC_EVERY == 0:
+            for key in view:
+                key.used[SEARCH_TYPE] = max(key.used[SEARCH_TYPE], true_used[key.id])
+
+        while True:
+            candidates = [key for key in view if key.remaining(SEARCH_TYPE) > 0]
+            if not candidates:
+                failed += 1
+                break
+            key = strategies[worker].select(candidates, SEARCH_TYPE)
+            latency = rng.expovariate(1 / base_latency[key.id])
+            latencies.append(latency)
+            key.latency = latency if key.latency is None else 0.2 * latency + 0.8 * key.latency
+            if true_used[key.id] >= LIMIT:
+                # 上游返回超限，标记后重试
+                wasted += 1
+                key.used[SEARCH_TYPE] = LIMIT
+                continue
+            true_used[key.id] += 1
+            key.used[SEARCH_TYPE] += 1
+            served += 1
+            break
+
+    return wasted, served, failed, statistics.mean(latencies)
+
+
+def main():
+    print(f"{REQUESTS} requests, {KEYS} keys x {LIMIT}, {WORKERS} workers, sync every {SYNC_EVERY}, {SEEDS} seeds")
+    print(f"{'strategy':<20}{'wasted/10k':>12}{'served':>10}{'no key':>10}{'mean latency':>15}")
+    for name in STRATEGIES:
+        results = [run(name, seed) for seed in range(SEEDS)]
+        wasted = statistics.mean(r[0] for r in results) * 10000 / REQUESTS
+        served = statistics.mean(r[1] for r in results)
+        failed = statistics.mean(r[2] for r in results)
+        latency = statistics.mean(r[3] for r in results)
+        print(f"{name:<20}{wasted:>12.1f}{served:>10.0f}{failed:>10.0f}{latency * 1000:>13.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
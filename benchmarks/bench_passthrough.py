@@ -0,0 +1,86 @@
+"""成功响应转发方式基准测试
+
+对一页25个完整POI（extensions=all）的多边形搜索结果，比较解析后用 jsonify 重新序列化
+与只读取 infocode 后原样转发两种方式的单次耗时和内存峰值。
+
+运行: python benchmarks/bench_passthrough.py
+"""
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DB_PASS', '')
+os.environ.setdefault('REQUEST_TIMEOUT', '180000')
+
+from app.services.search_client import UpstreamResult, peek_info  # noqa: E402
+
+ROUNDS = 2000
+POI = {
+    'id': 'B0FFG1234A', 'parent': [], 'childtype': [], 'name': '某某购物中心', 'type': '购物服务;商场;购物中心',
+    'typecode': '060101', 'biz_type': [], 'address': '某某路1号', 'location': '116.481028,39.989643',
+    'tel': '010-12345678', 'postcode': [], 'website': [], 'email': [], 'pcode': '110000', 'pname': '北京市',
+    'citycode': '010', 'cityname': '北京市', 'adcode': '110105', 'adname': '朝阳区', 'importance': [],
+    'shopid': [], 'shopinfo': '0', 'poiweight': [], 'gridcode': '5916736922', 'distance': [],
+    'navi_poiid': 'J50F001020_123456', 'entr_location': '116.480816,39.990001', 'business_area': '望京',
+    'exit_location': [], 'match': '0', 'recommend': '3', 'timestamp': [], 'alias': [], 'indoor_map': '1',
+    'indoor_data': {'cpid': 'B0FFG1234A', 'floor': [], 'truefloor': [], 'cmsid': []}, 'groupbuy_num': '0',
+    'discount_num': '0', 'biz_ext': {'rating': '4.6', 'cost': [], 'meal_ordering': '0'}, 'event': [],
+    'children': [], 'photos': [
+        {'title': [], 'url': f'http://store.is.autonavi.com/showpic/{i:032x}'} for i in range(3)
+    ]
+}
+PAYLOAD = json.dumps({
+    'status': '1', 'count': '893', 'info': 'OK', 'infocode': '10000', 'suggestion': {'keywords': [], 'cities': []},
+    'pois': [dict(POI, id=f'B0FFG{i:05d}') for i in range(25)]
+}, ensure_ascii=False).encode('utf-8')
+
+
+def reserialize(app):
+    with app.app_context():
+        result = json.loads(PAYLOAD)
+        if result.get('infocode') == '10000':
+            return UpstreamResult(200, data=result).to_response().get_data()
+
+
+def passthrough(app):
+    with app.app_context():
+        infocode, _ = peek_info(PAYLOAD)
+        if infocode == '10000':
+            return UpstreamResult(200, content=PAYLOAD).to_response().get_data()
+
+
+def measure(func, app):
+    latencies = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        func(app)
+        latencies.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func(app)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    latencies.sort()
+    return (
+        statistics.mean(latencies) * 1e6,
+        latencies[int(len(latencies) * 0.99)] * 1e6,
+        peak / 1024
+    )
+
+
+def main():
+    app = Flask(__name__)
+    print(f"payload {len(PAYLOAD) / 1024:.1f}KB, {ROUNDS} rounds")
+    print(f"{'mode':<14}{'mean':>10}{'p99':>10}{'peak mem':>12}")
+    for name, func in (('reserialize', reserialize), ('passthrough', passthrough)):
+        mean, p99, peak = measure(func, app)
+        print(f"{name:<14}{mean:>8.0f}us{p99:>8.0f}us{peak:>10.0f}KB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""多边形任务结果写入基准测试
+
+多个任务并发写各自的结果文件，每个任务写 PAGES 页（每页25个POI）。
+比较原来每页重新计算目录、makedirs、检查文件是否存在并以追加方式打开文件的写法，
+与整个任务只打开一次文件、在提交进度时写入缓冲的 ResultWriter
+（每页提交一次；以及并发抓取时一次写入多个连续页后才提交的情况，按每4页提交一次模拟）。
+写系统调用次数读取自 /proc/self/io（非 Linux 时不显示）。
+
+运行: python benchmarks/bench_result_writer.py
+"""
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DB_PASS', '')
+os.environ.setdefault('REQUEST_TIMEOUT', '180000')
+
+from app.services import result_writer  # noqa: E402
+from app.services.result_writer import CSV_HEADER, ResultWriter  # noqa: E402
+
+PAGES = 400
+TASK_COUNTS = (1, 4, 16)
+POI = {
+    'id': 'B0FFG1234A', 'name': '某某购物中心', 'type': '购物服务;商场;购物中心', 'typecode': '060101',
+    'address': '某某路1号', 'location': '116.481028,39.989643', 'tel': '010-12345678',
+    'business_area': '望京', 'pname': '北京市', 'cityname': '北京市', 'adname': '朝阳区'
+}
+PAGE = [dict(POI, id=f'B0FFG{i:05d}') for i in range(25)]
+LABELS = ['weight5_购物服务'] * len(PAGE)
+
+
+def reopen_per_page(results_dir: str, filename: str, pois, poi_types):
+    """原来的写法：每页重新打开文件"""
+    os.makedirs(results_dir, exist_ok=True)
+    filepath = os.path.join(results_dir, filename)
+    file_exists = os.path.exists(filepath)
+    with open(filepath, 'a', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        if not file_exists:
+            writer.writerow(CSV_HEADER)
+        for poi, poi_type in zip(pois, poi_types):
+            writer.writerow([
+                poi.get('id', ''), poi.get('name', ''), poi.get('type', ''), poi.get('typecode', ''),
+                poi.get('address', ''), poi.get('location', ''), poi.get('tel', ''),
+                poi.get('business_area', ''), poi_type, poi.get('pname', ''), poi.get('cityname', ''),
+                poi.get('adname', '')
+            ])
+    return os.path.getsize(filepath)
+
+
+def run_reopen(results_dir: str, index: int):
+    for _ in range(PAGES):
+        reopen_per_page(results_dir, f'task{index}_poi.csv', PAGE, LABELS)
+
+
+def run_writer(results_dir: str, index: int, every: int = 1):
+    writer = ResultWriter(f'task{index}_poi.csv')
+    try:
+        for page in range(1, PAGES + 1):
+            writer.write(PAGE, LABELS)
+            if page % every == 0:
+                writer.checkpoint()
+    finally:
+        writer.close()
+
+
+def run_writer_batched(results_dir: str, index: int):
+    run_writer(results_dir, index, 4)
+
+
+def write_syscalls() -> int:
+    try:
+        with open('/proc/self/io') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('syscw'))
+    except OSError:
+        return -1
+
+
+def measure(func, tasks: int):
+    results_dir = tempfile.mkdtemp()
+    result_writer.RESULTS_DIR = results_dir
+    try:
+        threads = [threading.Thread(target=func, args=(results_dir, index)) for index in range(tasks)]
+        syscalls = write_syscalls()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        syscalls = write_syscalls() - syscalls if syscalls >= 0 else None
+        sizes = {os.path.getsize(os.path.join(results_dir, name)) for name in os.listdir(results_dir)}
+        return elapsed, syscalls, sizes
+    finally:
+        shutil.rmtree(results_dir)
+
+
+def main():
+    print(f"{PAGES} pages x 25 POIs per task")
+    print(f"{'tasks':<7}{'mode':<20}{'total':>10}{'per page':>11}{'write calls':>13}{'file opens':>12}")
+    for tasks in TASK_COUNTS:
+        sizes = set()
+        modes = (('reopen per page', run_reopen), ('ResultWriter', run_writer),
+                 ('ResultWriter (x4)', run_writer_batched))
+        for name, func in modes:
+            elapsed, syscalls, file_sizes = measure(func, tasks)
+            sizes |= file_sizes
+            opens = tasks * PAGES if func is run_reopen else tasks
+            print(f"{tasks:<7}{name:<20}{elapsed * 1000:>8.0f}ms{elapsed / (tasks * PAGES) * 1e6:>9.1f}us"
+                  f"{syscalls if syscalls is not None else '-':>13}{opens:>12}")
+        # 各种写法的文件内容长度应一致
+        assert len(sizes) == 1, sizes
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""上游连接池基准测试
+
+在本地启动一个 HTTPS 桩服务（自签名证书，需要 openssl 命令；没有时退回 HTTP），
+对比每次 requests.get 新建连接、UpstreamSessionPool 复用长连接和
+HttpClient 固定IP持久连接时的请求延迟。
+
+运行: python benchmarks/bench_upstream_session.py
+"""
+import json
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DB_PASS', '')
+os.environ.setdefault('REQUEST_TIMEOUT', '180000')
+
+from app.services.upstream_session import UpstreamSessionPool  # noqa: E402
+from app.utils.http_client import HttpClient  # noqa: E402
+
+REQUESTS = 500
+THREADS = 4
+BODY = json.dumps({'status': '1', 'info': 'OK', 'infocode': '10000', 'count': '0', 'pois': []}).encode()
+
+requests.packages.urllib3.disable_warnings()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 响应头和内容一次写出，避免 Nagle 与延迟确认叠加出约40ms的延迟
+    wbufsize = 65536
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json;charset=UTF-8')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    scheme = 'http'
+    directory = tempfile.mkdtemp()
+    cert, key = os.path.join(directory, 'cert.pem'), os.path.join(directory, 'key.pem')
+    try:
+        subprocess.run(
+            ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+             '-subj', '/CN=127.0.0.1', '-keyout', key, '-out', cert],
+            check=True, capture_output=True
+        )
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = 'https'
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"{scheme}://127.0.0.1:{server.server_address[1]}/v3/place/polygon"
+
+
+def measure(get, url):
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(REQUESTS))
+
+    def run():
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            start = time.perf_counter()
+            response = get(url, params={'key': 'bench', 'polygon': '116.4,39.9|116.5,40.0'}, timeout=10)
+            response.json()
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=run) for _ in range(THREADS)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = time.perf_counter() - started
+    latencies.sort()
+    return (
+        statistics.mean(latencies) * 1000,
+        latencies[len(latencies) // 2] * 1000,
+        latencies[int(len(latencies) * 0.99)] * 1000,
+        REQUESTS / total
+    )
+
+
+def main():
+    server, url = start_server()
+    pool = UpstreamSessionPool()
+    pool.configure(pool_size=THREADS)
+    client = HttpClient()
+    base_url, path = url.split('/v3/', 1)
+    client.configure(base_url, pool_size=THREADS)
+    print(f"{REQUESTS} requests, {THREADS} threads, {url.split(':')[0]} stub")
+    print(f"{'client':<16}{'mean':>10}{'p50':>10}{'p99':>10}{'req/s':>10}")
+    for name, get in (
+        ('requests.get', lambda url, **kwargs: requests.get(url, verify=False, **kwargs)),
+        ('session pool', pool.get),
+        ('pinned client', lambda url, **kwargs: client.get(f'/v3/{path}', **kwargs)),
+    ):
+        mean, p50, p99, throughput = measure(get, url)
+        print(f"{name:<16}{mean:>8.2f}ms{p50:>8.2f}ms{p99:>8.2f}ms{throughput:>10.0f}")
+    pool.close()
+    client.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""多worker扩展性基准测试
+
+用 fork 出的多个进程模拟 gunicorn worker，每个进程有自己的 KeyPool 和若干线程。
+每次请求: 预占key -> 模拟上游耗时和响应解析(CPU) -> 确认使用。
+
+吞吐测试: 额度和QPS充足，比较不同worker数下的每秒请求数。
+正确性测试: 额度和QPS紧张，比较 local 账本（各worker各自计数）与 mmap 共享账本下
+放行总数是否超过总额度，以及单个key在任意1秒内的最大放行次数是否超过QPS上限。
+
+运行: python benchmarks/bench_worker_scaling.py
+"""
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DB_PASS', '')
+os.environ.setdefault('REQUEST_TIMEOUT', '180000')
+
+from app.services.key_pool import KeyPool, PooledKey  # noqa: E402
+from app.services.quota_ledger import create_ledger  # noqa: E402
+
+SEARCH_TYPE = 'polygon'
+KEYS = 20
+REQUESTS = 10000        # 所有worker合计发出的请求数
+# (每个key的额度, 每个key的QPS上限)
+THROUGHPUT_LIMITS = (10 ** 6, 10 ** 4)
+STRICT_LIMITS = (200, 20)
+THREADS = 4             # 每个worker的线程数
+UPSTREAM_LATENCY = 0.005
+PAYLOAD = json.dumps({'status': '1', 'count': '25', 'pois': [
+    {'id': f'B0{i:08d}', 'name': f'poi {i}', 'type': '餐饮服务;中餐厅', 'location': '116.48,39.99',
+     'address': '某某路1号', 'tel': '010-12345678', 'biz_ext': {'rating': '4.5', 'cost': '60'}}
+    for i in range(25)
+]}, ensure_ascii=False)
+
+
+def fake_api_key(key_id, limit, qps):
+    return SimpleNamespace(
+        id=key_id, key=f'key{key_id:04d}', masked_key=f'key{key_id:04d}',
+        SEARCH_LIMITS={'keyword': limit, 'around': limit, 'polygon': limit},
+        QPS_LIMITS={'keyword': qps, 'around': qps, 'polygon': qps},
+        last_reset=None, keyword_search_used=0, around_search_used=0, polygon_search_used=0
+    )
+
+
+def worker(ledger_name, path, requests, limits, results):
+    pool = KeyPool()
+    pool.ledger = create_ledger(ledger_name)
+    if ledger_name == 'mmap':
+        pool.ledger.open(path, 1024)
+    pool.rate_limiter.clock = pool.ledger.clock
+    for key_id in range(1, KEYS + 1):
+        pool._keys[key_id] = PooledKey(fake_api_key(key_id, *limits))
+    pool._loaded = True
+
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+    grants = []
+
+    def run():
+        while True:
+            with counter_lock:
+                if next(counter, None) is None:
+                    return
+            while True:
+                key, wait = pool.try_reserve(SEARCH_TYPE)
+                if key or wait <= 0:
+                    break
+                time.sleep(wait)
+            if key is None:
+                continue
+            grants.append((key.id, time.monotonic()))
+            time.sleep(UPSTREAM_LATENCY)
+            json.dumps(json.loads(PAYLOAD), ensure_ascii=False)
+            pool.commit(key.id, SEARCH_TYPE)
+
+    threads = [threading.Thread(target=run) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put(grants)
+
+
+def max_per_second(grants):
+    """单个key在任意1秒窗口内的最大放行次数"""
+    worst = 0
+    by_key = {}
+    for key_id, moment in grants:
+        by_key.setdefault(key_id, []).append(moment)
+    for moments in by_key.values():
+        moments.sort()
+        start = 0
+        for end, moment in enumerate(moments):
+            while moment - moments[start] >= 1:
+                start += 1
+            worst = max(worst, end - start + 1)
+    return worst
+
+
+def run(ledger_name, workers, limits):
+    path = os.path.join(tempfile.mkdtemp(), 'ledger')
+    if ledger_name == 'mmap':
+        ledger = create_ledger('mmap')
+        ledger.open(path, 1024)
+        ledger.reset(datetime.now())
+
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=worker, args=(ledger_name, path, REQUESTS // workers, limits, results))
+        for _ in range(workers)
+    ]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    grants = [grant for _ in processes for grant in results.get()]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+    return len(grants) / elapsed, len(grants), max_per_second(grants)
+
+
+def main():
+    print(f"{KEYS} keys, {REQUESTS} requests, {THREADS} threads/worker, "
+          f"{UPSTREAM_LATENCY * 1000:.0f}ms upstream, {os.cpu_count()} cpus")
+
+    print("\nthroughput (quota and qps not binding)")
+    print(f"{'ledger':<8}{'workers':>8}{'req/s':>10}")
+    for ledger_name in ('local', 'mmap'):
+        for workers in (1, 2, 4, 8):
+            throughput, _, _ = run(ledger_name, workers, THROUGHPUT_LIMITS)
+            print(f"{ledger_name:<8}{workers:>8}{throughput:>10.0f}")
+
+    limit, qps = STRICT_LIMITS
+    print(f"\ncorrectness ({limit} quota/key = {KEYS * limit} total, {qps} qps/key)")
+    print(f"{'ledger':<8}{'workers':>8}{'granted':>10}{'max/s/key':>11}")
+    for ledger_name in ('local', 'mmap'):
+        for workers in (1, 2, 4):
+            _, granted, worst = run(ledger_name, workers, STRICT_LIMITS)
+            print(f"{ledger_name:<8}{workers:>8}{granted:>10}{worst:>11}")
+
+
+if __name__ == '__main__':
+    main()
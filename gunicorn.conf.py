@@ -0,0 +1,20 @@
+import os
+
+# gunicorn 配置，可通过环境变量调整
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', '1'))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+accesslog = '-'
+errorlog = '-'
+
+# 异步网关模式: /amap 搜索接口在事件循环中处理，其他接口仍由 Flask 处理（见 app/asgi.py）
+if os.getenv('ASYNC_GATEWAY', 'false').lower() == 'true':
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    wsgi_app = 'app.asgi:app'
+else:
+    wsgi_app = 'app:create_app()'
+
+# 多个worker之间必须共享额度和QPS计数
+if workers > 1 and os.getenv('QUOTA_LEDGER', 'local') == 'local':
+    raise RuntimeError('GUNICORN_WORKERS > 1 时需要设置 QUOTA_LEDGER=mmap 或 QUOTA_LEDGER=database')
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# 导入 app 包时会读取配置，测试不连接数据库，只需补上没有默认值的必填项
+os.environ.setdefault('DB_PASS', '')
+os.environ.setdefault('REQUEST_TIMEOUT', '5000')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
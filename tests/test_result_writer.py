@@ -0,0 +1,117 @@
+import csv
+import io
+import json
+
+import pytest
+
+from app.services import result_writer
+from app.services.result_writer import RESULT_FORMATS, open_result_writer
+
+# 各格式需要的可选依赖
+DEPENDENCIES = {'csv.zst': 'zstandard', 'ndjson.zst': 'zstandard', 'parquet': 'pyarrow'}
+
+
+def _pois(start, count):
+    return [{'id': f'B{i:06d}', 'name': f'店铺{i}', 'typecode': '050000',
+             'location': f'116.{i:06d},39.{i:06d}', 'pname': '北京市'} for i in range(start, start + count)]
+
+
+def _read(filename):
+    """按格式读出结果文件中的 (id, name, poi_type)"""
+    path = result_writer.result_path(filename)
+    if filename.endswith('.parquet'):
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(path, columns=['id', 'name', 'poi_type'])
+        return list(zip(*(table.column(name).to_pylist() for name in ('id', 'name', 'poi_type'))))
+    codec = RESULT_FORMATS[result_writer.result_format(filename)][1]
+    with open(path, 'rb') as f:
+        data = (codec() if codec else result_writer._Plain()).decompress(f.read())
+    if '.ndjson' in filename:
+        return [(poi['id'], poi['name'], poi['poi_type']) for poi in map(json.loads, data.splitlines())]
+    rows = list(csv.DictReader(io.StringIO(data.decode('utf-8-sig'), newline='')))
+    return [(row['id'], row['name'], row['poi_type']) for row in rows]
+
+
+@pytest.fixture(params=list(RESULT_FORMATS))
+def filename(request, tmp_path, monkeypatch):
+    if request.param in DEPENDENCIES:
+        pytest.importorskip(DEPENDENCIES[request.param])
+    monkeypatch.setattr(result_writer, 'RESULTS_DIR', str(tmp_path))
+    return f'task_poi.{request.param}'
+
+
+def test_round_trip(filename):
+    writer = open_result_writer(filename)
+    writer.write(_pois(0, 3), ['餐饮'] * 3)
+    writer.checkpoint()
+    writer.write(_pois(3, 2), ['购物'] * 2)
+    writer.close()
+
+    expected = [(poi['id'], poi['name'], '餐饮') for poi in _pois(0, 3)]
+    expected += [(poi['id'], poi['name'], '购物') for poi in _pois(3, 2)]
+    assert _read(filename) == expected
+
+    writer = open_result_writer(filename)
+    assert writer.ids(0, writer.size) == {poi['id'] for poi in _pois(0, 5)}
+    writer.close()
+
+
+def test_resume_from_checkpoint(filename):
+    """中断后从最后一次提交的位置继续，提交之后写入的行被截掉"""
+    writer = open_result_writer(filename)
+    writer.write(_pois(0, 3), ['餐饮'] * 3)
+    first = writer.checkpoint()
+    writer.write(_pois(3, 2), ['餐饮'] * 2)
+    committed = writer.checkpoint()
+    writer.write(_pois(5, 4), ['餐饮'] * 4)
+    writer.checkpoint()
+    writer.write(_pois(9, 1), ['餐饮'])
+    # 进程中断：不关闭，最后一次 checkpoint 的进度没有提交
+
+    writer = open_result_writer(filename)
+    assert writer.size >= committed
+    writer.truncate(committed)
+    assert writer.ids(first, committed) == {poi['id'] for poi in _pois(3, 2)}
+    writer.write(_pois(5, 2), ['购物'] * 2)
+    writer.close()
+
+    expected = [(poi['id'], poi['name'], '餐饮') for poi in _pois(0, 5)]
+    expected += [(poi['id'], poi['name'], '购物') for poi in _pois(5, 2)]
+    assert _read(filename) == expected
+
+
+def test_discard_drops_uncommitted_rows(filename):
+    writer = open_result_writer(filename)
+    writer.write(_pois(0, 2), ['餐饮'] * 2)
+    writer.checkpoint()
+    writer.write(_pois(2, 2), ['餐饮'] * 2)
+    writer.discard()
+    writer.close()
+
+    assert [row[0] for row in _read(filename)] == [poi['id'] for poi in _pois(0, 2)]
+
+
+def test_parquet_resume_after_close(tmp_path, monkeypatch):
+    """失败时关闭会合并分片；恢复时截回到原文件之内并继续追加"""
+    pytest.importorskip('pyarrow')
+    monkeypatch.setattr(result_writer, 'RESULTS_DIR', str(tmp_path))
+    writer = open_result_writer('task_poi.parquet')
+    writer.write(_pois(0, 3), ['餐饮'] * 3)
+    committed = writer.checkpoint()
+    writer.write(_pois(3, 2), ['餐饮'] * 2)
+    writer.checkpoint()
+    writer.close()
+    assert not (tmp_path / 'task_poi.parquet.parts').exists()
+
+    writer = open_result_writer('task_poi.parquet')
+    assert writer.size == 5
+    writer.truncate(committed)
+    writer.write(_pois(3, 1), ['购物'])
+    writer.checkpoint()
+
+    writer = open_result_writer('task_poi.parquet')
+    assert writer.size == 4
+    writer.close()
+    expected = [(poi['id'], poi['name'], '餐饮') for poi in _pois(0, 3)]
+    expected += [(poi['id'], poi['name'], '购物') for poi in _pois(3, 1)]
+    assert _read('task_poi.parquet') == expected